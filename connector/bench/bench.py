@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""bench.py
+
+Benchmarks the connector's pipeline with realistic dionaea payloads, one per
+mapping (see payloads/). Every payload is driven through the stages
+
+* ``decode``:    the Receiver's json decoder,
+* ``transform``: Mapper.convert,
+* ``transform_many``: Mapper.transform_many, in batches of BATCH events,
+* ``send``:      Sender.send (via the loopback transport) and
+* ``receive``:   a full POST through the Receiver (Flask test client),
+                 decoding, mapping and sending it.
+
+For every stage and mapping the throughput (events/s), the p50/p99 latency
+and the retained objects per event are reported. Retained objects are the net
+growth of the objects tracked by the garbage collector over the run (the
+outputs and any caches grown), not every allocation: short-lived objects and
+untracked ones (e.g. strings and numbers) are not counted.
+
+Results are appended as json lines to a results file, tagged with the git
+revision, so runs of different versions can be compared (``--compare``).
+
+Usage (from the connector directory)::
+
+    python bench/bench.py [-n EVENTS] [-m MAPPING] [--compare]
+"""
+import standin
+standin.install()  # noqa: E402, must precede the connector imports
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from timeit import default_timer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, os.pardir, "src")
+sys.path.insert(0, SRC)
+
+from mapper import Mapper  # noqa: E402
+from receiver import Receiver  # noqa: E402
+from sender import Sender  # noqa: E402
+from transport import LoopbackTransport  # noqa: E402
+import yaml  # noqa: E402
+
+STAGES = ("decode", "transform", "transform_many", "send", "receive")
+# events per batch of the transform_many stage
+BATCH = 100
+PAYLOADS = os.path.join(HERE, "payloads")
+MAPPINGS = os.path.join(SRC, "mappings", "dionaea")
+RESULTS = os.path.join(HERE, "results.jsonl")
+
+
+def load_payloads(names=None):
+    """Return [(mapping name, raw json body)] of the payloads."""
+    payloads = []
+    for filename in sorted(os.listdir(PAYLOADS)):
+        name, ext = os.path.splitext(filename)
+        if ext != ".json" or (names and name not in names):
+            continue
+        with open(os.path.join(PAYLOADS, filename)) as f:
+            payloads.append((name, json.dumps(json.load(f))))
+    return payloads
+
+
+def load_mappings():
+    """Return the dionaea mappings."""
+    mappings = []
+    for filename in sorted(os.listdir(MAPPINGS)):
+        with open(os.path.join(MAPPINGS, filename)) as f:
+            mappings.append(yaml.load(f))
+    return mappings
+
+
+def percentile(sorted_values, fraction):
+    """Return the *fraction* percentile of *sorted_values*."""
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(func, inputs, batch=1):
+    """Call *func* for every input and return the statistics.
+
+    If every input is a batch of *batch* events, the statistics are per
+    event nonetheless (the latencies are the batch latency divided by
+    *batch*).
+    """
+    latencies = []
+    outputs = []
+    gc.collect()
+    objects = len(gc.get_objects())
+    start = default_timer()
+    for item in inputs:
+        t = default_timer()
+        outputs.append(func(item))
+        latencies.append((default_timer() - t) / batch)
+    total = default_timer() - start
+    events = len(inputs) * batch
+    gc.collect()
+    # the latencies list is an artifact of measuring
+    retained = float(len(gc.get_objects()) - objects - 1) / events
+    latencies.sort()
+    return {"events": events,
+            "events_per_second": events / total,
+            "p50_us": percentile(latencies, 0.5) * 1e6,
+            "p99_us": percentile(latencies, 0.99) * 1e6,
+            "retained_per_event": retained}
+
+
+class Bench(object):
+    """The benchmark of all stages."""
+
+    def __init__(self, events):
+        """Bench(events)
+
+        :param events:  Number of events per stage and mapping. (int)
+        """
+        self.events = events
+        self.mapper = Mapper(load_mappings())
+        self.sender = Sender("127.0.0.1", 9999, "bench-connector",
+                             "honeypot/dionaea/", "bench",
+                             transport=LoopbackTransport(
+                                 slave="bro-slave-127.0.0.1:9998", keep=0))
+        self.receiver = Receiver("bench", "127.0.0.1", 8080)
+        self.receiver.run = lambda **kwargs: None
+        self.receiver.listen("/", self._on_data)
+        self.client = self.receiver.test_client()
+
+    def _on_data(self, data):
+        converter, message = self.mapper.convert(data)
+        if message is not None:
+            self.sender.send(message, converter.key(data))
+
+    def run(self, stage, raw):
+        """Run *stage* with the payload *raw* and return the statistics."""
+        data = self.receiver.decode(raw)
+        if stage == "decode":
+            return measure(self.receiver.decode, [raw] * self.events)
+        if stage == "transform":
+            return measure(self.mapper.transform, [data] * self.events)
+        if stage == "transform_many":
+            batches = max(self.events // BATCH, 1)
+            return measure(self.mapper.transform_many,
+                           [[data] * BATCH] * batches, BATCH)
+        if stage == "send":
+            # send appends the connector id, every event needs its own copy
+            converter = self.mapper.convert(data)[0]
+            if converter is None:
+                raise ValueError("Payload is not mapped.")
+            key = converter.key(data)
+            messages = [(self.mapper.transform(data), key)
+                        for _ in xrange(self.events)]
+            return measure(lambda item: self.sender.send(*item), messages)
+        return measure(
+            lambda body: self.client.post(
+                "/", data=body, content_type="application/json").status_code,
+            [raw] * self.events)
+
+
+def revision():
+    """Return the git revision of the working tree."""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=HERE,
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_results(path):
+    """Return the latest result per (stage, mapping) of previous runs."""
+    latest = {}
+    if not os.path.exists(path):
+        return latest
+    with open(path) as f:
+        for line in f:
+            result = json.loads(line)
+            latest[(result["stage"], result["mapping"])] = result
+    return latest
+
+
+def report(results, previous):
+    """Print the results (and the change to *previous*)."""
+    header = "{:<14} {:<17} {:>11} {:>9} {:>9} {:>11}".format(
+        "stage", "mapping", "events/s", "p50 us", "p99 us", "retained/ev")
+    if previous is not None:
+        header += " {:>8} {:<12}".format("change", "baseline")
+    print(header)
+    for result in results:
+        line = "{:<14} {:<17} {:>11.0f} {:>9.1f} {:>9.1f} {:>11.1f}".format(
+            result["stage"], result["mapping"], result["events_per_second"],
+            result["p50_us"], result["p99_us"], result["retained_per_event"])
+        if previous is not None:
+            base = previous.get((result["stage"], result["mapping"]))
+            if base:
+                line += " {:>+7.1f}% {:<12}".format(
+                    100.0 * (result["events_per_second"] /
+                             base["events_per_second"] - 1),
+                    base["revision"])
+        print(line)
+
+
+def main():
+    """Parse the arguments, run the benchmarks and store the results."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the connector pipeline.")
+    parser.add_argument("-n", "--events", type=int, default=5000,
+                        help="Events per stage and mapping.")
+    parser.add_argument("-m", "--mapping", action="append",
+                        help="Only benchmark this mapping (repeatable).")
+    parser.add_argument("-s", "--stage", action="append", choices=STAGES,
+                        help="Only benchmark this stage (repeatable).")
+    parser.add_argument("--results", default=RESULTS,
+                        help="File to append the results to.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare to the latest stored results.")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Do not store the results.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    previous = load_results(args.results) if args.compare else None
+    bench = Bench(args.events)
+    run = {"revision": revision(),
+           "timestamp": datetime.utcnow().isoformat(),
+           "python": platform.python_version()}
+    results = []
+    for stage in args.stage or STAGES:
+        for name, raw in load_payloads(args.mapping):
+            result = dict(run, stage=stage, mapping=name)
+            result.update(bench.run(stage, raw))
+            results.append(result)
+    report(results, previous)
+
+    if not args.no_store:
+        with open(args.results, "a") as f:
+            for result in results:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""replay.py
+
+Replays recorded dionaea traffic against a running connector. Captures are
+the log.txt files of ``dionaea/logging-dummy.py`` (json messages separated by
+blank lines); newline-delimited json works as well.
+
+Messages are posted at a fixed rate (``--rate``) or a rate ramping linearly
+to ``--ramp-to`` over ``--duration`` seconds, by ``--concurrency`` workers
+with a persistent connection each. The schedule is open-loop: the latency of
+a message is measured from the time it was scheduled, so a connector falling
+behind shows in the latency, instead of silently lowering the rate. With
+``--rate 0`` (and no ramp), messages are posted as fast as the workers take
+them; their latency is that of the request alone.
+
+At the end, the achieved throughput, the responses per status code (or error)
+and the latency percentiles are reported.
+
+Usage::
+
+    python bench/replay.py --rate 100 --ramp-to 2000 --duration 60 --loop
+                           http://localhost:8080/ log.txt
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from errno import errorcode
+import httplib
+from itertools import count, cycle, izip
+from math import sqrt
+from Queue import Queue
+import socket
+from threading import Lock, Thread
+from time import sleep
+from timeit import default_timer
+from urlparse import urlparse
+
+HEADERS = {"Content-Type": "application/json"}
+# messages queued per worker at most, before the schedule waits for them
+BACKLOG = 100
+
+
+def read_captures(paths):
+    """Return the json messages of the capture files."""
+    messages = []
+    for path in paths:
+        with open(path) as f:
+            messages.extend(line.strip() for line in f if line.strip())
+    return messages
+
+
+class Schedule(object):
+    """The send schedule, a fixed or linearly ramping rate."""
+
+    def __init__(self, rate, ramp_to=None, duration=None):
+        """Schedule(rate, ramp_to, duration)
+
+        :param rate:        Messages per second at the start, 0 for as fast as
+                            possible. (float)
+        :param ramp_to:     Messages per second at the end of the duration.
+                            (float)
+        :param duration:    Seconds to ramp over. (float)
+        """
+        self.rate = float(rate)
+        self.ramp_to = None if ramp_to is None or not duration \
+            else float(ramp_to)
+        self.duration = duration
+        # as fast as possible, there are no send times
+        self.unlimited = not self.rate and self.ramp_to is None
+
+    def time_of(self, n):
+        """Return the send time of the *n*-th message or None, if never."""
+        if self.ramp_to is None:
+            return n / self.rate
+        # messages sent within the ramp: rate * t + slope / 2 * t ** 2
+        slope = (self.ramp_to - self.rate) / self.duration
+        ramped = (self.rate + self.ramp_to) / 2 * self.duration
+        if n <= ramped:
+            if not n:
+                return 0.0
+            # the root of the above, stable for any slope (and rate 0)
+            return 2 * n / (self.rate + sqrt(max(self.rate ** 2 +
+                                                 2 * slope * n, 0)))
+        if self.ramp_to <= 0:
+            return None
+        return self.duration + (n - ramped) / self.ramp_to
+
+    def times(self):
+        """Yield the send times, in seconds since the start.
+
+        None is yielded for every message if :attr:`unlimited`, the times
+        end if the rate ramps down to 0.
+        """
+        for n in count():
+            if self.unlimited:
+                yield None
+                continue
+            at = self.time_of(n)
+            if at is None:
+                return
+            yield at
+
+
+class Stats(object):
+    """Thread-safe collection of the outcomes and latencies."""
+
+    def __init__(self):
+        """Initialise empty stats."""
+        self.lock = Lock()
+        self.outcomes = Counter()
+        self.latencies = []
+
+    def record(self, outcome, latency):
+        """Record a response (status or error name) and its latency."""
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.latencies.append(latency)
+
+    def percentile(self, fraction):
+        """Return the *fraction* percentile of the sorted latencies."""
+        index = int(round(fraction * (len(self.latencies) - 1)))
+        return self.latencies[index]
+
+    def report(self, elapsed):
+        """Print the summary of a run of *elapsed* seconds."""
+        self.latencies.sort()
+        count = len(self.latencies)
+        print("sent:        {}".format(count))
+        print("duration:    {:.1f}s".format(elapsed))
+        print("throughput:  {:.1f} msg/s".format(count / elapsed))
+        for outcome, n in sorted(self.outcomes.items()):
+            print("{:<12} {}".format("{}:".format(outcome), n))
+        if count:
+            print("latency:     p50 {:.1f}ms  p90 {:.1f}ms  p99 {:.1f}ms  "
+                  "max {:.1f}ms".format(*(1000 * self.percentile(p)
+                                          for p in (0.5, 0.9, 0.99, 1.0))))
+
+
+class Replay(object):
+    """Posts messages according to a schedule with concurrent workers."""
+
+    def __init__(self, url, schedule, concurrency=8, timeout=10):
+        """Replay(url, schedule, concurrency, timeout)
+
+        :param url:         The connector's url. (str)
+        :param schedule:    The send schedule. (Schedule)
+        :param concurrency: Number of concurrent connections. (int)
+        :param timeout:     Seconds until a request is aborted. (float)
+        """
+        url = urlparse(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path or "/"
+        self.schedule = schedule
+        self.timeout = timeout
+        self.stats = Stats()
+        self.queue = Queue(BACKLOG * concurrency)
+        self.workers = [Thread(target=self._work, name="replay-{}".format(i))
+                        for i in range(concurrency)]
+        for worker in self.workers:
+            worker.daemon = True
+
+    def run(self, messages, duration=None):
+        """Post *messages* (an iterable) until exhausted or *duration*."""
+        for worker in self.workers:
+            worker.start()
+        start = default_timer()
+        try:
+            for message, at in izip(messages, self.schedule.times()):
+                now = default_timer() - start
+                if duration and (now > duration or
+                                 at is not None and at > duration):
+                    break
+                if at is not None and at > now:
+                    sleep(at - now)
+                self.queue.put((None if at is None else start + at, message))
+        except KeyboardInterrupt:
+            print("Interrupted, waiting for pending requests.")
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.stats.report(default_timer() - start)
+
+    def _work(self):
+        """Post queued messages until None is queued."""
+        connection = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            scheduled, message = item
+            if scheduled is None:
+                scheduled = default_timer()
+            try:
+                if connection is None:
+                    connection = httplib.HTTPConnection(
+                        self.host, self.port, timeout=self.timeout)
+                connection.request("POST", self.path, message, HEADERS)
+                response = connection.getresponse()
+                response.read()
+                outcome = response.status
+            except (httplib.HTTPException, socket.error) as e:
+                outcome = errorcode.get(getattr(e, "errno", None),
+                                        e.__class__.__name__)
+                if connection is not None:
+                    connection.close()
+                connection = None
+            self.stats.record(outcome, default_timer() - scheduled)
+
+
+def main():
+    """Parse the arguments and replay the captures."""
+    ap = ArgumentParser(description="Replay recorded dionaea traffic.")
+    ap.add_argument("url", help="The connector's url.")
+    ap.add_argument("captures", nargs="+", metavar="capture",
+                    help="log.txt files of the logging-dummy.")
+    ap.add_argument("--rate", type=float, default=100,
+                    help="Messages per second (at the start), 0 for as fast "
+                         "as possible. Default: 100")
+    ap.add_argument("--ramp-to", type=float, metavar="rate",
+                    help="Messages per second at the end of the duration.")
+    ap.add_argument("--duration", type=float, metavar="seconds",
+                    help="Stop (and reach the ramp rate) after this time.")
+    ap.add_argument("--concurrency", type=int, default=8,
+                    help="Number of concurrent connections. Default: 8")
+    ap.add_argument("--timeout", type=float, default=10,
+                    help="Seconds until a request is aborted. Default: 10")
+    ap.add_argument("--loop", action="store_true",
+                    help="Repeat the captures until the duration is over.")
+    args = ap.parse_args()
+    if args.rate < 0 or args.ramp_to is not None and args.ramp_to < 0:
+        ap.error("rates must not be negative")
+    if args.ramp_to is not None and not args.duration:
+        ap.error("--ramp-to requires --duration")
+    if args.loop and not args.duration:
+        ap.error("--loop requires --duration")
+
+    messages = read_captures(args.captures)
+    if not messages:
+        ap.error("No messages in the captures.")
+    replay = Replay(args.url, Schedule(args.rate, args.ramp_to, args.duration),
+                    args.concurrency, args.timeout)
+    replay.run(cycle(messages) if args.loop else messages, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""standin.py
+
+Provides a local stand-in for the parts of pybroker used by the connector,
+so the benchmarks run without Broker (and without a Bro to peer with).
+Install it via :func:`install` before importing any connector module.
+
+The stand-in keeps the types cheap but not free: data values are wrapped and
+messages are lists. Sending uses the loopback transport, so no endpoints are
+needed. The numbers measured against it are the connector's own overhead,
+not Broker's.
+"""
+import socket
+import sys
+
+
+class address(object):
+    """An IPv4/6 address."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        """Wrap the address string *value*."""
+        self.value = value
+
+    def __str__(self):
+        """Return the address string."""
+        return self.value
+
+
+def address_from_string(value):
+    """Return the address for *value* or None if it is invalid."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+        except (socket.error, ValueError, TypeError):
+            continue
+        return address(value)
+    return None
+
+
+class time_point(object):
+    """A point in time, seconds since the epoch."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        """Wrap the seconds *value*."""
+        self.value = value
+
+
+class vector_of_data(list):
+    """A vector of data."""
+
+
+class data(object):
+    """A typed value."""
+
+    __slots__ = ("value",)
+
+    (tag_boolean, tag_count, tag_integer, tag_real, tag_string, tag_address,
+     tag_subnet, tag_port, tag_time, tag_duration, tag_enum_value, tag_set,
+     tag_table, tag_vector, tag_record) = range(15)
+
+    def __init__(self, value):
+        """Wrap *value*, raise TypeError if Broker would not accept it."""
+        if value is None or isinstance(value, dict):
+            raise TypeError("Unsupported type: {}".format(type(value)))
+        self.value = value
+
+    def which(self):
+        """Return the type tag of the value."""
+        value = self.value
+        if isinstance(value, bool):
+            return self.tag_boolean
+        if isinstance(value, (int, long)):
+            return self.tag_integer
+        if isinstance(value, float):
+            return self.tag_real
+        if isinstance(value, basestring):
+            return self.tag_string
+        if isinstance(value, address):
+            return self.tag_address
+        if isinstance(value, time_point):
+            return self.tag_time
+        return self.tag_vector
+
+    def as_bool(self):
+        """Return the value."""
+        return self.value
+
+    as_count = as_integer = as_real = as_string = as_address = as_time = \
+        as_vector = as_bool
+
+
+class message(list):
+    """A Broker message, a list of data."""
+
+
+def install():
+    """Make this module importable as pybroker."""
+    sys.modules["pybroker"] = sys.modules[__name__]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_replay
+
+Test the send schedule of the load test.
+"""
+from replay import Schedule
+
+import unittest
+from itertools import islice
+
+
+class TestSchedule(unittest.TestCase):
+    """TestCases for replay.Schedule"""
+
+    @staticmethod
+    def times(schedule, n):
+        """Return the first *n* send times of *schedule*"""
+        return list(islice(schedule.times(), n))
+
+    def testSuccessFixedRate(self):
+        """Test messages are spread evenly at a fixed rate"""
+        times = self.times(Schedule(10), 4)
+        for at, expected in zip(times, (0.0, 0.1, 0.2, 0.3)):
+            self.assertAlmostEqual(at, expected)
+
+    def testSuccessUnlimited(self):
+        """Test messages are not scheduled without rate"""
+        schedule = Schedule(0)
+        self.assertTrue(schedule.unlimited)
+        self.assertEqual(self.times(schedule, 3), [None] * 3)
+
+    def testSuccessRampFromZero(self):
+        """Test a ramp starting at rate 0 advances"""
+        times = self.times(Schedule(0, 100, 10), 1000)
+        self.assertEqual(times[0], 0.0)
+        self.assertEqual(times, sorted(set(times)))
+        # the rate reaches 100/s after 10s, 500 messages are sent until then
+        self.assertAlmostEqual(times[1], 0.4472, places=4)
+        self.assertAlmostEqual(times[500], 10.0)
+        self.assertAlmostEqual(times[600], 11.0)
+
+    def testSuccessRampDown(self):
+        """Test a ramp down to rate 0 ends"""
+        times = list(Schedule(10, 0, 2).times())
+        self.assertEqual(len(times), 11)
+        self.assertAlmostEqual(times[-1], 2.0)
+
+    def testSuccessRampMatchesRate(self):
+        """Test the messages of a ramp add up to its mean rate"""
+        schedule = Schedule(100, 300, 5)
+        times = self.times(schedule, 1002)
+        self.assertTrue(times[1000] <= 5.0 < times[1001])
+
+
+if __name__ == '__main__':
+    unittest.main()
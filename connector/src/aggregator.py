@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""aggregator.py
+
+Provides the Aggregator, which collapses repetitive events (e.g. the access
+events of a scan wave) into summary events. Mappings opt in with an
+``aggregate`` key::
+
+    aggregate:
+        key: [src_ip, dst_port, protocol]
+        window: 10
+        name: Beemaster::dionaea_access_summary
+
+The first event of a key opens a window of ``window`` seconds, all further
+events of the key within the window are only counted. Once the window ends,
+a single event is sent as is, otherwise a summary event of the key items
+(as in the first event), the count and the first and last seen time::
+
+    [name, key items..., count, first_seen, last_seen]
+
+The first and last seen time are the ``timestamp`` items of the first and
+last event, or their arrival time if the message has no timestamp. The
+summary event defaults to the mapping's name suffixed with "_summary".
+"""
+import pybroker as pb
+import logging
+from threading import Lock, Thread
+from time import sleep, time
+
+
+class Window(object):
+    """The open aggregation window of a key."""
+
+    __slots__ = ("converter", "message", "key", "started", "count",
+                 "first_seen", "last_seen")
+
+    def __init__(self, converter, message, key, started, seen):
+        """Window(converter, message, key, started, seen)
+
+        :param converter:   The converter of the events. (mapper.Converter)
+        :param message:     The first event. (pybroker.Message)
+        :param key:         The key to balance the events by. (json)
+        :param started:     The arrival time of the first event. (float)
+        :param seen:        The first seen time. (pybroker.data)
+        """
+        self.converter = converter
+        self.message = message
+        self.key = key
+        self.started = started
+        self.count = 1
+        self.first_seen = seen
+        self.last_seen = seen
+
+
+class Aggregator(object):
+    """The aggregator.
+
+    See module description.
+    """
+
+    # seconds between checks for ended windows
+    FLUSH_INTERVAL = 0.5
+    # default upper bound for the number of open windows
+    MAX_KEYS = 10000
+
+    def __init__(self, send, max_keys=MAX_KEYS, metrics=None, clock=time):
+        """Aggregator(send, max_keys, metrics, clock)
+
+        Initialises the Aggregator. Start flushing ended windows in the
+        background via :meth:`start`.
+
+        :param send:        The function to send events and summaries with.
+                            (func(mapper.Converter, pybroker.Message, json))
+        :param max_keys:    Maximum number of open windows, further keys pass
+                            through unaggregated. (int)
+        :param metrics:     The metrics to count aggregated events in.
+                            (metrics.Metrics)
+        :param clock:       The function returning the current time.
+                            (func())
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        self.send = send
+        self.max_keys = max_keys
+        self.metrics = metrics
+        self.clock = clock
+        # (mapping name, key) -> Window
+        self.windows = {}
+        self.lock = Lock()
+
+        self.thread = Thread(target=self._run, name="aggregator-flush")
+        self.thread.daemon = True
+
+    def start(self):
+        """Start flushing ended windows in the background."""
+        self.thread.start()
+
+    def pending(self):
+        """Return the number of open windows."""
+        return len(self.windows)
+
+    def add(self, converter, message, data, key=None):
+        """Aggregate *message*, if its mapping is configured to.
+
+        :param converter:   The converter *message* was mapped with.
+                            (mapper.Converter)
+        :param message:     The mapped event. (pybroker.Message)
+        :param data:        The data *message* was mapped from. (json)
+        :param key:         The key to balance the event by. (json)
+        :returns:           True, if the event was taken over (and must not
+                            be sent). (bool)
+        """
+        if converter.aggregate is None:
+            return False
+        window_key = (converter.name,
+                      tuple(converter.value(item, data)
+                            for item in converter.aggregate))
+        now = self.clock()
+        with self.lock:
+            try:
+                window = self.windows.get(window_key)
+            except TypeError:
+                # unhashable values (e.g. lists) are not aggregated
+                return False
+            if window is None:
+                if len(self.windows) >= self.max_keys:
+                    if self.metrics:
+                        self.metrics.inc("aggregation_overflow",
+                                         mapping=converter.name)
+                    return False
+                self.windows[window_key] = Window(
+                    converter, message, key, now,
+                    self._seen(converter, message, now))
+                return True
+            window.count += 1
+            window.last_seen = self._seen(converter, message, now)
+        if self.metrics:
+            self.metrics.inc("aggregated", mapping=converter.name)
+        return True
+
+    @staticmethod
+    def _seen(converter, message, now):
+        """Return the timestamp of *message* or *now* as Broker data."""
+        if "timestamp" in converter.message:
+            return message[converter.message.index("timestamp") + 1]
+        return pb.data(pb.time_point(now))
+
+    @staticmethod
+    def summarize(window):
+        """Return the event to send for the ended *window*.
+
+        :param window:  The ended window. (Window)
+        :returns:       The single event or the summary. (pybroker.Message)
+        """
+        if window.count == 1:
+            return window.message
+        converter = window.converter
+        summary = pb.message()
+        summary.append(converter.summary)
+        for item in converter.aggregate:
+            summary.append(window.message[converter.message.index(item) + 1])
+        summary.append(pb.data(window.count))
+        summary.append(window.first_seen)
+        summary.append(window.last_seen)
+        return summary
+
+    def flush(self, force=False):
+        """Send the events of all ended windows.
+
+        :param force:   Whether to end all windows right away. (bool)
+        """
+        now = self.clock()
+        ended = []
+        with self.lock:
+            for window_key, window in self.windows.items():
+                if force or \
+                        now - window.started >= window.converter.window:
+                    ended.append(self.windows.pop(window_key))
+        for window in ended:
+            try:
+                self.send(window.converter, self.summarize(window),
+                          window.key)
+            except Exception:
+                self.log.error("Failed to send aggregated events of '{}'."
+                               .format(window.converter.name), exc_info=True)
+
+    def _run(self):
+        """Flush ended windows forever."""
+        while True:
+            sleep(self.FLUSH_INTERVAL)
+            self.flush()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""cache.py
+
+Provides the LRUCache, a bounded and thread-safe least-recently-used cache,
+which counts its hits and misses.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """The LRU cache.
+
+    See module description.
+    """
+
+    def __init__(self, size):
+        """LRUCache(size)
+
+        :param size:    Maximum number of entries, caching is disabled if 0.
+                        (int)
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Return the number of entries."""
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Return the value for *key* (and mark it as recently used)."""
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Set *key* to *value*, evicting the least recently used entry."""
+        if self.size < 1:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+            self.entries[key] = value
@@ -9,21 +9,54 @@ Messages are received via http (default: 0.0.0.0:8080) and sent via broker to
 the peered Bro-instance. The incoming messages are mapped via a matching
 mapping to be properly processed on the other side.
 
+Optionally, received messages are only queued and mapped and sent by a
+dedicated worker (pipeline mode "queue"), so the latency towards the honeypot
+does not depend on the Broker side. The queue has a lane per mapping
+priority; under overload, low priority events are shed first.
+
+Events are optionally filtered before they are mapped, by allow/deny rules on
+their networks, ports and mapping and by sampling, see filters.py.
+
+The mappings are reloaded on SIGHUP (and optionally once the mappings
+directory changes) without interrupting the handling of events, see
+reloader.py.
+
+Repetitive events (e.g. of scan waves) are optionally collapsed into summary
+events per time window, see aggregator.py.
+
+Instead of Broker, messages can be sent via a loopback (discarding them) or
+json lines over TCP sockets (send transport "loopback"/"socket"), e.g. to
+profile the connector without any Bro.
+
+With multiple workers (listen.workers), the connector runs in as many
+processes sharing one listening socket, each with its own mapper and
+endpoints. A supervisor restarts dead workers.
+
 The module can be executed directly.
 """
 from __future__ import with_statement
 
-from receiver import Receiver
-from mapper import Mapper
+from receiver import Receiver, Overloaded
+from reloader import Reloader
+from aggregator import Aggregator
+from cache import LRUCache
+from filters import Filter
+from logs import Lazy, RepeatFilter
+from mapper import Converter, Mapper
+from mappingcache import MappingCache, signature
+from metrics import Metrics
+from pipeline import Pipeline
 from sender import Sender
+from spool import Spool
+from transport import BrokerTransport, LoopbackTransport, SocketTransport
 
 from argparse import ArgumentParser
 import logging
 import os.path
 from os import walk
 import platform
+import signal
 import sys
-import yaml
 
 
 class ConnConfig(dict):
@@ -36,17 +69,87 @@ class ConnConfig(dict):
     DEFAULT_CONFIG = {
         "listen": {
             "address": "0.0.0.0",
-            "port": 8080
+            "port": 8080,
+            # one of Receiver.SERVERS
+            "server": "flask",
+            "threads": 4,
+            "timeout": 30,
+            # one of Receiver.DECODERS
+            "decoder": "json",
+            # number of worker processes sharing the port
+            "workers": 1
         },
         "send": {
             "address": "127.0.0.1",
-            "port": 5000
+            "port": 5000,
+            # seconds between lookups of the slave to send to
+            "slave_refresh": 1.0,
+            # one of Connector.TRANSPORTS
+            "transport": "broker"
         },
         "mappings": "mappings",
+        "mapper": {
+            # number of cached address conversions, 0 disables the cache
+            "address_cache": 1024,
+            # seconds between checks of the mappings directory for changes,
+            # 0 reloads the mappings on SIGHUP only
+            "reload_interval": 0,
+            # file to cache the parsed mappings in, disabled if None
+            "cache": None
+        },
+        "aggregation": {
+            # upper bound for the number of open aggregation windows, events
+            # of further keys are sent unaggregated
+            "max_keys": 10000
+        },
+        "filter": {
+            # policy for events without matching rule, "allow" or "deny"
+            "policy": "allow",
+            # rules of events to pass/reject before mapping, see filters.py
+            "allow": [],
+            "deny": [],
+            # mapping name -> keep only every n-th event
+            "sample": {}
+        },
+        "pipeline": {
+            # "sync" maps and sends within the request, "queue" only queues
+            # and leaves the rest to a worker
+            "mode": "sync",
+            "queue_size": 10000,
+            # per mapping priority, the share of the queue up to which its
+            # events are admitted; lower priorities are shed first
+            "admission": {
+                "high": 1.0,
+                "normal": 0.8,
+                "low": 0.5
+            },
+            # seconds the honeypot is asked to retry rejected events after
+            "retry_after": 1
+        },
         "broker": {
             "topic": "honeypot/dionaea/",
             "endpoint_prefix": "beemaster-connector-"
         },
+        "batch": {
+            # messages per Broker message, batching is disabled if 0
+            "size": 0,
+            # seconds a message waits at most for its batch to fill up
+            "max_latency": 0.5,
+            "event": "Beemaster::connector_batch"
+        },
+        "spool": {
+            # directory to spool messages to while disconnected from Bro,
+            # spooling is disabled if None
+            "directory": None,
+            "segment_size": 1048576,
+            "max_size": 67108864,
+            # spooled messages replayed per second once connected again
+            "replay_rate": 100
+        },
+        "metrics": {
+            # route to serve the metrics on, disabled if None
+            "route": "/metrics"
+        },
         "connector_id": platform.uname()[1],
         "logging": {
             "file": "stderr",
@@ -58,7 +161,9 @@ class ConnConfig(dict):
             # as in https://docs.python.org/2.7/library/
             #           logging.html#logrecord-attributes
             "format":
-                "[ %(asctime)s | %(name)10s | %(levelname)8s ] %(message)s"
+                "[ %(asctime)s | %(name)10s | %(levelname)8s ] %(message)s",
+            # seconds to collapse repeated warnings/errors for, 0 disables it
+            "repeat_interval": 60
         }
     }
 
@@ -102,12 +207,18 @@ class Connector(object):
     """
 
     REQUIRED_KEYS = {"name", "mapping", "message"}
+    PIPELINE_MODES = ("sync", "queue")
+    TRANSPORTS = ("broker", "loopback", "socket")
     RECEIVER_NAME = "bm-connector"
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, worker=None, sock=None):
         """Initialise the Connector and starts to listen to incoming messages.
 
         :param config:      Configuration to use (default config if None).
+        :param worker:      Index of the worker process, to derive unique
+                            endpoint names and spool directories. (int)
+        :param sock:        The listening socket shared by the workers.
+                            (socket.socket)
         """
         self.log = logging.getLogger(self.__class__.__name__)
 
@@ -115,36 +226,140 @@ class Connector(object):
             config = ConnConfig()
             self.log.info("Falling back to default configuration.")
 
+        if config.pipeline.mode not in self.PIPELINE_MODES:
+            raise ValueError("Unknown pipeline mode '{}'."
+                             .format(config.pipeline.mode))
+        if config.send.transport not in self.TRANSPORTS:
+            raise ValueError("Unknown transport '{}'."
+                             .format(config.send.transport))
+
+        self.filter = None
+        if config.filter.allow or config.filter.deny or config.filter.sample:
+            self.filter = Filter(config.filter.allow, config.filter.deny,
+                                 config.filter.policy, config.filter.sample)
+
         # errors up to here are allowed to terminate the program
 
+        self.metrics = Metrics()
+
+        self.mapping_cache = None
+        if config.mapper.cache:
+            self.mapping_cache = MappingCache(config.mapper.cache)
         mappings = self._read_mappings(config.mappings)
-        self.mapper = Mapper(mappings)
+        self.mapper = Mapper(mappings, LRUCache(config.mapper.address_cache))
         self.log.debug("Mappings read.")
 
+        # endpoints (and spools) must be unique per worker
+        suffix = "" if worker is None else "-{}".format(worker)
+
+        spool = None
+        if config.spool.directory:
+            directory = config.spool.directory
+            if worker is not None:
+                directory = os.path.join(directory, str(worker))
+            spool = Spool(directory, config.spool.segment_size,
+                          config.spool.max_size)
+            self.log.info("Spooling to '{}'.".format(directory))
+
+        endpoint = config.broker.endpoint_prefix + config.connector_id + \
+            suffix
         self.sender = Sender(config.send.address, config.send.port,
-                             config.broker.endpoint_prefix +
-                             config.connector_id,
+                             endpoint,
                              config.broker.topic,
-                             config.connector_id)
+                             config.connector_id,
+                             spool, config.spool.replay_rate,
+                             config.send.slave_refresh,
+                             config.batch.size, config.batch.max_latency,
+                             config.batch.event, self.metrics,
+                             self._create_transport(
+                                 config, endpoint,
+                                 config.connector_id + suffix))
         self.log.info("Sender created.")
 
+        self.aggregator = Aggregator(self._send, config.aggregation.max_keys,
+                                     self.metrics)
+        self.aggregator.start()
+
+        self.reloader = Reloader(config.mappings,
+                                 lambda: self._build_mapper(config.mappings),
+                                 self._swap_mapper,
+                                 config.mapper.reload_interval, self.metrics)
+        self.reloader.start()
+        signal.signal(signal.SIGHUP, lambda signum, frame:
+                      self.reloader.trigger())
+
+        self.pipeline = None
+        self.retry_after = config.pipeline.retry_after
+        if config.pipeline.mode == "queue":
+            self.pipeline = Pipeline(
+                self._process, config.pipeline.queue_size,
+                [config.pipeline.admission[priority]
+                 for priority in Converter.PRIORITIES])
+            self.pipeline.start()
+            self.log.info("Pipeline started.")
+
         self.receiver = Receiver(self.RECEIVER_NAME,
-                                 config.listen.address, config.listen.port)
+                                 config.listen.address, config.listen.port,
+                                 config.listen.server, config.listen.threads,
+                                 config.listen.timeout,
+                                 config.listen.decoder, self.metrics, sock)
         self.log.info("Receiver created.")
-        self.receiver.listen("/", self.handle_receive)
+        self._register_gauges()
+        if config.metrics.route:
+            self.receiver.serve_metrics(config.metrics.route)
+        # batches are mapped at once, unless every message is queued
+        self.receiver.listen("/", self.handle_receive,
+                             202 if self.pipeline else 200,
+                             None if self.pipeline else self.handle_batch)
+
+    def _create_transport(self, config, endpoint, slave_endpoint):
+        """Return the configured transport.
+
+        :param config:          The configuration. (ConnConfig)
+        :param endpoint:        Name of the Broker endpoint peering with the
+                                master. (str)
+        :param slave_endpoint:  Name of the Broker endpoint peering with
+                                slaves. (str)
+        """
+        if config.send.transport == "loopback":
+            # messages are counted, but not recorded
+            return LoopbackTransport(keep=0)
+        if config.send.transport == "socket":
+            return SocketTransport(config.send.address, config.send.port)
+        return BrokerTransport(config.send.address, config.send.port,
+                               endpoint, slave_endpoint)
+
+    def _read_mappings(self, location, strict=False):
+        """Read the mappings into a list of dictionaries.
+
+        :param location:    The mappings directory. (str)
+        :param strict:      Whether to fail instead of ignoring invalid
+                            files. (bool)
+        :raises ValueError: If *strict* and a file is invalid.
+        """
+        current = None
+        if self.mapping_cache:
+            current = signature(location)
+            mappings = self.mapping_cache.get(location, current)
+            if mappings is not None:
+                self.log.debug("Using cached mappings.")
+                return mappings
+
+        # deferred, as the cached mappings do not need it
+        import yaml
+        loader = getattr(yaml, "CLoader", yaml.Loader)
 
-    def _read_mappings(self, location):
-        """Read the mappings into a list of dictionaries."""
         # os/fs errors here are allowed to terminate the program
         # yaml parse errors should not crash but log
         mappings = []
+        failures = []
         for root, _, files in walk(location):
             for f in files:
                 filepath = os.path.join(root, f)
                 with open(filepath, "r") as fd:
                     # TODO extract the below block?
                     try:
-                        mp = yaml.load(fd)
+                        mp = yaml.load(fd, Loader=loader)
                         for i in self.REQUIRED_KEYS:
                             if i not in mp:
                                 raise LookupError(i)
@@ -153,22 +368,172 @@ class Connector(object):
                         self.log.error(
                             "Missing key '{}' in file '{}'. Ignoring."
                             .format(e.args[0], filepath))
+                        failures.append(filepath)
                     except Exception:
                         # TODO find correct exception types.
                         self.log.error(
                             "Failed to read mapping in '{}'. Ignoring."
                             .format(filepath))
+                        failures.append(filepath)
+        if strict and failures:
+            raise ValueError("Invalid mapping file(s) '{}'."
+                             .format("', '".join(failures)))
+        if self.mapping_cache and not failures:
+            self.mapping_cache.put(location, current, mappings)
         return mappings
 
+    def _build_mapper(self, location):
+        """Return a new Mapper of the mappings in *location*.
+
+        The address cache of the current mapper is reused.
+
+        :param location:    The mappings directory. (str)
+        :raises ValueError: If a mapping is invalid.
+        """
+        mappings = self._read_mappings(location, strict=True)
+        mapper = Mapper(mappings, self.mapper.addresses)
+        if len(mapper.converters) != len(mappings):
+            raise ValueError("Invalid mapping(s).")
+        return mapper
+
+    def _swap_mapper(self, mapper):
+        """Replace the current mapper with *mapper*."""
+        # a single assignment, events are handled by either mapper
+        self.mapper = mapper
+        self.log.info("Using {} mappings.".format(len(mapper.converters)))
+
     def handle_receive(self, message):
-        """Handle message via mapping.
+        """Handle message via mapping or queue it in pipeline mode.
 
         :param message:     The message to map and send. (json)
+        :raises Overloaded: If the pipeline's queue is full (503) or the
+                            priority of the message is not admitted (429).
+        """
+        converter = None
+        if self.filter is not None or self.pipeline is not None:
+            converter = self.mapper.match(message)
+        if self._filtered(converter, message):
+            return
+        if self.pipeline is None:
+            self._process(message)
+            return
+        if converter is None:
+            # not worth queueing, it would be dropped by the worker anyway
+            self.metrics.inc("unmapped")
+            return
+        priority = converter.priority
+        lane = Converter.PRIORITIES.index(priority)
+        if not self.pipeline.admit(lane):
+            self.metrics.inc("dropped", reason="shed", priority=priority)
+            raise Overloaded(429, self.retry_after)
+        if not self.pipeline.put(message, lane):
+            self.metrics.inc("dropped", reason="queue_full",
+                             priority=priority)
+            raise Overloaded(503, self.retry_after)
+
+    def handle_batch(self, messages):
+        """Map and send a batch of messages at once (not in pipeline mode).
+
+        :param messages:    The messages to map and send. (List[json])
+        :returns:           The error (or None) per message. (List[str])
         """
-        mapped = self.mapper.transform(message)
-        if mapped:
-            self.log.info("Mapped message is '{}'.".format(mapped))
-            self.sender.send(mapped)
+        errors = [None] * len(messages)
+        indices = range(len(messages))
+        if self.filter is not None:
+            indices = [index for index in indices
+                       if not self._filtered(
+                           self.mapper.match(messages[index]),
+                           messages[index])]
+        with self.metrics.timer("transform_batch_seconds"):
+            converted = self.mapper.convert_many([messages[index]
+                                                  for index in indices])
+
+        for index, (converter, mapped) in zip(indices, converted):
+            message = messages[index]
+            if mapped is None:
+                self.metrics.inc("unmapped")
+                continue
+            self.metrics.inc("mapped", mapping=converter.name)
+            self.log.info(Lazy("Mapped message is '{}'.", mapped))
+            try:
+                key = converter.key(message)
+                if not self.aggregator.add(converter, mapped, message, key):
+                    self._send(converter, mapped, key)
+            except Exception as e:
+                self.log.error("Failed to send message.", exc_info=True)
+                errors[index] = str(e)
+        return errors
+
+    def _filtered(self, converter, message):
+        """Return True and count the message, if the filter rejects it.
+
+        :param converter:   The converter to map *message* with, if any.
+                            (mapper.Converter)
+        :param message:     The message. (json)
+        """
+        if self.filter is None:
+            return False
+        reason = self.filter.check(converter, message)
+        if reason is None:
+            return False
+        labels = {"mapping": converter.name} if converter else {}
+        self.metrics.inc("filtered", reason=reason, **labels)
+        return True
+
+    def _process(self, message):
+        """Map and send message.
+
+        :param message:     The message to map and send. (json)
+        """
+        with self.metrics.timer("transform_seconds"):
+            converter, mapped = self.mapper.convert(message)
+        if mapped is None:
+            self.metrics.inc("unmapped")
+            return
+        self.metrics.inc("mapped", mapping=converter.name)
+
+        self.log.info(Lazy("Mapped message is '{}'.", mapped))
+        key = converter.key(message)
+        if self.aggregator.add(converter, mapped, message, key):
+            return
+        self._send(converter, mapped, key)
+
+    def _send(self, converter, mapped, key):
+        """Send a mapped message (or an aggregated summary).
+
+        :param converter:   The converter of the message. (mapper.Converter)
+        :param mapped:      The message to send. (pybroker.Message)
+        :param key:         The key to balance the message by. (json)
+        """
+        # sent, spooled and dropped events are counted by the sender
+        with self.metrics.timer("send_seconds"):
+            self.sender.send(mapped, key, converter.name)
+
+    def _register_gauges(self):
+        """Register the gauges of all components."""
+        metrics = self.metrics
+        if self.pipeline:
+            metrics.gauge("queue_depth", self.pipeline.depth)
+            for lane, priority in enumerate(Converter.PRIORITIES):
+                metrics.gauge("lane_depth",
+                              lambda lane=lane: self.pipeline.depth(lane),
+                              priority=priority)
+        metrics.gauge("connection_established",
+                      lambda: int(self.sender.transport.established(
+                          Sender.MASTER)),
+                      endpoint=Sender.MASTER)
+        metrics.gauge("slaves_peered", lambda: len(self.sender.slaves))
+        metrics.gauge("slaves_established", self.sender.established_slaves)
+        if self.sender.spool:
+            metrics.gauge("spool_pending",
+                          lambda: int(self.sender.spool.pending()))
+        metrics.gauge("batch_depth", self.sender.batch_depth)
+        metrics.gauge("aggregation_windows", self.aggregator.pending)
+        metrics.gauge("mappings", lambda: len(self.mapper.converters))
+        metrics.gauge("address_cache_hits",
+                      lambda: self.mapper.addresses.hits)
+        metrics.gauge("address_cache_misses",
+                      lambda: self.mapper.addresses.misses)
 
 
 def main():
@@ -190,12 +555,47 @@ def main():
     ap.add_argument('--lport', metavar="port",
                     type=int,
                     help="Port to listen on.")
+    ap.add_argument('--server', metavar="backend",
+                    choices=Receiver.SERVERS,
+                    help="Server backend to listen with.")
+    ap.add_argument('--threads', metavar="count",
+                    type=int,
+                    help="Worker threads/greenlets of the server backend.")
+    ap.add_argument('--timeout', metavar="seconds",
+                    type=int,
+                    help="Request timeout of the server backend.")
+    ap.add_argument('--workers', metavar="count",
+                    type=int,
+                    help="Number of worker processes sharing the port.")
+    ap.add_argument('--decoder', metavar="decoder",
+                    choices=sorted(Receiver.DECODERS),
+                    help="JSON decoder to use.")
     # send
     ap.add_argument('--saddr', metavar="address",
                     help="Address to send to.")
     ap.add_argument('--sport', metavar="port",
                     type=int,
                     help="Port to send to.")
+    ap.add_argument('--transport', metavar="transport",
+                    choices=Connector.TRANSPORTS,
+                    help="Send via 'broker', a 'loopback' (discarding "
+                    "messages) or json lines over a TCP 'socket'.")
+    # pipeline
+    ap.add_argument('--pipeline', metavar="mode",
+                    choices=Connector.PIPELINE_MODES,
+                    help="Handle messages within the request ('sync') or "
+                    "queue them for a worker ('queue').")
+    ap.add_argument('--queue-size', metavar="size",
+                    type=int,
+                    help="Maximum number of queued messages.")
+    # batch
+    ap.add_argument('--batch-size', metavar="size",
+                    type=int,
+                    help="Number of messages per Broker message, batching is "
+                    "disabled if 0.")
+    # spool
+    ap.add_argument('--spool', metavar="directory",
+                    help="Directory to spool messages to while disconnected.")
     # mappings
     ap.add_argument('--mappings', metavar="directory",
                     help="Directory to look for mappings.")
@@ -235,15 +635,27 @@ def main():
 
     # update with config-values
     if args.config:
+        import yaml
+        loader = getattr(yaml, "CLoader", yaml.Loader)
         with open(args.config, "r") as conf:
-            config.update(yaml.load(conf))
+            config.update(yaml.load(conf, Loader=loader))
 
     # update config with settings
     argmap = {'laddr': ['listen', 'address'],
               'lport': ['listen', 'port'],
+              'server': ['listen', 'server'],
+              'threads': ['listen', 'threads'],
+              'timeout': ['listen', 'timeout'],
+              'decoder': ['listen', 'decoder'],
+              'workers': ['listen', 'workers'],
               'saddr': ['send', 'address'],
               'sport': ['send', 'port'],
+              'transport': ['send', 'transport'],
+              'batch_size': ['batch', 'size'],
+              'spool': ['spool', 'directory'],
               'mappings': ['mappings'],
+              'pipeline': ['pipeline', 'mode'],
+              'queue_size': ['pipeline', 'queue_size'],
               'topic': ['broker', 'topic'],
               'endpoint_prefix': ['broker', 'endpoint_prefix'],
               'id': ['connector_id'],
@@ -271,10 +683,20 @@ def main():
     else:
         logging_dict['filename'] = config.logging.file
     logging.basicConfig(**logging_dict)
+    if config.logging.repeat_interval:
+        repeat_filter = RepeatFilter(config.logging.repeat_interval)
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(repeat_filter)
     logging.debug("Logging configured.")
 
     # start!
-    Connector(config)
+    if config.listen.workers > 1:
+        from workers import Supervisor, listen_socket
+        sock = listen_socket(config.listen.address, config.listen.port)
+        Supervisor(lambda worker: Connector(config, worker, sock),
+                   config.listen.workers).run()
+    else:
+        Connector(config)
 
 
 if __name__ == '__main__':
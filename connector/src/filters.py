@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""filters.py
+
+Provides the Filter, which rejects events before they are mapped: events of
+known hosts (e.g. our own monitoring or research scanners) by allow/deny
+rules, and a share of the events of noisy mappings by sampling.
+
+Every rule matches events by all of its conditions::
+
+    src: [10.0.0.0/8, 192.168.1.5]      # source networks/addresses
+    dst: [...]                          # destination networks/addresses
+    src_port: [1024-65535]              # source ports/port ranges
+    dst_port: [22, 80]                  # destination ports/port ranges
+    mapping: [Beemaster::dionaea_access]
+
+Events matching an allow rule pass, otherwise events matching a deny rule
+are rejected, all others are handled by the default policy. The networks of
+all rules are compiled into one prefix trie per condition, the ports into
+dicts, so matching an event costs a single trie walk or lookup per
+condition, regardless of the number of rules.
+
+The source, destination and ports of an event are the message items of its
+mapping named in ITEMS (e.g. src_ip for a dionaea access event, remote_ip
+for a dionaea blackhole event).
+"""
+import socket
+from binascii import hexlify
+from itertools import count
+from weakref import WeakKeyDictionary
+
+
+def parse_address(address):
+    """Return (bits, number) of an IPv4/IPv6 address.
+
+    IPv4-mapped IPv6 addresses (::ffff:a.b.c.d) are returned as IPv4.
+
+    :raises ValueError: If *address* is no address.
+    """
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, TypeError):
+            continue
+        number = int(hexlify(packed), 16)
+        if bits == 128 and number >> 32 == 0xffff:
+            return 32, number & 0xffffffff
+        return bits, number
+    raise ValueError("Invalid address '{}'.".format(address))
+
+
+class PrefixTrie(object):
+    """A binary trie of network prefixes, per address family.
+
+    Every prefix carries a bitmask (e.g. of rules), a lookup returns the
+    union of the masks of all prefixes containing the address.
+    """
+
+    def __init__(self):
+        """Initialise an empty trie."""
+        # bits -> root; a node is [child 0, child 1, mask]
+        self.roots = {32: [None, None, 0], 128: [None, None, 0]}
+
+    def add(self, network, mask):
+        """Add *mask* to the prefix *network* (address[/length]).
+
+        :param network: The network, e.g. "10.0.0.0/8". (str)
+        :param mask:    The mask to add. (int)
+        :raises ValueError: If *network* is invalid.
+        """
+        address, _, length = str(network).partition("/")
+        bits, number = parse_address(address)
+        length = int(length) if length else bits
+        if bits == 32 and ":" in address:
+            # the length refers to the IPv4-mapped IPv6 address
+            length -= 96
+        if not 0 <= length <= bits:
+            raise ValueError("Invalid network '{}'.".format(network))
+        node = self.roots[bits]
+        for shift in range(bits - 1, bits - 1 - length, -1):
+            bit = (number >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, 0]
+            node = node[bit]
+        node[2] |= mask
+
+    def lookup(self, address):
+        """Return the union of the masks of all prefixes of *address*.
+
+        :param address: The address. (str)
+        :raises ValueError: If *address* is no address.
+        """
+        bits, number = parse_address(address)
+        node = self.roots[bits]
+        mask = node[2]
+        for shift in range(bits - 1, -1, -1):
+            node = node[(number >> shift) & 1]
+            if node is None:
+                break
+            mask |= node[2]
+        return mask
+
+
+class RuleSet(object):
+    """A compiled list of rules, see module description."""
+
+    NETWORKS = ("src", "dst")
+    PORTS = ("src_port", "dst_port")
+
+    def __init__(self, rules):
+        """Compile the *rules*.
+
+        :param rules:   The rules. (List[Dict])
+        :raises ValueError: If a rule has an unknown or invalid condition.
+        """
+        self.any = (1 << len(rules)) - 1
+        # condition -> mask of the rules without that condition
+        self.wildcards = {}
+        # condition -> PrefixTrie / {value: mask}
+        self.index = {}
+        for condition in self.NETWORKS:
+            self.wildcards[condition] = self.any
+            self.index[condition] = PrefixTrie()
+        for condition in self.PORTS + ("mapping",):
+            self.wildcards[condition] = self.any
+            self.index[condition] = {}
+
+        for i, rule in enumerate(rules):
+            unknown = set(rule) - set(self.wildcards)
+            if unknown:
+                raise ValueError("Unknown filter condition(s) '{}'."
+                                 .format(", ".join(sorted(unknown))))
+            mask = 1 << i
+            for condition, values in rule.iteritems():
+                if not isinstance(values, list):
+                    values = [values]
+                self.wildcards[condition] &= ~mask
+                for value in values:
+                    self._add(condition, value, mask)
+
+    def _add(self, condition, value, mask):
+        """Add *value* of *condition* of the rule *mask* to the index."""
+        index = self.index[condition]
+        if condition in self.NETWORKS:
+            index.add(value, mask)
+            return
+        if condition == "mapping":
+            index[value] = index.get(value, 0) | mask
+            return
+        first, _, last = str(value).partition("-")
+        first, last = int(first), int(last or first)
+        if not 0 <= first <= last <= 65535:
+            raise ValueError("Invalid port (range) '{}'.".format(value))
+        for port in xrange(first, last + 1):
+            index[port] = index.get(port, 0) | mask
+
+    def match(self, values):
+        """Return True if any rule matches the event *values*.
+
+        :param values:  The value per condition, None if unknown. (Dict)
+        """
+        matching = self.any
+        for condition, wildcard in self.wildcards.iteritems():
+            if wildcard == self.any:
+                continue
+            value = values.get(condition)
+            mask = wildcard
+            if value is not None:
+                try:
+                    if condition in self.NETWORKS:
+                        mask |= self.index[condition].lookup(value)
+                    elif condition == "mapping":
+                        mask |= self.index[condition].get(value, 0)
+                    else:
+                        mask |= self.index[condition].get(int(value), 0)
+                except (ValueError, TypeError):
+                    pass
+            matching &= mask
+            if not matching:
+                return False
+        return matching != 0
+
+
+class Filter(object):
+    """The filter.
+
+    See module description.
+    """
+
+    POLICIES = ("allow", "deny")
+    # condition -> message items providing the value
+    ITEMS = {"src": ("src_ip", "remote_ip"),
+             "dst": ("dst_ip", "local_ip"),
+             "src_port": ("src_port", "remote_port"),
+             "dst_port": ("dst_port", "local_port")}
+
+    def __init__(self, allow=None, deny=None, default="allow", sample=None):
+        """Filter(allow, deny, default, sample)
+
+        :param allow:   Rules of events to pass. (List[Dict])
+        :param deny:    Rules of events to reject. (List[Dict])
+        :param default: Policy for events without matching rule, "allow" or
+                        "deny". (str)
+        :param sample:  Per mapping name, keep only every n-th event.
+                        (Dict[str, int])
+        :raises ValueError: If a rule, the policy or a rate is invalid.
+        """
+        if default not in self.POLICIES:
+            raise ValueError("Unknown filter policy '{}'.".format(default))
+        self.allow = RuleSet(allow or [])
+        self.deny = RuleSet(deny or [])
+        self.default = default == "allow"
+        self.rates = {}
+        for name, rate in (sample or {}).iteritems():
+            if int(rate) < 1:
+                raise ValueError("Invalid sample rate '{}' for '{}'."
+                                 .format(rate, name))
+            self.rates[name] = int(rate)
+        # mapping name -> counter of events
+        self.counters = {}
+        # converter -> {condition: item}, converters of reloaded mappings
+        # are dropped
+        self.items = WeakKeyDictionary()
+
+    def _items(self, converter):
+        """Return the message item per condition of *converter*."""
+        items = self.items.get(converter)
+        if items is None:
+            items = {}
+            for condition, candidates in self.ITEMS.iteritems():
+                items[condition] = next((item for item in candidates
+                                         if item in converter.message), None)
+            self.items[converter] = items
+        return items
+
+    def check(self, converter, data):
+        """Return why *data* is rejected or None, if it passes.
+
+        :param converter:   The converter to map *data* with, if any.
+                            (mapper.Converter)
+        :param data:        The event. (json)
+        :returns:           None, "denied" or "sampled". (str)
+        """
+        name = converter.name if converter else None
+        values = {"mapping": name}
+        if converter is not None:
+            for condition, item in self._items(converter).iteritems():
+                if item is not None:
+                    values[condition] = converter.value(item, data)
+
+        if not self.allow.match(values) and \
+                (not self.default or self.deny.match(values)):
+            return "denied"
+
+        rate = self.rates.get(name)
+        if rate is not None:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters.setdefault(name, count())
+            if next(counter) % rate:
+                return "sampled"
+        return None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""hashring.py
+
+Provides the HashRing, a consistent hash ring mapping keys (e.g. attacker
+addresses) to nodes (e.g. Bro slaves). Every node is placed on the ring
+multiple times, so keys spread evenly. Adding or removing a node only moves
+the keys of that node.
+"""
+from bisect import bisect
+from hashlib import md5
+
+
+class HashRing(object):
+    """The consistent hash ring.
+
+    See module description.
+    """
+
+    # points per node on the ring
+    REPLICAS = 100
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        """HashRing(nodes, replicas)
+
+        :param nodes:       The nodes to distribute keys among. (List[str])
+        :param replicas:    Number of points per node on the ring. (int)
+        """
+        self.nodes = sorted(set(nodes))
+        points = sorted((self._hash("{}#{}".format(node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def __len__(self):
+        """Return the number of nodes."""
+        return len(self.nodes)
+
+    @staticmethod
+    def _hash(key):
+        """Return the position of *key* on the ring."""
+        return int(md5(key).hexdigest()[:8], 16)
+
+    def get(self, key):
+        """Return the node responsible for *key* or None without nodes.
+
+        :param key:     The key to look up. (str)
+        """
+        if not self.points:
+            return None
+        if isinstance(key, unicode):
+            key = key.encode("utf8")
+        index = bisect(self.points, self._hash(str(key)))
+        return self.owners[index % len(self.owners)]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""logs.py
+
+Provides logging helpers for the hot path of the connector:
+
+* :class:`Lazy` defers the (str.format) formatting of a message until a
+  record is actually emitted.
+* :class:`RepeatFilter` collapses repeated records into periodic summaries,
+  so the log volume does not grow with the attack traffic (e.g. during an
+  outage of the Bro side).
+"""
+import logging
+from threading import Lock, Timer
+from time import time
+
+
+class Lazy(object):
+    """A log message, formatted via str.format only when emitted."""
+
+    __slots__ = ("fmt", "args", "kwargs")
+
+    def __init__(self, fmt, *args, **kwargs):
+        """Lazy(fmt, *args, **kwargs)
+
+        :param fmt:     The format string. (str)
+        :param args:    Positional arguments for the format string.
+        :param kwargs:  Keyword arguments for the format string.
+        """
+        self.fmt = fmt
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        """Return the formatted message."""
+        return self.fmt.format(*self.args, **self.kwargs)
+
+
+class RepeatFilter(logging.Filter):
+    """Filter collapsing repeated records.
+
+    Records are considered the same if they share logger, level and message
+    (the format string for :class:`Lazy` messages). Only the first record per
+    interval is passed. Once the interval ends, the number of records
+    suppressed in the meantime is logged with the last of them, by a timer
+    (or by the next record, if that comes first).
+    """
+
+    # upper bound for the number of tracked messages
+    MAX_TRACKED = 1024
+
+    def __init__(self, interval, level=logging.WARNING):
+        """RepeatFilter(interval, level)
+
+        :param interval:    Seconds to suppress repetitions for. (float)
+        :param level:       Only records of this level or above are
+                            collapsed. (int)
+        """
+        super(RepeatFilter, self).__init__()
+        self.interval = interval
+        self.level = level
+        # key -> [start of the interval, suppressed records, last of them]
+        self.seen = {}
+        self.lock = Lock()
+        # the pending flush of suppressed records, if any
+        self.timer = None
+
+    def filter(self, record):
+        """Return True if the record should be emitted."""
+        if record.levelno < self.level or hasattr(record, "suppressed"):
+            return True
+        msg = record.msg
+        key = (record.name, record.levelno,
+               msg.fmt if isinstance(msg, Lazy) else msg)
+        now = time()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                entry[2] = record
+                if self.timer is None:
+                    self._schedule(entry[0] + self.interval - now)
+                return False
+            if len(self.seen) >= self.MAX_TRACKED:
+                self.seen.clear()
+            self.seen[key] = [now, 0, None]
+        if entry is not None and entry[1]:
+            record.msg = self._summary(record, entry[1], now - entry[0])
+            record.args = ()
+        return True
+
+    @staticmethod
+    def _summary(record, suppressed, seconds):
+        """Return the message of *record* with the number suppressed."""
+        return "{} [{} similar messages suppressed in {:.0f}s]".format(
+            record.getMessage(), suppressed, seconds)
+
+    def _schedule(self, delay):
+        """Flush in *delay* seconds (with the lock held)."""
+        self.timer = Timer(max(delay, 0), self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        """Log the suppressed records of all ended intervals."""
+        now = time()
+        ended = []
+        with self.lock:
+            self.timer = None
+            delay = None
+            for key, (started, suppressed, last) in self.seen.items():
+                if not suppressed:
+                    continue
+                if now - started >= self.interval:
+                    ended.append((started, suppressed, last))
+                    del self.seen[key]
+                else:
+                    remaining = started + self.interval - now
+                    delay = remaining if delay is None \
+                        else min(delay, remaining)
+            if delay is not None:
+                self._schedule(delay)
+        for started, suppressed, last in ended:
+            summary = logging.LogRecord(
+                last.name, last.levelno, last.pathname, last.lineno,
+                self._summary(last, suppressed, now - started), (), None,
+                last.funcName)
+            summary.suppressed = suppressed
+            logging.getLogger(last.name).handle(summary)
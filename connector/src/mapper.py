@@ -3,51 +3,253 @@
 
 Provides the Mapper, which maps json input data to Broker messages.
 """
+from cache import LRUCache
+from logs import Lazy
+
 import pybroker as pb
 from datetime import datetime
 
 import logging
+from operator import itemgetter
 import re
 
 
+class Converter(object):
+    """A compiled mapping.
+
+    Converts json data to the mapping's Broker message, by pulling exactly
+    the paths required for the message and converting them with the
+    pre-resolved handlers.
+
+    The key to balance the message among slaves by is the value of the item
+    named by the mapping's ``balance`` key, by default the first of
+    BALANCE_ITEMS in the message (the attacker address).
+
+    The ``priority`` of a mapping (one of PRIORITIES, default "normal")
+    decides which events are shed first under overload.
+
+    Events of mappings with an ``aggregate`` key are collapsed into summary
+    events by the Aggregator, see :mod:`aggregator`.
+    """
+
+    BALANCE_ITEMS = ("src_ip", "remote_ip")
+    # default seconds to aggregate events for
+    AGGREGATE_WINDOW = 10.0
+    # from highest to lowest
+    PRIORITIES = ("high", "normal", "low")
+
+    def __init__(self, mapping, handlers):
+        """Compile the *mapping* with the given *handlers*.
+
+        :param mapping:     The mapping to compile. (Dict)
+        :param handlers:    The handler per mapping type. (Dict[str, func])
+        :raises LookupError:    If a message item cannot be produced.
+        """
+        self.mapping = mapping
+        self.name = mapping['name']
+        self.message = mapping['message']
+        # prepending with event-name for broker
+        self.event = pb.data(self.name)
+
+        leaves = self._leaves(mapping['mapping'])
+        # (item, [paths], handler) in message order
+        self.fields = []
+        for item in self.message:
+            paths = [path for path, _ in leaves if path[-1] == item]
+            types = {str(tp) for path, tp in leaves if path[-1] == item}
+            if not paths:
+                raise LookupError("No mapping for message item '{}'."
+                                  .format(item))
+            if len(types) != 1 or list(types)[0] not in handlers:
+                raise LookupError("No handler implemented for '{}' ({})."
+                                  .format(item, ", ".join(types)))
+            self.fields.append((item, paths, handlers[types.pop()]))
+        # item -> [paths]
+        self.paths = {item: paths for item, paths, _ in self.fields}
+
+        balance = mapping.get('balance')
+        if balance is None:
+            balance = next((item for item in self.BALANCE_ITEMS
+                            if item in self.message), None)
+        elif balance not in self.message:
+            raise LookupError("Balance item '{}' is not in the message."
+                              .format(balance))
+        self.balance = balance
+
+        self.priority = mapping.get('priority', "normal")
+        if self.priority not in self.PRIORITIES:
+            raise LookupError("Unknown priority '{}'.".format(self.priority))
+
+        # items keying the aggregation windows, not aggregated if None
+        self.aggregate = None
+        aggregate = mapping.get('aggregate')
+        if aggregate is not None:
+            self.aggregate = list(aggregate.get('key') or [])
+            if not self.aggregate:
+                raise LookupError("No aggregation key.")
+            unknown = [item for item in self.aggregate
+                       if item not in self.message]
+            if unknown:
+                raise LookupError("Aggregation key item(s) '{}' not in the "
+                                  "message.".format(", ".join(unknown)))
+            self.window = float(aggregate.get('window',
+                                              self.AGGREGATE_WINDOW))
+            self.summary = pb.data(aggregate.get('name',
+                                                 self.name + "_summary"))
+
+    @staticmethod
+    def _leaves(structure, prefix=()):
+        """Return (path, type) for all leaves of the (nested) *structure*."""
+        leaves = []
+        for key, child in structure.iteritems():
+            path = prefix + (key,)
+            if isinstance(child, dict):
+                leaves.extend(Converter._leaves(child, path))
+            else:
+                leaves.append((path, child))
+        return leaves
+
+    @staticmethod
+    def _getter(path):
+        """Return a function pulling *path* out of the data."""
+        if len(path) == 1:
+            return itemgetter(path[0])
+
+        def get(data):
+            for key in path:
+                data = data[key]
+            return data
+        return get
+
+    def key(self, data):
+        """Return the key to balance *data* by or None.
+
+        :param data:    The (converted) data. (json)
+        """
+        if self.balance is None:
+            return None
+        return self.value(self.balance, data)
+
+    def value(self, item, data):
+        """Return the raw value of message *item* in *data* or None.
+
+        :param item:    The message item. (str)
+        :param data:    The (converted) data. (json)
+        """
+        for path in self.paths[item]:
+            try:
+                value = data
+                for key in path:
+                    value = value[key]
+                return value
+            except (KeyError, TypeError):
+                continue
+        return None
+
+    def resolve(self, paths):
+        """Resolve the fields for data with the given leaf *paths*.
+
+        :param paths:   The leaf paths present in the data. (Set[Tuple])
+        :returns:       The (getter, handler) per message item or None, if an
+                        item is not present. (List[Tuple])
+        """
+        resolved = []
+        for _, candidates, handler in self.fields:
+            for path in candidates:
+                if path in paths:
+                    resolved.append((self._getter(path), handler))
+                    break
+            else:
+                return None
+        return resolved
+
+    def convert(self, data, fields):
+        """Convert *data* with the resolved *fields* to a Broker message.
+
+        :param data:    The data to convert. (json)
+        :param fields:  The fields as returned by :meth:`resolve`.
+        :returns:       The Broker message or None, if a value is not
+                        convertible. (pybroker.Message)
+        """
+        message = pb.message()
+        message.append(self.event)
+        for getter, handler in fields:
+            broker_obj = handler(getter(data))
+            if broker_obj is None:
+                return None
+            message.append(pb.data(broker_obj))
+        return message
+
+
 class Mapper(object):
     """The mapper.
 
     Maps messages over mappings to broker-messages.
+
+    Every mapping is compiled to a :class:`Converter` once. Incoming messages
+    are dispatched by their key-shape (the nested structure of their keys) to
+    the converters which can produce every field of their message. The result
+    is cached per shape, including shapes no mapping applies to.
+
+    Converted addresses are cached, as honeypot traffic is dominated by few
+    addresses (not least the honeypot's own).
+
+    Batches of events are converted column by column via
+    :meth:`convert_many`: events are grouped by their dispatch and every
+    field is converted for the whole group in one pass, converting equal
+    values only once.
     """
 
-    def __init__(self, mappings):
+    # upper bound for the number of cached shapes
+    DISPATCH_CACHE_SIZE = 1024
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+    # TIME_FORMAT split into seconds and fraction, for the fast path
+    TIME_PATTERN = re.compile(
+        r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)\.(\d{1,6})\Z')
+    EPOCH = datetime.utcfromtimestamp(0)
+    # upper bound for the number of cached seconds (since epoch) per
+    # timestamp prefix, events arrive in bursts sharing the same second
+    TIME_CACHE_SIZE = 64
+    _time_cache = {}
+
+    # default size of the address cache
+    ADDRESS_CACHE_SIZE = 1024
+
+    # whitespace to replace with a single space in strings
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, mappings, addresses=None):
         """Initialise a new Mapper with the given mappings
 
         :param mappings:    The mapping to use. (List[Dict])
+        :param addresses:   The cache for converted addresses, may be shared.
+                            (cache.LRUCache)
         """
         self.log = logging.getLogger(self.__class__.__name__)
 
+        self.addresses = addresses
+        if addresses is None:
+            self.addresses = LRUCache(self.ADDRESS_CACHE_SIZE)
+
         self.mappings = sorted(mappings,
                                key=lambda mapping: -len(mapping['message']))
+        self.converters = []
+        for mapping in self.mappings:
+            try:
+                self.converters.append(Converter(mapping, self._handlers()))
+            except LookupError as e:
+                self.log.error("Invalid mapping for '{}': {} Ignoring."
+                               .format(mapping['name'], e.args[0]))
+        # shape -> List[(converter, fields)]; an empty list caches a shape
+        # without match
+        self._dispatch = {}
 
-    def _map_final_type(self, prop, value, mapped):
-        """Try to map the final property."""
-        if isinstance(mapped, dict):
-            mapped = mapped.get(prop)
-        if not mapped or not isinstance(mapped, str):
-            self._log_unknown(prop, value)
-            return
-        handler = getattr(self, '_map_{}'.format(mapped), None)
-        if not handler:
-            self._log_unimplemented(prop, value)
-            return
-        return handler(value)
-
-    def _log_unknown(self, prop, val):
-        """Log an unknown item."""
-        self.log.info("No Mapping configured for property "
-                      "'{}' with value '{}'.".format(prop, val))
-
-    def _log_unimplemented(self, prop, val):
-        """Log an unimplemented item."""
-        self.log.info("No handler implemented for '{}' with value '{}'"
-                      .format(prop, val))
+    def _handlers(self):
+        """Return the handler per mapping type (from the _map_* methods)."""
+        prefix = '_map_'
+        return {name[len(prefix):]: getattr(self, name)
+                for name in dir(self) if name.startswith(prefix)}
 
     @staticmethod
     def _map_port_count(port):
@@ -56,10 +258,15 @@ class Mapper(object):
         if 0 <= p <= 65535:
             return p
 
-    @staticmethod
-    def _map_address(addr):
+    def _map_address(self, addr):
         """Map an address."""
-        return pb.address_from_string(str(addr))
+        addr = str(addr)
+        address = self.addresses.get(addr)
+        if address is None:
+            address = pb.address_from_string(addr)
+            if address is not None:
+                self.addresses.put(addr, address)
+        return address
 
     @staticmethod
     def _map_count(num):
@@ -74,18 +281,38 @@ class Mapper(object):
             string = str(string.encode('utf8'))
         else:
             string = str(string)
-        string = re.sub(r"\s+", ' ', string)
-        return string
+        return Mapper.WHITESPACE.sub(' ', string)
 
     @staticmethod
     def _map_time_point(time_str):
         """Map a time_point."""
-        date = datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S.%f')
+        match = Mapper.TIME_PATTERN.match(time_str)
+        if match is None:
+            return Mapper._map_time_point_generic(time_str)
+
+        prefix = time_str[:19]
+        seconds = Mapper._time_cache.get(prefix)
+        if seconds is None:
+            # datetime validates the ranges, just like strptime
+            delta = datetime(*map(int, match.groups()[:6])) - Mapper.EPOCH
+            seconds = delta.days * 86400 + delta.seconds
+            if len(Mapper._time_cache) >= Mapper.TIME_CACHE_SIZE:
+                Mapper._time_cache.clear()
+            Mapper._time_cache[prefix] = seconds
+        microseconds = int(match.group(7).ljust(6, '0'))
+
+        # This sets the time_point as a double containing the amount of seconds
+        # since epoch (computed like timedelta.total_seconds).
+        return pb.time_point((seconds * 10**6 + microseconds) / 1e6)
+
+    @staticmethod
+    def _map_time_point_generic(time_str):
+        """Map a time_point (via strptime)."""
+        date = datetime.strptime(time_str, Mapper.TIME_FORMAT)
 
         # This sets the time_point as a double containing the amount of seconds
         # since epoch.
-        return pb.time_point(
-            (date - datetime.utcfromtimestamp(0)).total_seconds())
+        return pb.time_point((date - Mapper.EPOCH).total_seconds())
 
     @staticmethod
     def _map_array(array):
@@ -95,28 +322,52 @@ class Mapper(object):
             string = str(string.encode('utf8'))
         else:
             string = str(string)
-        string = re.sub(r"\s+", ' ', string)
-        return string
+        return Mapper.WHITESPACE.sub(' ', string)
 
-    def _traverse_to_end(self, key, child, curr_map, acc=None):
-        """Traverse the structure to the end."""
-        if acc is None:
-            acc = {}
-
-        # key and child represent a property from the received message.
-        # currMap is the current (sub-)mapping to be applied.
+    @staticmethod
+    def _shape(data):
+        """Return the (hashable) key-shape of *data*."""
+        return frozenset((key, Mapper._shape(child)
+                          if isinstance(child, dict) else None)
+                         for key, child in data.iteritems())
 
-        if key in curr_map:
-            curr_map = curr_map[key]
-            if isinstance(child, dict):
-                for k, v in child.iteritems():
-                    self._traverse_to_end(k, v, curr_map, acc)
+    @staticmethod
+    def _shape_paths(shape, prefix=()):
+        """Return the set of leaf paths of a *shape*."""
+        paths = set()
+        for key, child in shape:
+            path = prefix + (key,)
+            if child is None:
+                paths.add(path)
             else:
-                broker_obj = self._map_final_type(key, child, curr_map)
-                if broker_obj is not None:
-                    acc[key] = broker_obj
+                paths |= Mapper._shape_paths(child, path)
+        return paths
+
+    def _candidates(self, data):
+        """Return the (converter, fields) which could possibly map *data*."""
+        if not isinstance(data, dict):
+            return []
+        shape = self._shape(data)
+        candidates = self._dispatch.get(shape)
+        if candidates is None:
+            paths = self._shape_paths(shape)
+            candidates = []
+            for converter in self.converters:
+                fields = converter.resolve(paths)
+                if fields is not None:
+                    candidates.append((converter, fields))
+            if len(self._dispatch) >= self.DISPATCH_CACHE_SIZE:
+                self._dispatch.clear()
+            self._dispatch[shape] = candidates
+        return candidates
 
-        return acc
+    def match(self, data):
+        """Return the first converter which could map *data* or None.
+
+        :param data:    The data to match. (json)
+        """
+        candidates = self._candidates(data)
+        return candidates[0][0] if candidates else None
 
     def transform(self, data):
         """Map *data* to the appropriate Broker message.
@@ -124,40 +375,118 @@ class Mapper(object):
         :param data:    The data to map. (json)
         :returns:       The corresponding Broker message. (pybroker.Message)
         """
-        self.log.debug("Trying to map '{}'.".format(data))
+        return self.convert(data)[1]
 
-        for mapping in self.mappings:
-            event_name = mapping['name']
-            self.log.debug("Trying mapping for '{}'.".format(event_name))
+    def convert(self, data):
+        """Map *data* and return the used converter with the message.
+
+        :param data:    The data to map. (json)
+        :returns:       The converter and the corresponding Broker message or
+                        (None, None). (Tuple[Converter, pybroker.Message])
+        """
+        self.log.debug(Lazy("Trying to map '{}'.", data))
 
-            local_mapping = mapping['mapping']
-            # the actual traversion
+        for converter, fields in self._candidates(data):
+            self.log.debug(Lazy("Trying mapping for '{}'.", converter.name))
             try:
-                broker_msg = {k2: v2 for k, v in data.iteritems() for k2, v2
-                              in self._traverse_to_end(k, v, local_mapping)
-                              .iteritems()}
+                message = converter.convert(data, fields)
             except Exception:
                 self.log.info("Failed to convert message properly. "
                               "Ignoring format.")
                 continue
+            if message is None:
+                self.log.debug("Invalid message. Format unknown.")
+                continue
 
-            self.log.info("Using mapping for '{}'.".format(event_name))
-            message = pb.message()
-            # prepending with event-name for broker
-            message.append(pb.data(event_name))
+            self.log.info(Lazy("Using mapping for '{}'.", converter.name))
+            return converter, message
 
-            # setting up the final message in desired order
-            local_message = mapping['message']
-            for item in local_message:
-                if item not in broker_msg:
-                    self.log.debug("Invalid message. Format unknown.")
-                    break
-                broker_item = broker_msg[item]
-                self.log.debug("Add converted brokerObject '{}' to message."
-                               .format(broker_item))
-                message.append(pb.data(broker_item))
-            else:
-                return message
-        else:
-            self.log.warn("No valid mapping found. Discarding message.")
-            return
+        self.log.warn("No valid mapping found. Discarding message.")
+        return None, None
+
+    def transform_many(self, events):
+        """Map a batch of *events* to the appropriate Broker messages.
+
+        :param events:  The data to map. (List[json])
+        :returns:       The corresponding Broker message (or None) per
+                        event. (List[pybroker.Message])
+        """
+        return [message for _, message in self.convert_many(events)]
+
+    def convert_many(self, events):
+        """Map a batch of *events* and return the converters and messages.
+
+        The events are grouped by their dispatch and converted column by
+        column, see class description. Events a column fails for are
+        converted on their own (by :meth:`convert`), as another mapping may
+        apply to them.
+
+        :param events:  The data to map. (List[json])
+        :returns:       The converter and the corresponding Broker message or
+                        (None, None) per event.
+                        (List[Tuple[Converter, pybroker.Message]])
+        """
+        results = [(None, None)] * len(events)
+        # id(candidates) -> (candidates, [index])
+        groups = {}
+        for index, data in enumerate(events):
+            candidates = self._candidates(data)
+            if not candidates:
+                continue
+            group = groups.get(id(candidates))
+            if group is None:
+                group = groups[id(candidates)] = (candidates, [])
+            group[1].append(index)
+
+        for candidates, indices in groups.itervalues():
+            converter, fields = candidates[0]
+            columns = [self._column(handler,
+                                    [getter(events[index])
+                                     for index in indices])
+                       for getter, handler in fields]
+            for row, index in enumerate(indices):
+                values = [column[row] for column in columns]
+                if any(value is None for value in values):
+                    results[index] = self.convert(events[index])
+                    continue
+                message = pb.message()
+                message.append(converter.event)
+                for value in values:
+                    message.append(value)
+                results[index] = (converter, message)
+
+        self.log.debug(Lazy("Converted {} events in {} groups.",
+                            len(events), len(groups)))
+        return results
+
+    @staticmethod
+    def _column(handler, values):
+        """Return the Broker data of *handler* per value or None on failure.
+
+        Equal values of the same type are converted once (1, 1.0 and True
+        are equal, but not converted alike).
+        """
+        converted = {}
+        column = []
+        for value in values:
+            key = (type(value), value)
+            try:
+                data = converted[key]
+            except KeyError:
+                data = converted[key] = Mapper._convert_value(handler, value)
+            except TypeError:
+                # unhashable
+                data = Mapper._convert_value(handler, value)
+            column.append(data)
+        return column
+
+    @staticmethod
+    def _convert_value(handler, value):
+        """Return the Broker data of *handler* for *value* or None."""
+        try:
+            result = handler(value)
+        except Exception:
+            return None
+        if result is None:
+            return None
+        return pb.data(result)
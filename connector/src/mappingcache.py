@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""mappingcache.py
+
+Provides the MappingCache, a cache file of the parsed mappings. Parsing the
+YAML files dominates the startup on slow devices; the cache is only used as
+long as the mapping files (paths, sizes and mtimes, see :func:`signature`)
+are unchanged.
+
+The compiled converters hold Broker data, which cannot be serialised, so the
+cache holds the parsed mappings. Compiling them is cheap in comparison. The
+mappings are plain data, so they are stored as json, which (unlike pickle)
+cannot execute code when read. Mappings json cannot represent exactly (e.g.
+with non-string keys) are not cached.
+"""
+import json
+import logging
+import os
+from tempfile import mkstemp
+
+
+def signature(location):
+    """Return the (path, size, mtime) of all files below *location*."""
+    files = []
+    for root, _, names in os.walk(location):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+    return sorted(files)
+
+
+class MappingCache(object):
+    """The mapping cache.
+
+    See module description.
+    """
+
+    # increase on incompatible changes of the cached data
+    VERSION = 2
+
+    def __init__(self, path):
+        """MappingCache(path)
+
+        :param path:    The cache file. (str)
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+
+    def _key(self, location, files):
+        """Return the key of the mappings in *location* with *files*."""
+        # lists, as they are compared with the key read from json
+        return [self.VERSION, os.path.abspath(location),
+                [list(entry) for entry in files]]
+
+    @staticmethod
+    def _decode(data):
+        """Return *data* with ascii strings as str, as yaml loads them."""
+        if isinstance(data, unicode):
+            try:
+                return data.encode("ascii")
+            except UnicodeEncodeError:
+                return data
+        if isinstance(data, list):
+            return [MappingCache._decode(item) for item in data]
+        if isinstance(data, dict):
+            return {MappingCache._decode(key): MappingCache._decode(value)
+                    for key, value in data.iteritems()}
+        return data
+
+    def get(self, location, files):
+        """Return the cached mappings of *location* or None.
+
+        :param location:    The mappings directory. (str)
+        :param files:       The :func:`signature` of *location*. (List)
+        :returns:           The mappings, if *files* are unchanged.
+                            (List[Dict])
+        """
+        try:
+            with open(self.path, "rb") as f:
+                key, mappings = self._decode(json.load(f))
+        except Exception:
+            return None
+        if key != self._key(location, files):
+            return None
+        return mappings
+
+    def put(self, location, files, mappings):
+        """Cache the *mappings* of *location* with *files*.
+
+        Failures are only logged, as the cache is optional. The directory of
+        the cache file is created (accessible by the owner only), if it is
+        missing.
+
+        :param location:    The mappings directory. (str)
+        :param files:       The :func:`signature` of *location*. (List)
+        :param mappings:    The parsed mappings. (List[Dict])
+        """
+        try:
+            encoded = json.dumps([self._key(location, files), mappings])
+        except (TypeError, ValueError):
+            encoded = None
+        if encoded is None or \
+                self._decode(json.loads(encoded))[1] != mappings:
+            self.log.info("Mappings are not representable as json, not "
+                          "caching them.")
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            # a new file (O_EXCL, mode 0600), as the directory may be shared
+            fd, tmp = mkstemp(dir=directory,
+                              prefix=os.path.basename(self.path) + ".")
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded)
+            # replaced atomically, workers may read and write concurrently
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            self.log.warn("Failed to write the mapping cache '{}': {}"
+                          .format(self.path, e))
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""metrics.py
+
+Provides the Metrics, a thread-safe registry of counters, gauges and latency
+histograms of the connector. It is rendered in the Prometheus text format
+(https://prometheus.io/docs/instrumenting/exposition_formats/), which the
+Receiver serves on its metrics route.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from timeit import default_timer
+
+
+class Histogram(object):
+    """A latency histogram with fixed buckets."""
+
+    def __init__(self, buckets):
+        """Histogram(buckets)
+
+        :param buckets:     The (sorted) upper bounds of the buckets in
+                            seconds. (Tuple[float])
+        """
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add *value* to the histogram."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """The metrics registry.
+
+    See module description.
+    """
+
+    PREFIX = "connector_"
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self):
+        """Initialise an empty registry."""
+        self.lock = Lock()
+        # name -> {labels: value}
+        self.counters = {}
+        self.histograms = {}
+        # name -> {labels: func}
+        self.gauges = {}
+
+    @staticmethod
+    def _labels(labels):
+        """Return the hashable representation of *labels*."""
+        return tuple(sorted(labels.iteritems()))
+
+    def inc(self, name, value=1, **labels):
+        """Increase the counter *name* by *value*."""
+        labels = self._labels(labels)
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[labels] = counter.get(labels, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Add *seconds* to the histogram *name*."""
+        labels = self._labels(labels)
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            histogram = histograms.get(labels)
+            if histogram is None:
+                histogram = histograms[labels] = Histogram(self.BUCKETS)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with-block in histogram *name*."""
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name, default_timer() - start, **labels)
+
+    def gauge(self, name, func, **labels):
+        """Register *func* to provide the current value of gauge *name*."""
+        with self.lock:
+            self.gauges.setdefault(name, {})[self._labels(labels)] = func
+
+    @staticmethod
+    def _format_labels(labels):
+        """Return *labels* in the exposition format."""
+        if not labels:
+            return ""
+        return "{{{}}}".format(",".join(
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\")
+                             .replace('"', '\\"')) for k, v in labels))
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.iteritems()):
+                name = "{}{}_total".format(self.PREFIX, name)
+                lines.append("# TYPE {} counter".format(name))
+                for labels, value in sorted(series.iteritems()):
+                    lines.append("{}{} {}".format(
+                        name, self._format_labels(labels), value))
+            gauges = sorted((name, sorted(series.items()))
+                            for name, series in self.gauges.iteritems())
+            for name, series in sorted(self.histograms.iteritems()):
+                name = self.PREFIX + name
+                lines.append("# TYPE {} histogram".format(name))
+                for labels, histogram in sorted(series.iteritems()):
+                    cumulative = 0
+                    bounds = [repr(b) for b in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        bucket = labels + (("le", bound),)
+                        lines.append("{}_bucket{} {}".format(
+                            name, self._format_labels(bucket), cumulative))
+                    lines.append("{}_sum{} {!r}".format(
+                        name, self._format_labels(labels), histogram.sum))
+                    lines.append("{}_count{} {}".format(
+                        name, self._format_labels(labels), histogram.count))
+        # gauges are evaluated outside of the lock
+        for name, series in gauges:
+            name = self.PREFIX + name
+            lines.append("# TYPE {} gauge".format(name))
+            for labels, func in series:
+                lines.append("{}{} {}".format(
+                    name, self._format_labels(labels), func()))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""monitor.py
+
+Provides the Monitor, which keeps track of the connection state of Broker
+endpoints. A background thread waits for status changes of all added
+endpoints, so the current state is a cheap lookup. Callbacks are notified on
+every change.
+
+Endpoints are not established until Broker reports so: an endpoint which
+cannot reach its peer from the start may never report a change, messages
+must then be spooled (or dropped) instead of sent into the void.
+"""
+import pybroker as broker
+
+import logging
+from select import select
+from threading import Thread
+
+
+class Monitor(object):
+    """The connection monitor.
+
+    See module description.
+    """
+
+    def __init__(self, timeout=1.0):
+        """Monitor(timeout)
+
+        Initialises the Monitor. Start it via :meth:`start`.
+
+        :param timeout:     Seconds to wait for changes before endpoints
+                            added in the meantime are considered. (float)
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        self.timeout = timeout
+        # name -> endpoint / established
+        self.endpoints = {}
+        self.states = {}
+        self.callbacks = []
+
+        self.thread = Thread(target=self._run, name="connection-monitor")
+        self.thread.daemon = True
+
+    def add(self, name, endpoint, established=False):
+        """Monitor the outgoing connections of *endpoint* as *name*.
+
+        :param name:        Name of the endpoint. (str)
+        :param endpoint:    The endpoint to monitor. (pybroker.endpoint)
+        :param established: The state until the first change, e.g. if the
+                            connection was already established. (bool)
+        """
+        self.states[name] = established
+        self.endpoints[name] = endpoint
+
+    def remove(self, name):
+        """Stop monitoring endpoint *name*."""
+        self.endpoints.pop(name, None)
+        self.states.pop(name, None)
+
+    def on_change(self, callback):
+        """Call *callback* with (name, established) on every change.
+
+        :param callback:    The function to call. (func(str, bool))
+        """
+        self.callbacks.append(callback)
+
+    def established(self, name):
+        """Return True if the connection of endpoint *name* is established."""
+        return self.states.get(name, False)
+
+    def start(self):
+        """Start monitoring in the background."""
+        self.thread.start()
+
+    def _run(self):
+        """Wait for and consume status changes forever."""
+        while True:
+            queues = {name: endpoint.outgoing_connection_status()
+                      for name, endpoint in self.endpoints.items()}
+            fds = {queue.fd(): name for name, queue in queues.iteritems()}
+            if not fds:
+                select([], [], [], self.timeout)
+                continue
+            readable, _, _ = select(list(fds), [], [], self.timeout)
+            for fd in readable:
+                name = fds[fd]
+                for m in queues[name].want_pop():
+                    self._update(name, m.status ==
+                                 broker.incoming_connection_status
+                                 .tag_established)
+
+    def _update(self, name, established):
+        """Set the state of *name* and notify the callbacks."""
+        if name not in self.endpoints or \
+                self.states.get(name) == established:
+            return
+        self.states[name] = established
+        self.log.info("Connection of '{}' {}.".format(
+            name, "established" if established else "lost"))
+        for callback in self.callbacks:
+            try:
+                callback(name, established)
+            except Exception:
+                self.log.error("Connection callback failed.", exc_info=True)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""pipeline.py
+
+Provides the Pipeline, which decouples receiving messages from handling them.
+Messages are put into a bounded queue, which is drained by a dedicated worker
+thread calling the handler for every message.
+
+The queue is divided into lanes by priority (lane 0 first). The worker
+always handles the messages of the highest priority lane first, and lower
+priority lanes are only admitted up to a share of the queue size, so they
+are shed first under overload (see :meth:`Pipeline.admit`).
+"""
+from Queue import PriorityQueue, Full
+from itertools import count
+from threading import Lock, Thread
+import logging
+
+
+class Pipeline(object):
+    """The pipeline.
+
+    See module description.
+    """
+
+    def __init__(self, handler, size, admission=(1.0,)):
+        """Pipeline(handler, size, admission)
+
+        Initialises the Pipeline. Start the worker via :meth:`start`.
+
+        :param handler:     The function to call for every message.
+                            (func(json))
+        :param size:        Maximum number of queued messages. (int)
+        :param admission:   Per lane, the share of *size* up to which
+                            messages of the lane are admitted. (List[float])
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        self.handler = handler
+        # (lane, sequence number, message)
+        self.queue = PriorityQueue(size)
+        self.limits = [int(size * share) for share in admission]
+        self.sequence = count()
+        # messages queued per lane
+        self.depths = [0] * len(admission)
+        self.lock = Lock()
+        self.worker = Thread(target=self._run, name="pipeline-worker")
+        self.worker.daemon = True
+
+    def start(self):
+        """Start the worker thread."""
+        self.worker.start()
+
+    def admit(self, lane=0):
+        """Return True if messages of *lane* are admitted now.
+
+        :param lane:        The lane, 0 is the highest priority. (int)
+        """
+        return self.queue.qsize() < self.limits[lane]
+
+    def put(self, message, lane=0):
+        """Queue *message* into *lane* without blocking.
+
+        :param message:     The message to queue. (json)
+        :param lane:        The lane, 0 is the highest priority. (int)
+        :returns:           False, if the queue is full. (bool)
+        """
+        with self.lock:
+            try:
+                self.queue.put_nowait((lane, next(self.sequence), message))
+            except Full:
+                return False
+            self.depths[lane] += 1
+        return True
+
+    def depth(self, lane=None):
+        """Return the number of queued messages (of *lane*, if given)."""
+        if lane is None:
+            return self.queue.qsize()
+        return self.depths[lane]
+
+    def _run(self):
+        """Handle queued messages forever."""
+        while True:
+            lane, _, message = self.queue.get()
+            with self.lock:
+                self.depths[lane] -= 1
+            try:
+                self.handler(message)
+            except Exception:
+                self.log.error("Failed to handle queued message.",
+                               exc_info=True)
+            finally:
+                self.queue.task_done()
@@ -5,21 +5,80 @@ Provides the Receiver, which listens to the given address and reacts on data.
 The method :meth:`Receiver.on_data` is called upon a valid json message. Start
 it by calling :func:`~Receiver.listen`.
 
+Besides single json objects, batches of messages are accepted as json array
+(``application/json``) or as newline-delimited json
+(``application/x-ndjson``). Every message of a batch is handled on its own,
+failures are reported per item. If an on_batch callback is given, the
+messages of a batch are handed to it at once instead, e.g. to map them in one
+pass.
+
+The server backend is configurable: Flask's (single-threaded) development
+server, a threaded WSGI server (``waitress``) or an event-loop based one
+(``gevent``). The latter two are optional dependencies and only imported if
+selected.
+
+The body is decoded exactly once, by the configured decoder: the standard
+library's ``json`` or the optional, C-accelerated ``ujson`` (``auto`` uses the
+latter if installed).
+
+If the callback raises :class:`Overloaded`, the message is answered with its
+status (``503 Service Unavailable`` or ``429 Too Many Requests``) and a
+``Retry-After`` header, if known. A batch is answered with that status only if
+all of its messages were rejected so (503, if any was).
+
+If metrics are given, received messages and decode latencies are recorded
+and the metrics can be served on a separate route via
+:meth:`~Receiver.serve_metrics`.
+
 This implementation uses Flask (http://flask.pocoo.org/)!
 """
 from flask import Flask, request, json, Response
 # ATTENTION: The imported json is a custom implementation of the internal json
 #            module. https://github.com/pallets/flask/blob/master/flask/json.py
+from logs import Lazy
+
+from importlib import import_module
 import logging
 
 
+class Overloaded(Exception):
+    """Raised by the on_data callback, if a message cannot be accepted now."""
+
+    REASONS = {429: "Too Many Requests", 503: "Service Unavailable"}
+
+    def __init__(self, status=503, retry_after=None):
+        """Overloaded(status, retry_after)
+
+        :param status:      The status to answer with, 503 (full) or 429
+                            (shed). (int)
+        :param retry_after: Seconds to retry after, if known. (int)
+        """
+        super(Overloaded, self).__init__(self.REASONS[status])
+        self.status = status
+        self.retry_after = retry_after
+
+    def response(self):
+        """Return the response to answer the message with."""
+        response = Response(self.REASONS[self.status], self.status)
+        if self.retry_after is not None:
+            response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+
 class Receiver(Flask):
     """Receiver
 
     See module description.
     """
 
-    def __init__(self, name, address, port):
+    SERVERS = ("flask", "waitress", "gevent")
+    # decoder -> modules to try (providing loads)
+    DECODERS = {"json": ["json"],
+                "ujson": ["ujson"],
+                "auto": ["ujson", "json"]}
+
+    def __init__(self, name, address, port, server="flask", threads=4,
+                 timeout=30, decoder="json", metrics=None, sock=None):
         """Receiver(name, address, port)
 
         Instantiates the Receiver. Start the service via
@@ -28,6 +87,16 @@ class Receiver(Flask):
         :param name:        Name of the receiver. (str)
         :param address:     Address to listen on. (str)
         :param port:        Port to listen on. (int)
+        :param server:      Server backend to use (see SERVERS). (str)
+        :param threads:     Number of worker threads (waitress) or concurrent
+                            greenlets (gevent). (int)
+        :param timeout:     Seconds until an inactive request is aborted
+                            (waitress, gevent). (int)
+        :param decoder:     The json decoder to use (see DECODERS). (str)
+        :param metrics:     The metrics to record in. (metrics.Metrics)
+        :param sock:        An already listening socket to accept on instead
+                            of address and port, e.g. shared by multiple
+                            workers. (socket.socket)
         """
         self.log = logging.getLogger(self.__class__.__name__)
 
@@ -36,31 +105,213 @@ class Receiver(Flask):
         self.name = name
         self.address = address
         self.port = port
+        self.sock = sock
         self.on_data = None
+        self.on_batch = None
+        self.status = 200
+        self.metrics = metrics
+
+        if server not in self.SERVERS:
+            raise ValueError("Unknown server backend '{}'.".format(server))
+        self.server = server
+        self.threads = threads
+        self.timeout = timeout
+
+        if decoder not in self.DECODERS:
+            raise ValueError("Unknown decoder '{}'.".format(decoder))
+        self.decode = self._load_decoder(self.DECODERS[decoder])
 
-    def listen(self, route, on_data):
+    def _load_decoder(self, modules):
+        """Return loads of the first importable module of *modules*."""
+        for module in modules:
+            try:
+                loads = import_module(module).loads
+            except ImportError:
+                continue
+            self.log.info("Decoding with '{}'.".format(module))
+            return loads
+        raise ImportError("No decoder available of: {}."
+                          .format(", ".join(modules)))
+
+    def listen(self, route, on_data, status=200, on_batch=None):
         """Listen on *route* and call *on_data*.
 
         :param route:       The path to listen on. (str)
         :param on_data:     The callback function. (func(json))
+        :param status:      The status to answer handled messages with, e.g.
+                            202 if they are only queued. (int)
+        :param on_batch:    The callback function for the messages of a
+                            batch, returning the error (or None) per message.
+                            (func(List[json]) -> List[str])
         """
         self.on_data = on_data
+        self.on_batch = on_batch
+        self.status = status
 
         self.route(route, methods=['POST'])(self.__handle_post)
-        self.run(host=self.address, port=self.port, debug=False)
+        self.log.info("Serving with '{}' backend.".format(self.server))
+        getattr(self, '_serve_{}'.format(self.server))()
+
+    def serve_metrics(self, route):
+        """Serve the metrics on *route* (GET).
+
+        :param route:       The path to serve the metrics on. (str)
+        """
+        self.route(route, methods=['GET'])(self.__handle_metrics)
+
+    def __handle_metrics(self):
+        return Response(self.metrics.render(), 200,
+                        mimetype='text/plain; version=0.0.4')
+
+    def _serve_flask(self):
+        """Serve with Flask's development server."""
+        if self.sock is None:
+            self.run(host=self.address, port=self.port, debug=False)
+            return
+        from werkzeug.serving import make_server
+        make_server(self.address, self.port, self,
+                    fd=self.sock.fileno()).serve_forever()
+
+    def _serve_waitress(self):
+        """Serve with waitress' multi-threaded WSGI server."""
+        from waitress import serve
+
+        if self.sock is None:
+            listen = {"host": self.address, "port": self.port}
+        else:
+            listen = {"sockets": [self.sock]}
+        serve(self, threads=self.threads, channel_timeout=self.timeout,
+              **listen)
+
+    def _serve_gevent(self):
+        """Serve with gevent's event-loop based WSGI server."""
+        from gevent import Timeout
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        def app(environ, start_response):
+            with Timeout(self.timeout):
+                return self(environ, start_response)
+
+        listener = (self.address, self.port)
+        if self.sock is not None:
+            # shared with other workers, which may accept a connection first
+            self.sock.setblocking(0)
+            listener = self.sock
+        WSGIServer(listener, app, spawn=Pool(self.threads),
+                   log=None).serve_forever()
 
     def __handle_post(self):
-        if 'application/json' in request.headers.get('Content-Type'):
+        content_type = request.headers.get('Content-Type', '')
+        if 'application/x-ndjson' in content_type:
+            return self.__handle_ndjson()
+        if 'application/json' in content_type:
             try:
-                data = request.json
-                # TODO build more sensible checks
-                data = json.loads(json.dumps(data))
+                data = self.__decode(request.get_data())
+                if not isinstance(data, (dict, list)):
+                    raise ValueError("No json object or array.")
+            except ValueError:
+                self.log.error("Failed to read POST-data.", exc_info=True)
+                self.__count("dropped", reason="invalid")
+                return Response('Bad Request', 400)
 
+            if isinstance(data, list):
+                return self.__handle_batch(enumerate(data), [])
+
+            self.__count("received")
+            try:
                 self.log.debug(data)
                 self.on_data(data)
+            except Overloaded as e:
+                self.log.warn("Overloaded, rejecting POST-data.")
+                return e.response()
             except Exception:
                 self.log.error("Failed to read POST-data.", exc_info=True)
                 return Response('Bad Request', 400)
 
-            return Response('OK', 200)
+            return Response('OK', self.status)
         return Response('Unsupported Media Type', 415)
+
+    def __handle_on_batch(self, batch, failed):
+        """Hand the (index, message) of *batch* to on_batch at once."""
+        try:
+            errors = self.on_batch([data for _, data in batch])
+        except Exception as e:
+            self.log.error("Failed to handle batch.", exc_info=True)
+            errors = [str(e)] * len(batch)
+        for (index, _), error in zip(batch, errors):
+            if error is not None:
+                failed.append({'index': index, 'error': error})
+
+    def __handle_ndjson(self):
+        """Decode the newline-delimited json body and handle it as batch."""
+        items = []
+        failed = []
+        lines = [line for line in request.get_data().splitlines()
+                 if line.strip()]
+        for index, line in enumerate(lines):
+            try:
+                items.append((index, self.__decode(line)))
+            except ValueError as e:
+                failed.append({'index': index, 'error': str(e)})
+                self.__count("dropped", reason="invalid")
+        return self.__handle_batch(items, failed)
+
+    def __decode(self, raw):
+        """Decode *raw* json, recording the latency."""
+        if self.metrics is None:
+            return self.decode(raw)
+        with self.metrics.timer("decode_seconds"):
+            return self.decode(raw)
+
+    def __count(self, name, **labels):
+        """Increase the counter *name*, if metrics are recorded."""
+        if self.metrics is not None:
+            self.metrics.inc(name, **labels)
+
+    def __handle_batch(self, items, failed):
+        """Handle every (index, message) of a batch on its own.
+
+        :param items:   The decoded messages. (Iter[Tuple[int, json]])
+        :param failed:  Failures so far. (List[Dict])
+        :returns:       A summary of the batch. (Response)
+        """
+        received = len(failed)
+        retry_after = None
+        # the status of overloaded messages, if all of them are
+        overloaded = []
+        # (index, message) for on_batch
+        batch = []
+        for index, data in items:
+            received += 1
+            if not isinstance(data, dict):
+                failed.append({'index': index, 'error': 'No json object.'})
+                self.__count("dropped", reason="invalid")
+                continue
+            self.__count("received")
+            if self.on_batch is not None:
+                batch.append((index, data))
+                continue
+            try:
+                self.on_data(data)
+            except Overloaded as e:
+                failed.append({'index': index, 'error': 'Overloaded'})
+                overloaded.append(e.status)
+                if e.retry_after is not None:
+                    retry_after = max(retry_after or 0, e.retry_after)
+            except Exception as e:
+                self.log.error(Lazy("Failed to handle item {} of batch.",
+                                    index), exc_info=True)
+                failed.append({'index': index, 'error': str(e)})
+        if batch:
+            self.__handle_on_batch(batch, failed)
+        failed.sort(key=lambda f: f['index'])
+        status = self.status
+        if overloaded and len(overloaded) == received:
+            status = max(overloaded)
+        response = Response(json.dumps({'received': received,
+                                        'failed': failed}),
+                            status, mimetype='application/json')
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""reloader.py
+
+Provides the Reloader, which reloads the mappings while the connector keeps
+running: on request (e.g. on SIGHUP) or once the files in the mappings
+directory change. The new mapper is built and validated in a background
+thread and only swapped in if that succeeds, so events are handled by the
+current mapper meanwhile and invalid mappings never replace valid ones.
+"""
+from mappingcache import signature
+
+import logging
+from threading import Event, Thread
+
+
+class Reloader(object):
+    """The mappings reloader.
+
+    See module description.
+    """
+
+    def __init__(self, location, build, swap, interval=0.0, metrics=None):
+        """Reloader(location, build, swap, interval, metrics)
+
+        Initialises the Reloader. Start watching via :meth:`start`.
+
+        :param location:    The mappings directory. (str)
+        :param build:       The function building the new mapper, raising
+                            if the mappings are invalid. (func())
+        :param swap:        The function swapping the new mapper in.
+                            (func(mapper.Mapper))
+        :param interval:    Seconds between checks of the directory for
+                            changes, only reloaded on request if 0. (float)
+        :param metrics:     The metrics to count reloads in.
+                            (metrics.Metrics)
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        self.location = location
+        self.build = build
+        self.swap = swap
+        self.interval = interval
+        self.metrics = metrics
+        self.signature = signature(location)
+        self.requested = Event()
+
+        self.thread = Thread(target=self._run, name="mappings-reload")
+        self.thread.daemon = True
+
+    def start(self):
+        """Start reloading in the background."""
+        self.thread.start()
+
+    def trigger(self):
+        """Request a reload, e.g. from a signal handler."""
+        self.requested.set()
+
+    def _run(self):
+        """Reload on request or change, forever."""
+        while True:
+            self.requested.wait(self.interval or None)
+            requested = self.requested.is_set()
+            self.requested.clear()
+            if requested or signature(self.location) != self.signature:
+                self.reload()
+
+    def reload(self):
+        """Build the new mapper and swap it in, if valid.
+
+        :returns:   True, if the mappings were reloaded. (bool)
+        """
+        current = signature(self.location)
+        try:
+            mapper = self.build()
+        except Exception as e:
+            self.log.error("Failed to reload the mappings, keeping the "
+                           "current ones: {}".format(e))
+            if self.metrics:
+                self.metrics.inc("mapping_reloads", result="failure")
+            # retry only once the files change again
+            self.signature = current
+            return False
+        self.swap(mapper)
+        self.signature = current
+        if self.metrics:
+            self.metrics.inc("mapping_reloads", result="success")
+        self.log.info("Mappings reloaded.")
+        return True
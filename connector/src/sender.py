@@ -3,15 +3,44 @@
 
 Provides the Sender, which wraps Broker to send messages to the associated
 communication partner.
+
+The slaves to send to are looked up in the "connectors" datastore (a
+comma-separated list) by a background thread, which also repeers on changes.
+Meanwhile, messages keep flowing to the current slaves or the master.
+
+Messages are distributed among the slaves by consistent hashing on a key,
+e.g. the attacker address: all messages of an attacker go to the same slave
+and only the keys of added or removed slaves move.
+
+Endpoints, peering and the connection state are provided by a transport
+(see :mod:`transport`), by default via Broker.
+
+Optionally, messages are batched: they are collected and flushed as a single
+Broker message (the batch event, a vector of all messages and the connector
+id), once either the batch size or the maximum latency is reached.
+
+If a spool is given, messages which cannot be sent for lack of a connection
+are spooled to disk and replayed (at a limited rate) by a background thread
+once a connection is established again.
+
+The outcome (sent, spooled or dropped) is counted per event and mapping once
+a message (or the batch holding it) is actually handed over.
 """
 # The following import _must_ not be made, otherwise some python binding calls
 # for broker distributed datastores do not work anymore. The import is left
 # commented-out to avoid someone trapping in this issue.
 # from __future__ import unicode_literals
 
+from hashring import HashRing
+from logs import Lazy
+from transport import BrokerTransport, Transport, parse_slaves
+
 import pybroker as broker
+from collections import Counter
+from itertools import count
 import logging
-from time import sleep
+from threading import Event, Lock, Thread
+from time import sleep, time
 
 
 class Sender(object):
@@ -20,9 +49,18 @@ class Sender(object):
     Sends Broker messages to an Broker endpoint.
     """
 
+    # name of the master endpoint of the transport
+    MASTER = Transport.MASTER
+    # seconds to retry replaying after, without a change of the connections
+    # (e.g. if the replay failed, as the chosen slave was unreachable)
+    REPLAY_RETRY = 10.0
+
     def __init__(self, master_address, master_port,
                  broker_endpoint, broker_topic,
-                 connector_id):
+                 connector_id, spool=None, replay_rate=100,
+                 slave_refresh=1.0, batch_size=0, batch_latency=0.5,
+                 batch_event="Beemaster::connector_batch", metrics=None,
+                 transport=None):
         """Sender(master_address, port)
 
         Initialises the Sender. The master_address/port are used to peer to the
@@ -35,113 +73,273 @@ class Sender(object):
                                    connecting to the master. (str)
         :param broker_topic:       The broker topic to send to. (str)
         :param connector_id:       The connector ID. (str)
+        :param spool:              The spool to use while disconnected.
+                                   (spool.Spool)
+        :param replay_rate:        Maximum number of spooled messages to
+                                   replay per second. (int)
+        :param slave_refresh:      Seconds between lookups of the slaves to
+                                   send to. (float)
+        :param batch_size:         Number of messages per batch, batching is
+                                   disabled if 0. (int)
+        :param batch_latency:      Maximum seconds a message waits in a
+                                   batch, positive if batching. (float)
+        :param batch_event:        Event name of batch messages. (str)
+        :param metrics:            The metrics to count sent, spooled and
+                                   dropped events in. (metrics.Metrics)
+        :param transport:          The transport to send with, Broker
+                                   endpoints peered with the master if None.
+                                   (transport.Transport)
+        :raises ValueError: If batching without positive batch_latency.
         """
         self.log = logging.getLogger(self.__class__.__name__)
 
+        if batch_size and batch_latency <= 0:
+            raise ValueError("Invalid batch latency '{}', must be positive."
+                             .format(batch_latency))
+
         self.master_name = "{}:{}".format(master_address, master_port)
-        # these variables cannot be passed by reference -> "getter / setter"
-        self.master_status = broker.incoming_connection_status.tag_established
-        self.slave_status = broker.incoming_connection_status.tag_established
 
         self.broker_topic = broker_topic
         self.broker_endpoint = broker_endpoint
         self.connector_id = connector_id
+        self.metrics = metrics
+
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.replay_event = Event()
 
-        self.connector_to_master = broker.endpoint(broker_endpoint)
-        # Peer with broker endpoint of bro master instance
-        self.connector_to_master.peer(master_address, master_port, 1)
+        if transport is None:
+            transport = BrokerTransport(master_address, master_port,
+                                        broker_endpoint, connector_id)
+        self.transport = transport
 
-        # dedicated endpoint for sending to slaves
-        self.connector_to_slave = broker.endpoint(connector_id)
-        # note: "connectors" is the name of the distributed datastore
-        self.balanced_slaves = broker.clone_create(self.connector_to_master,
-                                                   "connectors", 1)
-        self.connector_to_slave_peering = None
-        self.current_slave = self._lookup_and_get_current_slave()
-        if self.current_slave:
-            self.connector_to_slave_peering = self._peer_connector_to_slave()
+        # the looked up value, the peered slaves and the ring among them
+        self.current_slave = None
+        self.slaves = []
+        self.ring = None
+        # spreads messages without key among the slaves
+        self.rotation = count()
+        self._repeer_connector_to_slave()
+
+        self.transport.on_change(self._on_connection_change)
+        self.transport.start()
+
+        if self.spool:
+            self.replayer = Thread(target=self._replay_spool,
+                                   name="sender-spool-replay")
+            self.replayer.daemon = True
+            self.replayer.start()
+
+        self.slave_refresh = slave_refresh
+        self.refresher = Thread(target=self._refresh_slave,
+                                name="sender-slave-refresh")
+        self.refresher.daemon = True
+        self.refresher.start()
+
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.batch_event = batch_event
+        # slave -> (start, messages, their mapping names)
+        self.batches = {}
+        self.batch_lock = Lock()
+        if self.batch_size:
+            self.flusher = Thread(target=self._flush_batches,
+                                  name="sender-batch-flush")
+            self.flusher.daemon = True
+            self.flusher.start()
 
         # TODO: provide a channel to accept commands (change config etc.)
 
-    def send(self, msg):
+    def send(self, msg, key=None, mapping=None):
         """Send the Broker message to the peer.
 
-        :param msg: The message to be sent. (Broker message)
+        :param msg:     The message to be sent. (Broker message)
+        :param key:     The key to choose the slave by, e.g. the attacker
+                        address. Messages without key are spread evenly.
+                        (str)
+        :param mapping: The name of the mapping of the message, to count
+                        its outcome by. (str)
         """
+        slave = self._select(key)
+        if self.batch_size:
+            self._add_to_batch(msg, mapping, slave)
+            return
         msg.append(broker.data(self.connector_id))
-        try:
-            self._repeer_connector_to_slave()
+        self._dispatch(msg, [mapping], slave)
+
+    def _select(self, key):
+        """Return the slave for *key* or None, if no slave is peered."""
+        # read once, the refresher may change it in the meantime
+        ring = self.ring
+        if not ring:
+            return None
+        if key is None:
+            return ring.nodes[next(self.rotation) % len(ring)]
+        return ring.get(key)
+
+    def batch_depth(self):
+        """Return the number of messages waiting in batches."""
+        with self.batch_lock:
+            return sum(len(events) for _, events, _ in self.batches.values())
+
+    def _add_to_batch(self, msg, mapping, slave):
+        """Add the message to the batch of *slave* and flush it, if full."""
+        event = broker.data(broker.vector_of_data(list(msg)))
+        with self.batch_lock:
+            batch = self.batches.get(slave)
+            if batch is None:
+                batch = self.batches[slave] = (time(), [], [])
+            batch[1].append(event)
+            batch[2].append(mapping)
+            if len(batch[1]) < self.batch_size:
+                return
+            del self.batches[slave]
+        self._send_batch(batch[1], batch[2], slave)
+
+    def _flush_batches(self):
+        """Flush batches reaching the maximum latency, forever."""
+        while True:
+            due = []
+            wait = self.batch_latency
+            with self.batch_lock:
+                now = time()
+                for slave, (started, events, mappings) in \
+                        self.batches.items():
+                    age = now - started
+                    if age >= self.batch_latency:
+                        due.append((slave, events, mappings))
+                        del self.batches[slave]
+                    else:
+                        wait = min(wait, self.batch_latency - age)
+            for slave, events, mappings in due:
+                self._send_batch(events, mappings, slave)
+            if not due:
+                sleep(wait)
 
-            if self.current_slave:
-                self.log.info("Sending to {}".format(self.current_slave))
-                self._send_to_bro(self.connector_to_slave, False, msg)
+    def _send_batch(self, batch, mappings, slave):
+        """Send the batched messages as one Broker message."""
+        msg = broker.message()
+        msg.append(broker.data(self.batch_event))
+        msg.append(broker.data(broker.vector_of_data(batch)))
+        msg.append(broker.data(self.connector_id))
+        self.log.debug(Lazy("Flushing batch of {} messages.", len(batch)))
+        if slave not in self.slaves:
+            # the slave was removed while the batch was collected
+            slave = self._select(None)
+        self._dispatch(msg, mappings, slave)
+
+    def _dispatch(self, msg, mappings, slave):
+        """Send the message to *slave* or, without slave, to the master.
+
+        *mappings* are the mapping names of the events in the message.
+        """
+        try:
+            if slave:
+                self.log.info(Lazy("Sending to {}", slave))
+                self._send_to_bro(slave, msg, mappings)
             else:
-                self.log.warn("Not peered with any slave, falling back to "
-                              "master: {}".format(self.master_name))
-                self._send_to_bro(self.connector_to_master, True, msg)
+                self.log.warn(Lazy("Not peered with any slave, falling back "
+                                   "to master: {}", self.master_name))
+                self._send_to_bro(self.MASTER, msg, mappings)
         except Exception, e:
-            local_endpoint = self.current_slave or self.master_name
-            self.log.error("Error sending data from {} to {}. Exception: {}"
-                           .format(self.broker_endpoint, local_endpoint, str(e)
-                                   ))
-
-    def _send_to_bro(self, bro_endpoint, is_master, msg):
-        """Send message if connection is established, log warning otherwise"""
-        if self._bro_connection_established(bro_endpoint, is_master):
-            bro_endpoint.send(self.broker_topic, msg)
+            local_endpoint = slave or self.master_name
+            self.log.error(Lazy("Error sending data from {} to {}. "
+                                "Exception: {}", self.broker_endpoint,
+                                local_endpoint, str(e)))
+            self._count("dropped", mappings, reason="error")
+
+    def _send_to_bro(self, name, msg, mappings):
+        """Send message if connection is established, spool it otherwise"""
+        if self.transport.established(name):
+            self.transport.send(name, self.broker_topic, msg)
+            self._count("sent", mappings)
+        elif self.spool:
+            self.log.debug("No connection established, spooling message.")
+            self.spool.append(msg)
+            self._count("spooled", mappings)
         else:
             self.log.warn("Sending failed - no connection established!")
+            self._count("dropped", mappings, reason="disconnected")
 
-    def _bro_connection_established(self, bro_endpoint, is_master):
-        """Return True if connection to master is established."""
-        # get bro endpoint connection status
-        status = self.master_status if is_master else self.slave_status
-        ocs = bro_endpoint.outgoing_connection_status()
-        for m in ocs.want_pop():  # Returns message only on change
-            status = m.status
-            # set the bro endpoint connection status variable
-            if is_master:
-                self.master_status = status
-            else:
-                self.slave_status = status
+    def _count(self, name, mappings, **labels):
+        """Count the events of *mappings* (names, None if unknown)."""
+        if not self.metrics:
+            return
+        for mapping, events in Counter(mappings).iteritems():
+            extra = {"mapping": mapping} if mapping is not None else {}
+            self.metrics.inc(name, events, **dict(labels, **extra))
+
+    def _on_connection_change(self, name, established):
+        """Trigger the replay of spooled messages on (re-)connection."""
+        if established and self.spool:
+            self.replay_event.set()
+
+    def _replay_spool(self):
+        """Replay spooled messages, limited to replay_rate per second."""
+        while True:
+            self.replay_event.wait(self.REPLAY_RETRY)
+            self.replay_event.clear()
+            while self.spool.pending():
+                name = self._select(None) or self.MASTER
 
-        return status == broker.incoming_connection_status.tag_established
+                def send(msg):
+                    if not self.transport.established(name):
+                        return False
+                    self.transport.send(name, self.broker_topic, msg)
+                    return True
+
+                replayed = self.spool.replay(send, self.replay_rate)
+                self.log.info("Replayed {} spooled messages.".format(replayed))
+                if not replayed:
+                    break
+                sleep(1)
+
+    def established_slaves(self):
+        """Return the number of slaves with an established connection."""
+        return sum(1 for slave in self.slaves
+                   if self.transport.established(slave))
 
     def _lookup_and_get_current_slave(self):
-        """Return the slave bro (name) that should be peered with"""
+        """Return the slave bros (names) that should be peered with"""
         current_slave = None
-        if self.balanced_slaves:
-            try:
-                current_slave = self.balanced_slaves.lookup(
-                    broker.data(self.broker_endpoint)).data().as_string()
-                self.log.debug("Lookup {} returns {}"
-                               .format(self.broker_endpoint, current_slave))
-            except Exception, e:
-                self.log.error("Error looking up slave on connector '{}'. "
-                               "Error: '{}'".format(
-                                   self.broker_endpoint, str(e)))
+        try:
+            current_slave = self.transport.lookup_slave()
+            self.log.debug("Lookup {} returns {}"
+                           .format(self.broker_endpoint, current_slave))
+        except Exception, e:
+            self.log.error("Error looking up slave on connector '{}'. "
+                           "Error: '{}'".format(self.broker_endpoint, str(e)))
         return current_slave
 
-    def _peer_connector_to_slave(self):
-        """Return the peer"""
-        slave_ip = self.current_slave[len("bro-slave-"):].split(":")[0]
-        slave_port = self.current_slave[len("bro-slave-"):].split(":")[1]
-        return self.connector_to_slave.peer(slave_ip, int(slave_port), 1)
+    def _refresh_slave(self):
+        """Look up the slaves and repeer, if necessary, forever."""
+        while True:
+            sleep(self.slave_refresh)
+            try:
+                self._repeer_connector_to_slave()
+            except Exception, e:
+                self.log.error("Error repeering connector '{}'. Error: '{}'"
+                               .format(self.broker_endpoint, str(e)))
 
     def _repeer_connector_to_slave(self):
-        """Repeer the connector to the slave bro if necessary"""
+        """Repeer the connector to the slave bros if necessary"""
         current_slave = self._lookup_and_get_current_slave()
-        if current_slave != self.current_slave:
-            # update the receiver, so repeer
-            self.current_slave = current_slave
-            if self.current_slave:
-                self.log.info("Repeering with {}".format(self.current_slave))
-                if self.connector_to_slave_peering:
-                    self.connector_to_slave.unpeer(
-                        self.connector_to_slave_peering)
-                self.connector_to_slave_peering = \
-                    self._peer_connector_to_slave()
-                sleep(0.1)  # repeering may take a moment, make sure..
-            else:
-                self.log.warn("No slave peered anymore.")
-                self.connector_to_slave.unpeer(self.connector_to_slave_peering)
+        if current_slave == self.current_slave:
+            return
+        slaves = parse_slaves(current_slave)
+        added = [slave for slave in slaves if slave not in self.slaves]
+        removed = [slave for slave in self.slaves if slave not in slaves]
+        for slave in added:
+            self.log.info("Peering with {}".format(slave))
+            self.transport.peer_slave(slave)
+        if added:
+            sleep(0.1)  # peering may take a moment, make sure..
+        # switch before unpeering, so no new message goes to removed slaves
+        self.ring = HashRing(slaves) if slaves else None
+        self.slaves = slaves
+        self.current_slave = current_slave
+        for slave in removed:
+            self.log.info("Unpeering from {}".format(slave))
+            self.transport.unpeer_slave(slave)
+        if not slaves:
+            self.log.warn("No slave peered anymore.")
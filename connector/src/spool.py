@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""spool.py
+
+Provides the Spool, an append-only store for Broker messages which could not
+be sent. Messages are appended as json lines to segment files in a directory.
+Segments are rotated at a configurable size and the oldest segments are
+dropped if the spool exceeds its disk cap. Replaying reads the messages in
+order; a cursor file keeps track of the position across restarts.
+"""
+import pybroker as broker
+
+import json
+import logging
+import os
+from threading import RLock
+
+
+# type name -> (Broker data to json value, json value to Broker data)
+CODECS = {
+    "string": (lambda d: d.as_string(),
+               lambda v: broker.data(v.encode('utf8'))),
+    "count": (lambda d: d.as_count(),
+              lambda v: broker.data(int(v))),
+    "integer": (lambda d: d.as_integer(),
+                lambda v: broker.data(int(v))),
+    "real": (lambda d: d.as_real(),
+             lambda v: broker.data(float(v))),
+    "address": (lambda d: str(d.as_address()),
+                lambda v: broker.data(broker.address_from_string(str(v)))),
+    "time": (lambda d: d.as_time().value,
+             lambda v: broker.data(broker.time_point(v))),
+}
+
+
+def _encode_data(d):
+    """Return the Broker data *d* as [type name, json value]."""
+    name = TAGS[d.which()]
+    return [name, CODECS[name][0](d)]
+
+
+def _decode_data(item):
+    """Return the Broker data of [type name, json value] *item*."""
+    name, value = item
+    return CODECS[name][1](value)
+
+
+# vectors (e.g. the events of a batch) hold encoded items, recursively
+CODECS["vector"] = (
+    lambda d: [_encode_data(item) for item in d.as_vector()],
+    lambda v: broker.data(broker.vector_of_data(
+        [_decode_data(item) for item in v])))
+# Broker data tag -> type name
+TAGS = {getattr(broker.data, "tag_{}".format(name)): name
+        for name in CODECS}
+
+
+def encode(msg):
+    """Encode the Broker message *msg* to a json line.
+
+    :param msg:     The message to encode. (pybroker.Message)
+    :returns:       The encoded message. (str)
+    :raises LookupError:    If the message contains unsupported types.
+    """
+    return json.dumps([_encode_data(d) for d in msg])
+
+
+def decode(line):
+    """Decode a json line, as written by :func:`encode`.
+
+    :param line:    The encoded message. (str)
+    :returns:       The decoded message. (pybroker.Message)
+    """
+    msg = broker.message()
+    for item in json.loads(line):
+        msg.append(_decode_data(item))
+    return msg
+
+
+class Spool(object):
+    """The spool.
+
+    See module description.
+    """
+
+    SUFFIX = ".spool"
+    CURSOR = "cursor"
+
+    def __init__(self, directory, segment_size, max_size):
+        """Spool(directory, segment_size, max_size)
+
+        Initialises the Spool, resuming with the segments already present in
+        *directory*.
+
+        :param directory:       The directory to store segments in. (str)
+        :param segment_size:    Size in bytes to rotate segments at. (int)
+        :param max_size:        Maximum size in bytes of all segments. (int)
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.segments = sorted(int(f[:-len(self.SUFFIX)])
+                               for f in os.listdir(directory)
+                               if f.endswith(self.SUFFIX))
+        self.sizes = {s: os.path.getsize(self._path(s))
+                      for s in self.segments}
+        # a new segment is started on the first append, so a partially
+        # written line of a previous run is never continued
+        self.writer = None
+        self.lock = RLock()
+
+        # the replay position (segment, offset)
+        self.cursor = (self.segments[0], 0) if self.segments else None
+        try:
+            with open(os.path.join(directory, self.CURSOR), "r") as fd:
+                segment, offset = map(int, fd.read().split())
+            if segment in self.sizes:
+                self.cursor = (segment, offset)
+        except (IOError, ValueError):
+            pass
+
+    def _path(self, segment):
+        """Return the path of *segment*."""
+        return os.path.join(self.directory,
+                            "{:010d}{}".format(segment, self.SUFFIX))
+
+    def pending(self):
+        """Return True if there are messages left to replay."""
+        with self.lock:
+            if self.cursor is None:
+                return False
+            segment, offset = self.cursor
+            return segment != self.segments[-1] or \
+                offset < self.sizes[segment]
+
+    def append(self, msg):
+        """Append the Broker message *msg* to the spool.
+
+        :param msg:     The message to append. (pybroker.Message)
+        """
+        line = encode(msg) + "\n"
+        with self.lock:
+            if self.writer is None or \
+                    self.sizes[self.segments[-1]] >= self.segment_size:
+                self._rotate()
+            self.writer.write(line)
+            self.writer.flush()
+            self.sizes[self.segments[-1]] += len(line)
+            if self.cursor is None:
+                self.cursor = (self.segments[-1], 0)
+            self._enforce_cap()
+
+    def _rotate(self):
+        """Start a new segment."""
+        if self.writer:
+            self.writer.close()
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.writer = open(self._path(segment), "a")
+
+    def _enforce_cap(self):
+        """Drop the oldest segments while the spool exceeds its cap."""
+        while len(self.segments) > 1 and \
+                sum(self.sizes.itervalues()) > self.max_size:
+            segment = self.segments[0]
+            self.log.warn("Spool exceeds {} bytes, dropping segment {}."
+                          .format(self.max_size, segment))
+            self._remove(segment)
+            if self.cursor[0] == segment:
+                self.cursor = (self.segments[0], 0)
+
+    def _remove(self, segment):
+        """Remove the (fully replayed or dropped) *segment*."""
+        self.segments.remove(segment)
+        del self.sizes[segment]
+        os.remove(self._path(segment))
+
+    def replay(self, send, limit):
+        """Replay up to *limit* messages in order.
+
+        The messages are read in chunks under the lock, but sent without it,
+        so appending is not blocked meanwhile. The cursor is advanced past
+        the sent messages only.
+
+        :param send:    Function to send a message with, returns False if the
+                        message could not be sent. (func(pybroker.Message))
+        :param limit:   Maximum number of messages to replay. (int)
+        :returns:       The number of replayed messages. (int)
+        """
+        replayed = 0
+        while replayed < limit:
+            with self.lock:
+                if not self.pending():
+                    break
+                segment, offset = self.cursor
+                lines, end = self._read(segment, offset, limit - replayed)
+            failed = False
+            for line in lines:
+                try:
+                    msg = decode(line)
+                except (LookupError, ValueError):
+                    self.log.error("Dropping undecodable message in "
+                                   "segment {}.".format(segment))
+                else:
+                    if not send(msg):
+                        failed = True
+                        break
+                    replayed += 1
+                offset += len(line)
+            with self.lock:
+                self._advance(segment, offset if failed or end is None
+                              else end)
+                if failed:
+                    break
+        with self.lock:
+            self._save_cursor()
+        return replayed
+
+    def _read(self, segment, offset, limit):
+        """Return up to *limit* lines of *segment* from *offset* on.
+
+        :returns:   The lines and the offset of the end of the segment, if
+                    reached, else None. (Tuple[List[str], int])
+        """
+        lines = []
+        with open(self._path(segment), "r") as fd:
+            fd.seek(offset)
+            while len(lines) < limit:
+                line = fd.readline()
+                if not line.endswith("\n"):
+                    # end of segment, skipping a partially written line of a
+                    # previous run
+                    return lines, self.sizes[segment]
+                lines.append(line)
+        return lines, None
+
+    def _advance(self, segment, offset):
+        """Move the cursor to *offset* of *segment*, once sent up to it."""
+        if segment not in self.sizes:
+            # dropped by the cap meanwhile, the cursor moved on already
+            return
+        if segment != self.segments[-1] and offset >= self.sizes[segment]:
+            self._remove(segment)
+            self.cursor = (self.segments[0], 0)
+        else:
+            self.cursor = (segment, offset)
+
+    def _save_cursor(self):
+        """Persist the replay position."""
+        if self.cursor is None:
+            return
+        with open(os.path.join(self.directory, self.CURSOR), "w") as fd:
+            fd.write("{} {}".format(*self.cursor))
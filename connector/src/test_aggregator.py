@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_aggregator
+
+Test the Aggregator.
+"""
+from aggregator import Aggregator
+from mapper import Mapper
+
+import unittest
+import yaml
+from copy import deepcopy
+
+
+class TestAggregator(unittest.TestCase):
+    """TestCases for aggregator.Aggregator"""
+
+    MAPPING = yaml.load("""
+        name: access
+        mapping:
+            timestamp: time_point
+            src_ip: address
+            src_port: port_count
+            dst_port: port_count
+            protocol: string
+        message:
+            - timestamp
+            - src_ip
+            - src_port
+            - dst_port
+            - protocol
+        aggregate:
+            key: [src_ip, dst_port, protocol]
+            window: 10
+    """)
+
+    def setUp(self):
+        """Create an Aggregator with a manual clock"""
+        self.now = 1000.0
+        self.sent = []
+        self.mapper = Mapper([self.MAPPING])
+        self.aggregator = Aggregator(
+            lambda converter, message, key:
+                self.sent.append((converter.name, message, key)),
+            max_keys=2, clock=lambda: self.now)
+
+    def event(self, second, src_port=1234, src_ip="10.0.0.1"):
+        """Return (converter, message, data) of an access event"""
+        data = {"timestamp": "2017-01-01T00:00:{:02}.000000".format(second),
+                "src_ip": src_ip, "src_port": src_port, "dst_port": 445,
+                "protocol": "smbd"}
+        converter, message = self.mapper.convert(data)
+        return converter, message, data
+
+    def testSuccessSummary(self):
+        """Test events of a key are collapsed once the window ends"""
+        for second in range(3):
+            converter, message, data = self.event(second, 1000 + second)
+            self.assertTrue(self.aggregator.add(converter, message, data,
+                                                "10.0.0.1"))
+        self.assertEqual(self.aggregator.pending(), 1)
+
+        self.now += 9
+        self.aggregator.flush()
+        self.assertEqual(self.sent, [])
+        self.now += 1
+        self.aggregator.flush()
+        self.assertEqual(self.aggregator.pending(), 0)
+
+        self.assertEqual(len(self.sent), 1)
+        name, summary, key = self.sent[0]
+        self.assertEqual((name, key), ("access", "10.0.0.1"))
+        self.assertEqual([str(d) for d in summary[:5]],
+                         ["access_summary", "10.0.0.1", "445", "smbd", "3"])
+        self.assertEqual([d.as_time().value for d in summary[5:]],
+                         [1483228800.0, 1483228802.0])
+
+    def testSuccessSingleEvent(self):
+        """Test a single event of a window is sent as is"""
+        converter, message, data = self.event(0)
+        self.aggregator.add(converter, message, data)
+        self.aggregator.flush(force=True)
+        self.assertEqual(self.sent, [("access", message, None)])
+
+    def testSuccessKeysSeparated(self):
+        """Test events of different keys are aggregated separately"""
+        for src_ip in ("10.0.0.1", "10.0.0.2", "10.0.0.1"):
+            self.aggregator.add(*self.event(0, src_ip=src_ip))
+        self.assertEqual(self.aggregator.pending(), 2)
+        self.aggregator.flush(force=True)
+        self.assertEqual(sorted(len(message) for _, message, _ in self.sent),
+                         [6, 7])
+
+    def testSuccessNotConfigured(self):
+        """Test events of mappings without aggregate pass through"""
+        mapping = deepcopy(self.MAPPING)
+        del mapping["aggregate"]
+        self.mapper = Mapper([mapping])
+        self.assertFalse(self.aggregator.add(*self.event(0)))
+        self.assertEqual(self.aggregator.pending(), 0)
+
+    def testFailureMaxKeys(self):
+        """Test events of further keys pass through if too many are open"""
+        for src_ip in ("10.0.0.1", "10.0.0.2"):
+            self.assertTrue(self.aggregator.add(*self.event(0, src_ip=src_ip)))
+        self.assertFalse(self.aggregator.add(*self.event(0, src_ip="::1")))
+        # known keys are still aggregated
+        self.assertTrue(self.aggregator.add(*self.event(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_cache
+
+Test the LRUCache.
+"""
+from cache import LRUCache
+
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+    """TestCases for cache.LRUCache"""
+
+    def testSuccessHitMiss(self):
+        """Test values are returned and hits/misses counted"""
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b", 2), 2)
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def testSuccessEviction(self):
+        """Test the least recently used entry is evicted"""
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def testSuccessDisabled(self):
+        """Test nothing is cached with size 0"""
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_filters
+
+Test the Filter.
+"""
+from filters import Filter, PrefixTrie
+from mapper import Mapper
+
+import unittest
+import yaml
+
+
+class TestPrefixTrie(unittest.TestCase):
+    """TestCases for filters.PrefixTrie"""
+
+    def testSuccessLookup(self):
+        """Test the masks of all containing prefixes are united"""
+        trie = PrefixTrie()
+        trie.add("10.0.0.0/8", 1)
+        trie.add("10.1.2.3", 2)
+        trie.add("2001:db8::/32", 4)
+        self.assertEqual(trie.lookup("10.1.2.3"), 3)
+        self.assertEqual(trie.lookup("10.1.2.4"), 1)
+        self.assertEqual(trie.lookup("11.0.0.1"), 0)
+        self.assertEqual(trie.lookup("2001:db8::1"), 4)
+        self.assertEqual(trie.lookup("2001:db9::1"), 0)
+
+    def testSuccessMappedAddress(self):
+        """Test IPv4-mapped IPv6 addresses match IPv4 networks"""
+        trie = PrefixTrie()
+        trie.add("192.168.0.0/16", 1)
+        trie.add("::ffff:10.0.0.0/104", 2)
+        self.assertEqual(trie.lookup("::ffff:192.168.1.1"), 1)
+        self.assertEqual(trie.lookup("10.9.8.7"), 2)
+
+    def testFailureInvalid(self):
+        """Test invalid networks and addresses are rejected"""
+        trie = PrefixTrie()
+        for network in ("10.0.0.0/33", "10.0.0/8", "foo"):
+            with self.assertRaises(ValueError):
+                trie.add(network, 1)
+        with self.assertRaises(ValueError):
+            trie.lookup("10.0.0.256")
+
+
+class TestFilter(unittest.TestCase):
+    """TestCases for filters.Filter"""
+
+    MAPPINGS = [yaml.load(open(path)) for path in
+                ('mappings/dionaea/access.yaml',
+                 'mappings/dionaea/blackhole.yaml')]
+
+    ACCESS = {"timestamp": "2017-01-01T00:00:00.000000",
+              "src_hostname": "", "src_ip": "10.0.0.1", "src_port": 4242,
+              "dst_ip": "192.168.0.1", "dst_port": 445,
+              "connection": {"type": "accept", "protocol": "smbd",
+                             "transport": "tcp"}}
+    BLACKHOLE = {"timestamp": "2017-01-01T00:00:00.000000",
+                 "origin": "dionaea", "name": "blackhole",
+                 "data": {"input": "", "length": 0,
+                          "connection": {"id": "1", "local_ip": "192.168.0.1",
+                                         "local_port": 1434,
+                                         "remote_ip": "10.0.0.1",
+                                         "remote_port": 4242,
+                                         "remote_hostname": "",
+                                         "protocol": "pcap",
+                                         "transport": "udp"}}}
+
+    def setUp(self):
+        """Create the Mapper to match the events with"""
+        self.mapper = Mapper(self.MAPPINGS)
+
+    def check(self, event_filter, data):
+        """Return the result of *event_filter* for *data*"""
+        return event_filter.check(self.mapper.match(data), data)
+
+    def testSuccessDeny(self):
+        """Test events matching all conditions of a deny rule are denied"""
+        event_filter = Filter(deny=[{"src": ["10.0.0.0/8"],
+                                     "dst_port": ["1-1000"]}])
+        self.assertEqual(self.check(event_filter, self.ACCESS), "denied")
+        # dst_port of the blackhole event is local_port
+        self.assertIsNone(self.check(event_filter, self.BLACKHOLE))
+
+    def testSuccessAllowOverridesDeny(self):
+        """Test events matching an allow rule pass"""
+        event_filter = Filter(allow=[{"src": "10.0.0.1",
+                                      "mapping": "Beemaster::dionaea_access"}],
+                              deny=[{"src": ["10.0.0.0/8"]}])
+        self.assertIsNone(self.check(event_filter, self.ACCESS))
+        self.assertEqual(self.check(event_filter, self.BLACKHOLE), "denied")
+
+    def testSuccessDefaultDeny(self):
+        """Test only allowed events pass with the default policy deny"""
+        event_filter = Filter(allow=[{"dst_port": [1434]}], default="deny")
+        self.assertEqual(self.check(event_filter, self.ACCESS), "denied")
+        self.assertIsNone(self.check(event_filter, self.BLACKHOLE))
+        self.assertEqual(event_filter.check(None, {}), "denied")
+
+    def testSuccessSample(self):
+        """Test only every n-th event of sampled mappings is kept"""
+        event_filter = Filter(sample={"Beemaster::dionaea_blackhole": 3})
+        results = [self.check(event_filter, self.BLACKHOLE) for _ in range(6)]
+        self.assertEqual(results, [None, "sampled", "sampled"] * 2)
+        self.assertIsNone(self.check(event_filter, self.ACCESS))
+
+    def testFailureInvalidRules(self):
+        """Test invalid rules, policies and rates are rejected"""
+        for kwargs in ({"deny": [{"source": "10.0.0.0/8"}]},
+                       {"deny": [{"dst_port": "80-70000"}]},
+                       {"default": "reject"},
+                       {"sample": {"Beemaster::dionaea_access": 0}}):
+            with self.assertRaises(ValueError):
+                Filter(**kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_hashring
+
+Test the HashRing.
+"""
+from hashring import HashRing
+
+import unittest
+
+from collections import Counter
+
+
+class TestHashRing(unittest.TestCase):
+    """TestCases for hashring.HashRing"""
+
+    NODES = ["bro-slave-10.0.0.{}:9999".format(i) for i in range(4)]
+    KEYS = ["192.168.{}.{}".format(i // 256, i % 256) for i in range(4000)]
+
+    def testSuccessStable(self):
+        """Test a key always maps to the same node"""
+        ring = HashRing(self.NODES)
+        other = HashRing(reversed(self.NODES))
+        for key in self.KEYS[:100]:
+            self.assertEqual(ring.get(key), ring.get(key))
+            self.assertEqual(ring.get(key), other.get(key))
+        self.assertEqual(ring.get(u"192.168.0.1"), ring.get("192.168.0.1"))
+
+    def testSuccessEvenSpread(self):
+        """Test keys spread evenly among the nodes"""
+        ring = HashRing(self.NODES)
+        counts = Counter(ring.get(key) for key in self.KEYS)
+        self.assertEqual(set(counts), set(self.NODES))
+        for count in counts.values():
+            self.assertLess(abs(count - 1000), 250)
+
+    def testSuccessMinimalMovement(self):
+        """Test removing a node only moves the keys of that node"""
+        ring = HashRing(self.NODES)
+        smaller = HashRing(self.NODES[:-1])
+        for key in self.KEYS:
+            if ring.get(key) != self.NODES[-1]:
+                self.assertEqual(ring.get(key), smaller.get(key))
+
+    def testFailureEmpty(self):
+        """Test an empty ring maps to no node"""
+        ring = HashRing([])
+        self.assertEqual(len(ring), 0)
+        self.assertIsNone(ring.get("192.168.0.1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
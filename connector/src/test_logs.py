@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_logs
+
+Test the logging helpers.
+"""
+from logs import Lazy, RepeatFilter
+
+import unittest
+import logging
+from time import sleep
+
+
+class Unprintable(object):
+    """Object failing to format"""
+
+    def __format__(self, spec):
+        """Fail"""
+        raise AssertionError("formatted")
+
+
+class Collector(logging.Handler):
+    """Handler collecting the emitted messages"""
+
+    def __init__(self):
+        """Initialise the handler without messages"""
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        """Collect the message of *record*"""
+        self.messages.append(record.getMessage())
+
+
+class TestLogs(unittest.TestCase):
+    """TestCases for logs.Lazy and logs.RepeatFilter"""
+
+    @staticmethod
+    def _record(msg, level=logging.WARNING, name="test"):
+        """Create a log record"""
+        return logging.LogRecord(name, level, __file__, 0, msg, (), None)
+
+    def testLazyFormat(self):
+        """Test messages are formatted on demand only"""
+        lazy = Lazy("{} and {x}", 1, x=2)
+        self.assertEqual(str(lazy), "1 and 2")
+
+        log = logging.getLogger("test_logs")
+        log.setLevel(logging.ERROR)
+        log.debug(Lazy("{}", Unprintable()))
+
+    def testRepeatFilterCollapse(self):
+        """Test repetitions are suppressed and counted"""
+        repeat_filter = RepeatFilter(60)
+        self.assertTrue(repeat_filter.filter(self._record(Lazy("a {}", 1))))
+        self.assertFalse(repeat_filter.filter(self._record(Lazy("a {}", 2))))
+        self.assertFalse(repeat_filter.filter(self._record(Lazy("a {}", 3))))
+
+        # other messages, levels and loggers are unaffected
+        self.assertTrue(repeat_filter.filter(self._record("b")))
+        self.assertTrue(repeat_filter.filter(
+            self._record(Lazy("a {}", 1), logging.ERROR)))
+        self.assertTrue(repeat_filter.filter(
+            self._record(Lazy("a {}", 1), name="other")))
+        self.assertTrue(repeat_filter.filter(
+            self._record(Lazy("a {}", 1), logging.INFO)))
+
+    def testRepeatFilterSummary(self):
+        """Test the first record after the interval carries the count"""
+        repeat_filter = RepeatFilter(0.05)
+        repeat_filter.filter(self._record("a"))
+        repeat_filter.filter(self._record("a"))
+        repeat_filter.filter(self._record("a"))
+
+        repeat_filter.timer.cancel()
+        repeat_filter.seen.values()[0][0] -= 1
+        record = self._record("a")
+        self.assertTrue(repeat_filter.filter(record))
+        self.assertTrue(record.getMessage().startswith(
+            "a [2 similar messages suppressed"))
+
+    def testRepeatFilterFlush(self):
+        """Test suppressed records are logged once the interval ends"""
+        repeat_filter = RepeatFilter(0.05)
+        handler = Collector()
+        handler.addFilter(repeat_filter)
+        log = logging.getLogger("test_logs_flush")
+        log.propagate = False
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+
+        for i in range(3):
+            log.warn(Lazy("a {}", i))
+        self.assertEqual(handler.messages, ["a 0"])
+
+        sleep(0.3)
+        self.assertEqual(len(handler.messages), 2)
+        self.assertTrue(handler.messages[1].startswith(
+            "a 2 [2 similar messages suppressed"))
+        self.assertEqual(repeat_filter.seen, {})
+        self.assertIsNone(repeat_filter.timer)
+
+        # the next record starts a new interval
+        log.warn(Lazy("a {}", 3))
+        self.assertEqual(handler.messages[-1], "a 3")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -223,6 +223,156 @@ class TestMapper(unittest.TestCase):
         mapper = Mapper([mapping])
         self.assertIsNone(mapper.transform(self.VALID_INPUT_PLAIN))
 
+    def testFailureUnproducibleItem(self):
+        """Test mappings are ignored if a message item is not mapped."""
+        mapping = deepcopy(self.VALID_MAPPING_PLAIN)
+        mapping["message"].append("unmapped")
+        mapper = Mapper([mapping])
+        self.assertEqual(mapper.converters, [])
+        self.assertIsNone(mapper.transform(self.VALID_INPUT_PLAIN))
+
+    def testTimePointFastPath(self):
+        """Test the fast timestamp path equals the strptime path."""
+        for inp in ("2017-01-01T00:00:00.000000", "2017-03-04T12:34:56.5",
+                    "1999-12-31T23:59:59.999999", u"2016-02-29T01:02:03.04",
+                    "1970-01-01T00:00:00.000001"):
+            self.assertEqual(Mapper._map_time_point(inp).value,
+                             Mapper._map_time_point_generic(inp).value)
+            # now from the cache
+            self.assertEqual(Mapper._map_time_point(inp).value,
+                             Mapper._map_time_point_generic(inp).value)
+
+    def testTimePointInvalid(self):
+        """Test invalid timestamps are rejected on both paths."""
+        for inp in ("2017-02-30T00:00:00.000000", "2017-01-01T24:00:00.0",
+                    "2017-01-01T00:00:00", "2017-01-01T00:00:00.1234567",
+                    "2017-01-01T00:00:00.5\n", "asdkfasdf"):
+            self.assertRaises(ValueError, Mapper._map_time_point, inp)
+
+    def testAddressCache(self):
+        """Test converted addresses are cached and shared by all mappings."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN, self.VALID_MAPPING_NESTED])
+
+        self.testPlainMapSuccess(mapper)
+        self.testNestedMapSuccess(mapper)
+
+        self.assertEqual(len(mapper.addresses), 2)
+        self.assertEqual(mapper.addresses.misses, 2)
+        self.assertEqual(mapper.addresses.hits, 2)
+
+    def testDispatchSingleCandidate(self):
+        """Test messages are dispatched to the matching mapping only."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN, self.VALID_MAPPING_NESTED])
+
+        for inp, mapping in ((self.VALID_INPUT_PLAIN,
+                              self.VALID_MAPPING_PLAIN),
+                             (self.VALID_INPUT_NESTED,
+                              self.VALID_MAPPING_NESTED)):
+            candidates = mapper._candidates(inp)
+            self.assertEqual(len(candidates), 1)
+            self.assertEqual(candidates[0][0].name, mapping['name'])
+
+    def testDispatchNegativeCache(self):
+        """Test shapes without any matching mapping are cached as well."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN])
+
+        unknown = {"some": "object", "no": {"mapping": 1}}
+        self.assertIsNone(mapper.transform(unknown))
+        self.assertEqual(mapper._dispatch, {Mapper._shape(unknown): []})
+        self.assertIsNone(mapper.transform(deepcopy(unknown)))
+        self.assertEqual(len(mapper._dispatch), 1)
+
+    def testMatch(self):
+        """Test the converter is matched without converting."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN])
+        self.assertEqual(mapper.match(self.VALID_INPUT_PLAIN),
+                         mapper.converters[0])
+        self.assertIsNone(mapper.match({"unknown": 1}))
+
+    def testTransformMany(self):
+        """Test batches are mapped like single events."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN, self.VALID_MAPPING_NESTED])
+        invalid = deepcopy(self.VALID_INPUT_PLAIN)
+        invalid["port"] = 70000
+        events = [self.VALID_INPUT_PLAIN, self.VALID_INPUT_NESTED,
+                  {"unknown": 1}, invalid, self.VALID_INPUT_PLAIN]
+
+        messages = mapper.transform_many(events)
+        self.assertEqual(len(messages), len(events))
+        for event, message in zip(events, messages):
+            expected = mapper.transform(event)
+            if expected is None:
+                self.assertIsNone(message)
+            else:
+                self.assertEqual([str(d) for d in message],
+                                 [str(d) for d in expected])
+        self.assertEqual([converter.name if converter else None
+                          for converter, _ in mapper.convert_many(events)],
+                         ["plain", "nested", None, None, "plain"])
+
+    def testTransformManyEqualValues(self):
+        """Test equal values of other types are mapped like single events."""
+        mapper = Mapper([self.VALID_MAPPING_PLAIN])
+        events = []
+        for value in (1, 1.0, True, u"1", "1"):
+            event = deepcopy(self.VALID_INPUT_PLAIN)
+            event["string"] = value
+            events.append(event)
+
+        messages = mapper.transform_many(events)
+        for event, message in zip(events, messages):
+            self.assertEqual([str(d) for d in message],
+                             [str(d) for d in mapper.transform(event)])
+        self.assertEqual(len({str(message[5]) for message in messages}), 3)
+
+    def testBalanceKey(self):
+        """Test the balance key is pulled from the configured item."""
+        mapping = deepcopy(self.VALID_MAPPING_NESTED)
+        mapping["balance"] = "ipv6"
+        mapper = Mapper([mapping])
+        converter, _ = mapper.convert(self.VALID_INPUT_NESTED)
+        self.assertEqual(converter.key(self.VALID_INPUT_NESTED),
+                         self.TEST_IPV6)
+
+    def testBalanceKeyDefault(self):
+        """Test the attacker address is the default balance key."""
+        mapper = Mapper([yaml.load(open(path)) for path in
+                         ('mappings/dionaea/access.yaml',
+                          'mappings/dionaea/login.yaml')])
+        keys = {}
+        for converter in mapper.converters:
+            keys[converter.name] = converter.key(
+                {"src_ip": self.TEST_IPV4,
+                 "data": {"connection": {"remote_ip": self.TEST_IPV6}}})
+        self.assertEqual(keys, {"Beemaster::dionaea_access": self.TEST_IPV4,
+                                "Beemaster::dionaea_login": self.TEST_IPV6})
+        # no balance item at all
+        self.assertIsNone(Mapper([self.VALID_MAPPING_PLAIN]).converters[0]
+                          .key(self.VALID_INPUT_PLAIN))
+
+    def testFailureBalanceItemNotInMessage(self):
+        """Test mappings are ignored if the balance item is unknown."""
+        mapping = deepcopy(self.VALID_MAPPING_PLAIN)
+        mapping["balance"] = "unknown"
+        self.assertEqual(Mapper([mapping]).converters, [])
+
+    def testPriority(self):
+        """Test the priority of mappings defaults to normal."""
+        mapping = deepcopy(self.VALID_MAPPING_PLAIN)
+        self.assertEqual(Mapper([mapping]).converters[0].priority, "normal")
+        mapping["priority"] = "high"
+        self.assertEqual(Mapper([mapping]).converters[0].priority, "high")
+        mapping["priority"] = "urgent"
+        self.assertEqual(Mapper([mapping]).converters, [])
+
+    def testFailureAggregateItemNotInMessage(self):
+        """Test mappings are ignored if an aggregation item is unknown."""
+        mapping = deepcopy(self.VALID_MAPPING_PLAIN)
+        mapping["aggregate"] = {"key": ["ipv4", "unknown"]}
+        self.assertEqual(Mapper([mapping]).converters, [])
+        mapping["aggregate"] = {"key": []}
+        self.assertEqual(Mapper([mapping]).converters, [])
+
 
 if __name__ == '__main__':
     logging.basicConfig(
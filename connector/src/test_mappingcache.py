@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_mappingcache
+
+Test the MappingCache.
+"""
+from mappingcache import MappingCache, signature
+
+import unittest
+
+import cPickle as pickle
+import json
+import os
+import shutil
+from tempfile import mkdtemp
+
+
+class Exploit(object):
+    """Creates a file, if unpickled"""
+
+    def __init__(self, path):
+        """Exploit(path)"""
+        self.path = path
+
+    def __reduce__(self):
+        """Unpickle as a call of open"""
+        return (open, (self.path, "w"))
+
+
+class TestMappingCache(unittest.TestCase):
+    """TestCases for mappingcache.MappingCache"""
+
+    MAPPINGS = [{"name": "access", "mapping": {"src_ip": "address"},
+                 "message": ["src_ip"]}]
+
+    def setUp(self):
+        """Create a mappings directory and the cache next to it"""
+        self.directory = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.location = os.path.join(self.directory, "mappings")
+        os.mkdir(self.location)
+        self.write("access.yaml", "name: access\n")
+        self.cache = MappingCache(os.path.join(self.directory, "cache"))
+
+    def write(self, name, content):
+        """Write *content* to the mapping file *name*"""
+        with open(os.path.join(self.location, name), "w") as f:
+            f.write(content)
+
+    def testSuccessHit(self):
+        """Test the mappings are cached while the files are unchanged"""
+        self.assertIsNone(self.cache.get(self.location,
+                                         signature(self.location)))
+        self.cache.put(self.location, signature(self.location),
+                       self.MAPPINGS)
+        self.assertEqual(self.cache.get(self.location,
+                                        signature(self.location)),
+                         self.MAPPINGS)
+        # no temporary file is left behind
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["cache", "mappings"])
+
+    def testSuccessMissOnChange(self):
+        """Test the cache is not used once a file changes or is added"""
+        self.cache.put(self.location, signature(self.location),
+                       self.MAPPINGS)
+        self.write("access.yaml", "name: access_changed\n")
+        self.assertIsNone(self.cache.get(self.location,
+                                         signature(self.location)))
+
+        self.cache.put(self.location, signature(self.location),
+                       self.MAPPINGS)
+        self.write("login.yaml", "name: login\n")
+        self.assertIsNone(self.cache.get(self.location,
+                                         signature(self.location)))
+
+    def testFailureCorrupt(self):
+        """Test corrupt cache files are ignored"""
+        with open(self.cache.path, "w") as f:
+            f.write("garbage")
+        self.assertIsNone(self.cache.get(self.location,
+                                         signature(self.location)))
+
+    def testSuccessCreateDirectory(self):
+        """Test the missing directory is created for the owner only"""
+        path = os.path.join(self.directory, "missing", "cache")
+        cache = MappingCache(path)
+        cache.put(self.location, signature(self.location), self.MAPPINGS)
+        self.assertEqual(cache.get(self.location, signature(self.location)),
+                         self.MAPPINGS)
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777,
+                         0o700)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def testFailurePickle(self):
+        """Test the cache is json, pickles are ignored without loading"""
+        self.cache.put(self.location, signature(self.location),
+                       self.MAPPINGS)
+        with open(self.cache.path) as f:
+            self.assertIsInstance(json.load(f), list)
+
+        marker = os.path.join(self.directory, "executed")
+        with open(self.cache.path, "wb") as f:
+            pickle.dump(Exploit(marker), f)
+        self.assertIsNone(self.cache.get(self.location,
+                                         signature(self.location)))
+        self.assertFalse(os.path.exists(marker))
+
+    def testFailureNotJson(self):
+        """Test mappings json cannot represent exactly are not cached"""
+        mappings = [{"name": "access", "mapping": {1: "address"}}]
+        self.cache.put(self.location, signature(self.location), mappings)
+        self.assertFalse(os.path.exists(self.cache.path))
+
+    def testFailureUnwritable(self):
+        """Test failing to write the cache is no error"""
+        # the parent of the cache file is a file
+        cache = MappingCache(os.path.join(self.location, "access.yaml",
+                                          "cache"))
+        cache.put(self.location, signature(self.location), self.MAPPINGS)
+        self.assertIsNone(cache.get(self.location, signature(self.location)))
+        self.assertEqual(sorted(os.listdir(self.location)), ["access.yaml"])
+
+
+if __name__ == '__main__':
+    unittest.main()
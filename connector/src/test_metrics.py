@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_metrics
+
+Test the Metrics.
+"""
+from metrics import Metrics
+
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    """TestCases for metrics.Metrics"""
+
+    def setUp(self):
+        """Create an empty registry"""
+        self.metrics = Metrics()
+
+    def testSuccessCounters(self):
+        """Test counters are summed per label set"""
+        self.metrics.inc("mapped", mapping="a")
+        self.metrics.inc("mapped", mapping="a")
+        self.metrics.inc("mapped", 3, mapping="b")
+        self.metrics.inc("unmapped")
+
+        rendered = self.metrics.render().splitlines()
+        self.assertIn("# TYPE connector_mapped_total counter", rendered)
+        self.assertIn('connector_mapped_total{mapping="a"} 2', rendered)
+        self.assertIn('connector_mapped_total{mapping="b"} 3', rendered)
+        self.assertIn("connector_unmapped_total 1", rendered)
+
+    def testSuccessHistogram(self):
+        """Test histogram buckets are cumulative"""
+        for seconds in (0.00005, 0.001, 0.002, 5):
+            self.metrics.observe("send_seconds", seconds)
+        with self.metrics.timer("send_seconds"):
+            pass
+
+        rendered = self.metrics.render().splitlines()
+        self.assertIn('connector_send_seconds_bucket{le="0.0001"} 2',
+                      rendered)
+        self.assertIn('connector_send_seconds_bucket{le="0.001"} 3',
+                      rendered)
+        self.assertIn('connector_send_seconds_bucket{le="1.0"} 4', rendered)
+        self.assertIn('connector_send_seconds_bucket{le="+Inf"} 5',
+                      rendered)
+        self.assertIn("connector_send_seconds_count 5", rendered)
+
+    def testSuccessGauges(self):
+        """Test gauges are evaluated on rendering"""
+        depth = [1]
+        self.metrics.gauge("queue_depth", lambda: depth[0])
+        self.metrics.gauge("connection_established", lambda: 1,
+                           endpoint='ma"ster')
+        depth[0] = 7
+
+        rendered = self.metrics.render().splitlines()
+        self.assertIn("connector_queue_depth 7", rendered)
+        self.assertIn('connector_connection_established{endpoint="ma\\"ster"}'
+                      ' 1', rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
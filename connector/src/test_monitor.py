@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_monitor
+
+Test the Monitor.
+"""
+from monitor import Monitor
+
+import unittest
+import pybroker as pb
+
+import os
+from collections import namedtuple
+from threading import Event
+
+Status = namedtuple("Status", ["status"])
+
+
+class StatusQueue(object):
+    """Status queue of an endpoint, readable via a pipe"""
+
+    def __init__(self):
+        """Create the queue"""
+        self.items = []
+        self.read_fd, self.write_fd = os.pipe()
+
+    def fd(self):
+        """Return the readable file descriptor"""
+        return self.read_fd
+
+    def push(self, status):
+        """Queue a status change"""
+        self.items.append(Status(status))
+        os.write(self.write_fd, "x")
+
+    def want_pop(self):
+        """Pop all queued changes"""
+        os.read(self.read_fd, len(self.items))
+        items, self.items = self.items, []
+        return items
+
+
+class Endpoint(object):
+    """Endpoint with a controllable outgoing connection status"""
+
+    def __init__(self):
+        """Create the endpoint"""
+        self.queue = StatusQueue()
+
+    def outgoing_connection_status(self):
+        """Return the status queue"""
+        return self.queue
+
+
+class TestMonitor(unittest.TestCase):
+    """TestCases for monitor.Monitor"""
+
+    TIMEOUT = 5
+
+    def setUp(self):
+        """Set up a monitor for a single endpoint, recording changes"""
+        self.changes = []
+        self.changed = Event()
+        self.endpoint = Endpoint()
+        self.monitor = Monitor(0.1)
+        self.monitor.add("ep", self.endpoint)
+        self.monitor.on_change(self.on_change)
+        self.monitor.start()
+
+    def on_change(self, name, established):
+        """Record change"""
+        self.changes.append((name, established))
+        self.changed.set()
+
+    def wait(self):
+        """Wait for a change"""
+        self.assertTrue(self.changed.wait(self.TIMEOUT))
+        self.changed.clear()
+
+    def testSuccessInitialState(self):
+        """Test endpoints are not established until reported"""
+        self.assertFalse(self.monitor.established("ep"))
+        self.assertFalse(self.monitor.established("unknown"))
+
+        # without any change, e.g. if the peer is unreachable from the start
+        self.endpoint.queue.push(pb.outgoing_connection_status
+                                 .tag_disconnected)
+        self.assertFalse(self.changed.wait(0.3))
+        self.assertFalse(self.monitor.established("ep"))
+
+        self.monitor.add("other", Endpoint(), established=True)
+        self.assertTrue(self.monitor.established("other"))
+
+    def testSuccessChanges(self):
+        """Test changes are tracked and reported"""
+        self.endpoint.queue.push(pb.incoming_connection_status
+                                 .tag_established)
+        self.wait()
+        self.assertTrue(self.monitor.established("ep"))
+
+        self.endpoint.queue.push(pb.outgoing_connection_status
+                                 .tag_disconnected)
+        self.wait()
+        self.assertFalse(self.monitor.established("ep"))
+
+        self.assertEqual(self.changes, [("ep", True), ("ep", False)])
+
+    def testSuccessRemove(self):
+        """Test removed endpoints are neither tracked nor reported"""
+        self.monitor.remove("ep")
+        self.assertFalse(self.monitor.established("ep"))
+
+        self.monitor._update("ep", True)
+        self.assertFalse(self.monitor.established("ep"))
+        self.assertEqual(self.changes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
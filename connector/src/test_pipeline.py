@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_pipeline
+
+Test the Pipeline.
+"""
+from pipeline import Pipeline
+
+import unittest
+from threading import Event
+
+
+class TestPipeline(unittest.TestCase):
+    """TestCases for pipeline.Pipeline"""
+
+    def testSuccessHandled(self):
+        """Test queued messages are handled by the worker in order"""
+        handled = []
+        pipeline = Pipeline(handled.append, 10)
+        pipeline.start()
+
+        for i in range(5):
+            self.assertTrue(pipeline.put({"i": i}))
+        pipeline.queue.join()
+
+        self.assertEqual(handled, [{"i": i} for i in range(5)])
+        self.assertEqual(pipeline.depth(), 0)
+
+    def testSuccessHandlerFailure(self):
+        """Test a failing handler does not stop the worker"""
+        handled = []
+
+        def handler(message):
+            if message is None:
+                raise ValueError()
+            handled.append(message)
+
+        pipeline = Pipeline(handler, 10)
+        pipeline.start()
+        pipeline.put(None)
+        pipeline.put({"a": 1})
+        pipeline.queue.join()
+
+        self.assertEqual(handled, [{"a": 1}])
+
+    def testFailureQueueFull(self):
+        """Test messages are rejected if the queue is full"""
+        release = Event()
+        pipeline = Pipeline(lambda message: release.wait(), 2)
+
+        self.assertTrue(pipeline.put({}))
+        self.assertTrue(pipeline.put({}))
+        self.assertFalse(pipeline.put({}))
+        self.assertEqual(pipeline.depth(), 2)
+
+        pipeline.start()
+        release.set()
+        pipeline.queue.join()
+        self.assertTrue(pipeline.put({}))
+
+    def testSuccessLanes(self):
+        """Test higher priority lanes are handled first"""
+        handled = []
+        pipeline = Pipeline(lambda message: handled.append(message["i"]), 10,
+                            (1.0, 1.0, 1.0))
+        for i, lane in enumerate((2, 1, 0, 2, 0)):
+            self.assertTrue(pipeline.put({"i": i}, lane))
+        self.assertEqual([pipeline.depth(lane) for lane in range(3)],
+                         [2, 1, 2])
+
+        pipeline.start()
+        pipeline.queue.join()
+        self.assertEqual(handled, [2, 4, 1, 0, 3])
+        self.assertEqual([pipeline.depth(lane) for lane in range(3)],
+                         [0, 0, 0])
+
+    def testFailureShed(self):
+        """Test lower priority lanes are not admitted beyond their share"""
+        pipeline = Pipeline(lambda message: None, 4, (1.0, 0.5))
+        for _ in range(2):
+            self.assertTrue(pipeline.admit(1))
+            pipeline.put({}, 1)
+        self.assertFalse(pipeline.admit(1))
+        self.assertTrue(pipeline.admit(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
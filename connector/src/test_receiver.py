@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_receiver
+
+Test the Receiver.
+"""
+from receiver import Receiver, Overloaded
+from metrics import Metrics
+
+import unittest
+from flask import json
+
+
+class TestReceiver(unittest.TestCase):
+    """TestCases for receiver.Receiver"""
+
+    def setUp(self):
+        """Set up a receiver, which records the received data"""
+        self.received = []
+        self.metrics = Metrics()
+        self.receiver = Receiver("test", "127.0.0.1", 0, metrics=self.metrics)
+        # do not actually serve, only register the routes
+        self.receiver.run = lambda **kwargs: None
+        self.receiver.serve_metrics("/metrics")
+        self.receiver.listen("/", self.on_data)
+        self.client = self.receiver.test_client()
+
+    def on_data(self, data):
+        """Record *data*, fail on non-objects and {"overload": ...}"""
+        if not isinstance(data, dict):
+            raise ValueError("no object")
+        if "overload" in data:
+            raise Overloaded(*data["overload"])
+        self.received.append(data)
+
+    def post(self, body, content_type="application/json"):
+        """Post *body* to the receiver"""
+        return self.client.post("/", data=body, content_type=content_type)
+
+    def testSuccessSingle(self):
+        """Test a single json object is passed on"""
+        response = self.post(json.dumps({"a": 1}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.received, [{"a": 1}])
+
+    def testSuccessBatchArray(self):
+        """Test every object of a json array is passed on"""
+        response = self.post(json.dumps([{"a": 1}, {"b": 2}]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.received, [{"a": 1}, {"b": 2}])
+        self.assertEqual(json.loads(response.data),
+                         {"received": 2, "failed": []})
+
+    def testSuccessBatchNdjson(self):
+        """Test every line of newline-delimited json is passed on"""
+        body = "\n".join([json.dumps({"a": 1}), "", json.dumps({"b": 2})])
+        response = self.post(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.received, [{"a": 1}, {"b": 2}])
+
+    def testFailurePartialBatch(self):
+        """Test failing items are reported without rejecting the batch"""
+        body = "\n".join([json.dumps({"a": 1}), "{broken",
+                          json.dumps([]), json.dumps({"b": 2})])
+        response = self.post(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.received, [{"a": 1}, {"b": 2}])
+
+        summary = json.loads(response.data)
+        self.assertEqual(summary["received"], 4)
+        self.assertEqual([f["index"] for f in summary["failed"]], [1, 2])
+
+    def testSuccessAcceptedStatus(self):
+        """Test the configured status is answered for handled messages"""
+        self.receiver.status = 202
+        self.assertEqual(self.post(json.dumps({"a": 1})).status_code, 202)
+        self.assertEqual(self.post(json.dumps([{"a": 1}])).status_code, 202)
+
+    def testFailureOverloaded(self):
+        """Test overload is answered with 503 or reported per batch item"""
+        response = self.post(json.dumps({"overload": []}))
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn("Retry-After", response.headers)
+
+        response = self.post(json.dumps([{"a": 1}, {"overload": []}]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["failed"],
+                         [{"index": 1, "error": "Overloaded"}])
+
+    def testFailureShed(self):
+        """Test shed messages are answered with 429 and Retry-After"""
+        response = self.post(json.dumps({"overload": [429, 2]}))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "2")
+
+        response = self.post(json.dumps([{"overload": [429, 1]},
+                                         {"overload": [503, 3]}]))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "3")
+
+        response = self.post(json.dumps([{"overload": [429, 1]},
+                                         {"overload": [429, 2]}]))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(len(json.loads(response.data)["failed"]), 2)
+
+        response = self.post(json.dumps([{"a": 1}, {"overload": [429, 1]}]))
+        self.assertEqual(response.status_code, 200)
+
+    def testSuccessOnBatch(self):
+        """Test the messages of a batch are handed to on_batch at once"""
+        batches = []
+
+        def on_batch(messages):
+            batches.append(messages)
+            return [None if "a" in m else "failed" for m in messages]
+
+        self.receiver.on_batch = on_batch
+        response = self.post(json.dumps([{"a": 1}, 2, {"b": 3}, {"a": 4}]))
+        self.assertEqual(batches, [[{"a": 1}, {"b": 3}, {"a": 4}]])
+        self.assertEqual(json.loads(response.data),
+                         {"received": 4,
+                          "failed": [{"index": 1, "error": "No json object."},
+                                     {"index": 2, "error": "failed"}]})
+        # single messages are still handled by on_data
+        self.post(json.dumps({"a": 5}))
+        self.assertEqual(self.received, [{"a": 5}])
+
+    def testFailureNoObject(self):
+        """Test json other than objects and arrays is rejected"""
+        self.assertEqual(self.post(json.dumps("string")).status_code, 400)
+        self.assertEqual(self.post("{broken").status_code, 400)
+        self.assertEqual(self.received, [])
+
+    def testFailureUnknownDecoder(self):
+        """Test unknown decoders are rejected"""
+        self.assertRaises(ValueError, Receiver, "test", "127.0.0.1", 0,
+                          decoder="unknown")
+
+    def testSuccessMetrics(self):
+        """Test received and dropped messages are counted and served"""
+        body = "\n".join([json.dumps({"a": 1}), "{broken",
+                          json.dumps([]), json.dumps({"b": 2})])
+        self.post(body, "application/x-ndjson")
+
+        self.assertEqual(self.metrics.counters["received"], {(): 2})
+        self.assertEqual(self.metrics.counters["dropped"],
+                         {(("reason", "invalid"),): 2})
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("connector_received_total 2", response.data)
+        self.assertIn("connector_decode_seconds_count 4", response.data)
+
+    def testFailureMediaType(self):
+        """Test unsupported content types are rejected"""
+        response = self.post("a=1", "application/x-www-form-urlencoded")
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.received, [])
+
+
+class TestReceiverServer(unittest.TestCase):
+    """TestCases for the server backends of receiver.Receiver"""
+
+    def receiver(self, server):
+        """Return a receiver recording the backends served with"""
+        receiver = Receiver("test", "127.0.0.1", 0, server=server)
+        receiver.served = []
+        for name in Receiver.SERVERS:
+            setattr(receiver, "_serve_{}".format(name),
+                    lambda name=name: receiver.served.append(name))
+        return receiver
+
+    def testFailureUnknownServer(self):
+        """Test unknown server backends are rejected"""
+        self.assertRaises(ValueError, Receiver, "test", "127.0.0.1", 0,
+                          server="tornado")
+
+    def testSuccessListenDispatch(self):
+        """Test listen serves with the configured backend only"""
+        for server in Receiver.SERVERS:
+            receiver = self.receiver(server)
+            receiver.listen("/", lambda data: None)
+            self.assertEqual(receiver.served, [server])
+            response = receiver.test_client().post(
+                "/", data="{}", content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+
+    def testSuccessServeFlask(self):
+        """Test the flask backend runs the development server"""
+        receiver = Receiver("test", "127.0.0.1", 8080)
+        runs = []
+        receiver.run = lambda **kwargs: runs.append(kwargs)
+        receiver.listen("/", lambda data: None)
+        self.assertEqual(runs, [{"host": "127.0.0.1", "port": 8080,
+                                 "debug": False}])
+
+
+if __name__ == '__main__':
+    unittest.main()
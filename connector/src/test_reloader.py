@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_reloader
+
+Test the Reloader.
+"""
+from mapper import Mapper
+from reloader import Reloader
+
+import unittest
+import yaml
+
+import os
+import shutil
+from tempfile import mkdtemp
+from time import sleep
+
+
+class TestReloader(unittest.TestCase):
+    """TestCases for reloader.Reloader"""
+
+    def setUp(self):
+        """Create a mappings directory with the access mapping"""
+        self.location = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.copy("access.yaml")
+        self.mappers = []
+
+    def copy(self, name):
+        """Copy the dionaea mapping *name* to the mappings directory"""
+        shutil.copy(os.path.join("mappings", "dionaea", name), self.location)
+
+    def build(self):
+        """Build a mapper of the mappings directory, fail if invalid"""
+        mappings = []
+        for name in sorted(os.listdir(self.location)):
+            with open(os.path.join(self.location, name)) as f:
+                mappings.append(yaml.load(f))
+        mapper = Mapper(mappings)
+        if len(mapper.converters) != len(mappings):
+            raise ValueError("Invalid mapping(s).")
+        return mapper
+
+    def names(self):
+        """Return the mapping names of the last swapped in mapper"""
+        return [c.name for c in self.mappers[-1].converters]
+
+    def testSuccessTrigger(self):
+        """Test the mappings are reloaded on request"""
+        reloader = Reloader(self.location, self.build, self.mappers.append)
+        reloader.start()
+        self.copy("blackhole.yaml")
+        reloader.trigger()
+        for _ in range(50):
+            if self.mappers:
+                break
+            sleep(0.01)
+        self.assertEqual(sorted(self.names()),
+                         ["Beemaster::dionaea_access",
+                          "Beemaster::dionaea_blackhole"])
+
+    def testSuccessChange(self):
+        """Test the mappings are reloaded once the directory changes"""
+        reloader = Reloader(self.location, self.build, self.mappers.append,
+                            interval=0.01)
+        reloader.start()
+        sleep(0.05)
+        self.assertEqual(self.mappers, [])
+        self.copy("blackhole.yaml")
+        for _ in range(50):
+            if self.mappers:
+                break
+            sleep(0.01)
+        self.assertEqual(len(self.names()), 2)
+
+    def testFailureInvalid(self):
+        """Test invalid mappings do not replace the current ones"""
+        reloader = Reloader(self.location, self.build, self.mappers.append)
+        with open(os.path.join(self.location, "broken.yaml"), "w") as f:
+            f.write("name: broken\nmapping: {}\nmessage: [unknown]\n")
+        self.assertFalse(reloader.reload())
+        self.assertEqual(self.mappers, [])
+
+        os.remove(os.path.join(self.location, "broken.yaml"))
+        self.assertTrue(reloader.reload())
+        self.assertEqual(self.names(), ["Beemaster::dionaea_access"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,16 @@ Test the Sender.
 
 from __future__ import with_statement
 
+from metrics import Metrics
 from sender import Sender
+from spool import Spool
+from transport import LoopbackTransport
 
 import unittest
 import pybroker as pb
 
+from shutil import rmtree
+from tempfile import mkdtemp
 from time import sleep
 from select import select
 
@@ -78,13 +83,13 @@ class TestSender(unittest.TestCase):
         # do test slave lookup on init
         self.assertEqual(sender.current_slave, balance_to)
 
-    def testSuccessSlaveLookupOnSend(self):
-        """Test successful (re-)lookup of Bro-Slave during sender send"""
+    def testSuccessSlaveLookupInBackground(self):
+        """Test successful (re-)lookup of Bro-Slave in the background"""
         self.assertTrue(self.master_listening)
         self.master_store.clear()
 
         sender = Sender(self.master_ip, self.master_port, self.connector_ep,
-                        self.topic, self.connector_id)
+                        self.topic, self.connector_id, slave_refresh=0.1)
 
         # verify no initial peering took place
         self.assertEqual(sender.current_slave, None)
@@ -93,14 +98,17 @@ class TestSender(unittest.TestCase):
         self.master_store.insert(pb.data(self.connector_id),
                                  pb.data(balance_to))
 
-        sleep(0.1)  # time for the update of the shared data
         msg = pb.message()
         msg.append(pb.data(self.topic))
         msg.append(pb.data("MESSAGE"))
 
+        # sending does not wait for the lookup
         sender.send(msg)
 
-        # do test slave lookup during send
+        # time for the update of the shared data, the lookup and repeering
+        sleep(0.5)
+
+        # do test slave lookup in the background
         self.assertEqual(sender.current_slave, balance_to)
 
     def testFailureSendInvalidMessage(self):
@@ -132,5 +140,205 @@ class TestSender(unittest.TestCase):
 #                       self.connector_id)
 
 
+class TestSenderLoopback(unittest.TestCase):
+    """TestCases for sender.Sender with the loopback transport"""
+
+    topic = "honeypotconnector/unittest"
+    connector_id = "test"
+    slave = "bro-slave-127.0.0.1:9999"
+
+    def sender(self, transport, **kwargs):
+        """Return a Sender with *transport*"""
+        return Sender("127.0.0.1", 9765, self.connector_id, self.topic,
+                      self.connector_id, transport=transport, **kwargs)
+
+    def message(self):
+        """Return a test message"""
+        msg = pb.message()
+        msg.append(pb.data("Beemaster::test"))
+        return msg
+
+    def testSuccessSendToSlave(self):
+        """Test messages are sent to the assigned slave"""
+        transport = LoopbackTransport(slave=self.slave)
+        sender = self.sender(transport)
+        sender.send(self.message())
+
+        name, topic, msg = transport.delivered[-1]
+        self.assertEqual(name, self.slave)
+        self.assertEqual(topic, self.topic)
+        self.assertEqual(msg[-1].as_string(), self.connector_id)
+
+    def testSuccessBalanceAmongSlaves(self):
+        """Test messages of a key go to the same of multiple slaves"""
+        slaves = ["bro-slave-127.0.0.1:{}".format(port)
+                  for port in range(9990, 9994)]
+        transport = LoopbackTransport(slave=",".join(slaves))
+        sender = self.sender(transport)
+        self.assertEqual(sender.slaves, slaves)
+
+        for i in range(200):
+            sender.send(self.message(), "10.0.{}.{}".format(i % 2, i))
+        for _ in range(3):
+            sender.send(self.message(), "10.0.0.0")
+
+        received = {name for name, _, _ in transport.delivered}
+        self.assertEqual(received, set(slaves))
+        last = [name for name, _, _ in list(transport.delivered)[-4:]]
+        self.assertEqual(len(set(last)), 1)
+
+    def testSuccessSendToMasterWithoutSlave(self):
+        """Test messages fall back to the master without slave"""
+        transport = LoopbackTransport()
+        sender = self.sender(transport)
+        sender.send(self.message())
+        self.assertEqual(transport.delivered[-1][0], Sender.MASTER)
+
+    def testSuccessSlaveReassignment(self):
+        """Test the sender repeers on reassignment of the slave"""
+        transport = LoopbackTransport(slave=self.slave)
+        sender = self.sender(transport, slave_refresh=0.05)
+
+        other = "bro-slave-127.0.0.1:9998"
+        transport.assign_slave(other)
+        sleep(0.5)
+
+        self.assertEqual(sender.current_slave, other)
+        self.assertFalse(transport.established(self.slave))
+        sender.send(self.message())
+        self.assertEqual(transport.delivered[-1][0], other)
+
+    def testSuccessSpoolAndReplay(self):
+        """Test messages are spooled while disconnected and replayed"""
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        transport = LoopbackTransport()
+        transport.disconnect(Sender.MASTER)
+        sender = self.sender(transport, spool=Spool(directory, 1024, 4096))
+
+        sender.send(self.message())
+        self.assertEqual(transport.sent, 0)
+        self.assertTrue(sender.spool.pending())
+
+        transport.connect(Sender.MASTER)
+        sleep(0.2)
+        self.assertEqual(transport.sent, 1)
+        self.assertFalse(sender.spool.pending())
+
+    def testFailureDropWhileDisconnected(self):
+        """Test messages are dropped while disconnected without spool"""
+        transport = LoopbackTransport()
+        transport.disconnect(Sender.MASTER)
+        metrics = Metrics()
+        sender = self.sender(transport, metrics=metrics)
+
+        sender.send(self.message())
+        self.assertEqual(transport.sent, 0)
+        self.assertEqual(metrics.counters["dropped"],
+                         {(("reason", "disconnected"),): 1})
+
+    def testSuccessBatchFlushOnSize(self):
+        """Test a batch is sent once it reaches the batch size"""
+        transport = LoopbackTransport()
+        sender = self.sender(transport, batch_size=3, batch_latency=60)
+
+        for _ in range(2):
+            sender.send(self.message())
+        self.assertEqual(transport.sent, 0)
+        self.assertEqual(sender.batch_depth(), 2)
+
+        sender.send(self.message())
+        self.assertEqual(transport.sent, 1)
+        self.assertEqual(sender.batch_depth(), 0)
+        _, _, msg = transport.delivered[-1]
+        self.assertEqual(msg[0].as_string(), "Beemaster::connector_batch")
+        self.assertEqual(len(msg[1].as_vector()), 3)
+
+    def testSuccessBatchFlushOnLatency(self):
+        """Test a batch is sent once it reaches the maximum latency"""
+        transport = LoopbackTransport()
+        sender = self.sender(transport, batch_size=100, batch_latency=0.05)
+
+        sender.send(self.message())
+        self.assertEqual(transport.sent, 0)
+        sleep(0.3)
+        self.assertEqual(transport.sent, 1)
+        self.assertEqual(sender.batch_depth(), 0)
+        self.assertEqual(len(transport.delivered[-1][2][1].as_vector()), 1)
+
+    def testFailureBatchLatency(self):
+        """Test batching without positive latency is rejected"""
+        for latency in (0, -1):
+            self.assertRaises(ValueError, self.sender, LoopbackTransport(),
+                              batch_size=2, batch_latency=latency)
+        # irrelevant without batching
+        self.sender(LoopbackTransport(), batch_latency=0)
+
+    def testSuccessBatchConnectorIdOnce(self):
+        """Test the connector id is appended once per batch"""
+        transport = LoopbackTransport()
+        sender = self.sender(transport, batch_size=2, batch_latency=60)
+
+        for _ in range(2):
+            sender.send(self.message())
+        _, _, msg = transport.delivered[-1]
+        self.assertEqual(len(msg), 3)
+        self.assertEqual(msg[-1].as_string(), self.connector_id)
+        for event in msg[1].as_vector():
+            self.assertEqual([d.as_string() for d in event.as_vector()],
+                             ["Beemaster::test"])
+
+    def testSuccessSpoolBatch(self):
+        """Test batches are spooled while disconnected and replayed"""
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        transport = LoopbackTransport()
+        transport.disconnect(Sender.MASTER)
+        metrics = Metrics()
+        sender = self.sender(transport, spool=Spool(directory, 1024, 4096),
+                             batch_size=2, batch_latency=60, metrics=metrics)
+
+        for _ in range(2):
+            sender.send(self.message())
+        self.assertEqual(transport.sent, 0)
+        self.assertTrue(sender.spool.pending())
+        self.assertNotIn("dropped", metrics.counters)
+
+        transport.connect(Sender.MASTER)
+        sleep(0.2)
+        self.assertEqual(transport.sent, 1)
+        _, _, msg = transport.delivered[-1]
+        self.assertEqual(len(msg[1].as_vector()), 2)
+        self.assertEqual(msg[-1].as_string(), self.connector_id)
+
+    def testSuccessCountBatchedEvents(self):
+        """Test batched events are counted per mapping once sent"""
+        transport = LoopbackTransport()
+        metrics = Metrics()
+        sender = self.sender(transport, batch_size=3, batch_latency=60,
+                             metrics=metrics)
+
+        sender.send(self.message(), mapping="a")
+        sender.send(self.message(), mapping="b")
+        self.assertNotIn("sent", metrics.counters)
+        sender.send(self.message(), mapping="a")
+        self.assertEqual(metrics.counters["sent"],
+                         {(("mapping", "a"),): 2, (("mapping", "b"),): 1})
+
+    def testFailureCountDroppedBatchEvents(self):
+        """Test the events of a dropped batch are counted as dropped"""
+        transport = LoopbackTransport()
+        transport.disconnect(Sender.MASTER)
+        metrics = Metrics()
+        sender = self.sender(transport, batch_size=2, batch_latency=60,
+                             metrics=metrics)
+
+        for _ in range(2):
+            sender.send(self.message(), mapping="a")
+        self.assertNotIn("sent", metrics.counters)
+        self.assertEqual(metrics.counters["dropped"],
+                         {(("mapping", "a"), ("reason", "disconnected")): 2})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_spool
+
+Test the Spool.
+"""
+from spool import Spool, encode, decode
+
+import unittest
+import pybroker as pb
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+
+
+class TestSpool(unittest.TestCase):
+    """TestCases for spool.Spool"""
+
+    def setUp(self):
+        """Create a temporary spool directory"""
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary spool directory"""
+        rmtree(self.directory)
+
+    @staticmethod
+    def _message(i):
+        """Return a message with all spoolable types"""
+        msg = pb.message()
+        for d in ("event", i, pb.address_from_string("127.0.0.1"),
+                  pb.time_point(1483228800.5)):
+            msg.append(pb.data(d))
+        return msg
+
+    def _replay(self, spool, limit):
+        """Replay up to *limit* messages and return their string values"""
+        replayed = []
+        spool.replay(lambda msg: replayed.append(map(str, msg)) or True,
+                     limit)
+        return replayed
+
+    def testSuccessCodec(self):
+        """Test messages survive encoding and decoding"""
+        msg = self._message(1)
+        self.assertEqual(map(str, decode(encode(msg))), map(str, msg))
+
+    def testSuccessCodecVector(self):
+        """Test messages with (nested) vectors survive encoding and decoding"""
+        msg = pb.message()
+        msg.append(pb.data("batch"))
+        msg.append(pb.data(pb.vector_of_data(
+            [pb.data(pb.vector_of_data(list(self._message(i))))
+             for i in range(2)])))
+        decoded = decode(encode(msg))
+        self.assertEqual(decoded[0].as_string(), "batch")
+        events = decoded[1].as_vector()
+        self.assertEqual(len(events), 2)
+        for i, event in enumerate(events):
+            self.assertEqual(map(str, event.as_vector()),
+                             map(str, self._message(i)))
+
+    def testSuccessReplayInOrder(self):
+        """Test messages are replayed in order across segments"""
+        spool = Spool(self.directory, 100, 100000)
+        for i in range(10):
+            spool.append(self._message(i))
+        self.assertTrue(spool.pending())
+        self.assertTrue(len(spool.segments) > 1)
+
+        replayed = self._replay(spool, 4) + self._replay(spool, 100)
+        self.assertEqual(replayed, [map(str, self._message(i))
+                                    for i in range(10)])
+        self.assertFalse(spool.pending())
+        self.assertEqual(len(spool.segments), 1)
+
+    def testSuccessResume(self):
+        """Test the replay position survives a restart"""
+        spool = Spool(self.directory, 100, 100000)
+        for i in range(6):
+            spool.append(self._message(i))
+        self._replay(spool, 2)
+
+        spool = Spool(self.directory, 100, 100000)
+        spool.append(self._message(6))
+        replayed = self._replay(spool, 100)
+        self.assertEqual(replayed, [map(str, self._message(i))
+                                    for i in range(2, 7)])
+
+    def testSuccessSendFailure(self):
+        """Test messages are kept if sending fails"""
+        spool = Spool(self.directory, 100, 100000)
+        spool.append(self._message(0))
+        self.assertEqual(spool.replay(lambda msg: False, 10), 0)
+        self.assertEqual(len(self._replay(spool, 10)), 1)
+
+    def testSuccessSendFailureMidway(self):
+        """Test only the messages sent before a failure are consumed"""
+        spool = Spool(self.directory, 100, 100000)
+        for i in range(5):
+            spool.append(self._message(i))
+        sent = []
+        spool.replay(lambda msg: len(sent) < 2 and not sent.append(msg), 10)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(self._replay(spool, 10),
+                         [map(str, self._message(i)) for i in range(2, 5)])
+
+    def testSuccessSendUnlocked(self):
+        """Test appending is not blocked while replayed messages are sent"""
+        spool = Spool(self.directory, 100, 100000)
+        for i in range(3):
+            spool.append(self._message(i))
+
+        def send(msg):
+            # from another thread, the lock is reentrant
+            appender = Thread(target=spool.append, args=(self._message(9),))
+            appender.start()
+            appender.join(5)
+            return not appender.is_alive()
+
+        self.assertEqual(spool.replay(send, 3), 3)
+        self.assertEqual(len(self._replay(spool, 10)), 3)
+
+    def testSuccessCap(self):
+        """Test the oldest segments are dropped above the cap"""
+        spool = Spool(self.directory, 100, 300)
+        for i in range(20):
+            spool.append(self._message(i))
+
+        size = sum(os.path.getsize(os.path.join(self.directory, f))
+                   for f in os.listdir(self.directory)
+                   if f.endswith(Spool.SUFFIX))
+        self.assertTrue(size <= 300)
+        replayed = self._replay(spool, 100)
+        self.assertEqual(replayed[-1], map(str, self._message(19)))
+        self.assertTrue(len(replayed) < 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_transport
+
+Test the transports.
+"""
+from transport import (LoopbackTransport, SocketTransport, Transport,
+                       parse_slaves)
+import spool
+
+import unittest
+import pybroker as pb
+
+import socket
+from threading import Thread
+
+
+def message(*values):
+    """Return a Broker message of *values*"""
+    msg = pb.message()
+    for value in values:
+        msg.append(pb.data(value))
+    return msg
+
+
+class TestLoopbackTransport(unittest.TestCase):
+    """TestCases for transport.LoopbackTransport"""
+
+    slave = "bro-slave-127.0.0.1:9999"
+
+    def testSuccessSendRecorded(self):
+        """Test messages are recorded with endpoint and topic"""
+        transport = LoopbackTransport()
+        msg = message("event")
+        transport.send(Transport.MASTER, "topic", msg)
+
+        transport.peer_slave(self.slave)
+        transport.send(self.slave, "topic", msg)
+
+        self.assertEqual(list(transport.delivered),
+                         [(Transport.MASTER, "topic", msg),
+                          (self.slave, "topic", msg)])
+        self.assertEqual(transport.sent, 2)
+
+    def testSuccessKeep(self):
+        """Test only the last messages are recorded, all are counted"""
+        transport = LoopbackTransport(keep=1)
+        for i in range(3):
+            transport.send(Transport.MASTER, "topic", message(i))
+        self.assertEqual(len(transport.delivered), 1)
+        self.assertEqual(transport.sent, 3)
+
+    def testSuccessConnectionChanges(self):
+        """Test simulated disconnects notify the callbacks once"""
+        transport = LoopbackTransport()
+        changes = []
+        transport.on_change(lambda *change: changes.append(change))
+
+        transport.disconnect(Transport.MASTER)
+        transport.disconnect(Transport.MASTER)
+        self.assertFalse(transport.established(Transport.MASTER))
+        transport.connect(Transport.MASTER)
+        self.assertTrue(transport.established(Transport.MASTER))
+
+        self.assertEqual(changes, [(Transport.MASTER, False),
+                                   (Transport.MASTER, True)])
+
+    def testSuccessSlaveAssignment(self):
+        """Test the assigned slave is looked up"""
+        transport = LoopbackTransport(slave=self.slave)
+        self.assertEqual(transport.lookup_slave(), self.slave)
+        transport.assign_slave(None)
+        self.assertIsNone(transport.lookup_slave())
+
+    def testSuccessPeerAndUnpeer(self):
+        """Test peered slaves are established until unpeered"""
+        transport = LoopbackTransport()
+        changes = []
+        transport.on_change(lambda *change: changes.append(change))
+
+        transport.peer_slave(self.slave)
+        self.assertTrue(transport.established(self.slave))
+        transport.unpeer_slave(self.slave)
+        self.assertFalse(transport.established(self.slave))
+
+        self.assertEqual(changes, [(self.slave, True), (self.slave, False)])
+
+    def testFailureSendDisconnected(self):
+        """Test sending via a disconnected endpoint fails"""
+        transport = LoopbackTransport()
+        self.assertFalse(transport.established(self.slave))
+        with self.assertRaises(IOError):
+            transport.send(self.slave, "topic", message("event"))
+        self.assertEqual(transport.sent, 0)
+
+
+class TestParseSlaves(unittest.TestCase):
+    """TestCases for transport.parse_slaves"""
+
+    def testSuccessParse(self):
+        """Test comma-separated slaves are split"""
+        self.assertEqual(parse_slaves("bro-slave-a:1, bro-slave-b:2,"),
+                         ["bro-slave-a:1", "bro-slave-b:2"])
+        self.assertEqual(parse_slaves("bro-slave-a:1"), ["bro-slave-a:1"])
+
+    def testSuccessParseEmpty(self):
+        """Test no slaves are parsed from None and empty values"""
+        self.assertEqual(parse_slaves(None), [])
+        self.assertEqual(parse_slaves(""), [])
+
+
+class TestSocketTransport(unittest.TestCase):
+    """TestCases for transport.SocketTransport"""
+
+    def setUp(self):
+        """Listen on a local port"""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def tearDown(self):
+        """Close the listening socket"""
+        self.server.close()
+
+    def testSuccessSend(self):
+        """Test messages are written as topic and encoded message"""
+        transport = SocketTransport("127.0.0.1", self.port)
+        transport.start()
+        self.assertTrue(transport.established(Transport.MASTER))
+
+        msg = message("event", 42)
+        transport.send(Transport.MASTER, "topic", msg)
+
+        connection, _ = self.server.accept()
+        line = connection.makefile().readline()
+        connection.close()
+        self.assertEqual(line, "topic {}\n".format(spool.encode(msg)))
+
+    def testSuccessConcurrentSend(self):
+        """Test concurrently sent messages are written as whole lines"""
+        transport = SocketTransport("127.0.0.1", self.port)
+        transport.start()
+        connection = self.server.accept()[0]
+        self.addCleanup(connection.close)
+        msg = message("x" * 100000, 42)
+        expected = "topic {}\n".format(spool.encode(msg))
+
+        def send():
+            for _ in range(5):
+                transport.send(Transport.MASTER, "topic", msg)
+
+        senders = [Thread(target=send) for _ in range(4)]
+        for sender in senders:
+            sender.start()
+        reader = connection.makefile()
+        lines = [reader.readline() for _ in range(20)]
+        for sender in senders:
+            sender.join()
+        self.assertEqual(lines, [expected] * 20)
+
+    def testFailureSendDisconnected(self):
+        """Test sending via an unconnected endpoint raises socket.error"""
+        transport = SocketTransport("127.0.0.1", self.port)
+        transport.start()
+        transport._close(Transport.MASTER)
+        self.assertRaises(socket.error, transport.send, Transport.MASTER,
+                          "topic", message("event"))
+        self.assertRaises(socket.error, transport.send, "unknown", "topic",
+                          message("event"))
+
+    def testFailureNotListening(self):
+        """Test the master is not established without listener"""
+        self.server.close()
+        transport = SocketTransport("127.0.0.1", self.port, retry=0.1)
+        transport.start()
+        self.assertFalse(transport.established(Transport.MASTER))
+
+
+if __name__ == '__main__':
+    unittest.main()
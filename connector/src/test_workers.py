@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""test_workers
+
+Test the Supervisor.
+"""
+from workers import Supervisor, listen_socket
+
+import unittest
+
+import os
+import signal
+import socket
+from tempfile import mkstemp
+from time import sleep
+
+
+class TestSupervisor(unittest.TestCase):
+    """TestCases for workers.Supervisor"""
+
+    def setUp(self):
+        """Create the file the workers log their starts to"""
+        fd, self.path = mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def starts(self):
+        """Return the logged worker starts"""
+        with open(self.path) as f:
+            return f.read().split()
+
+    def testSuccessRestartAndStop(self):
+        """Test dead workers are restarted until the supervisor is stopped"""
+        def target(index):
+            with open(self.path, "a") as f:
+                f.write("{}\n".format(index))
+            if len(self.starts()) >= 6:
+                os.kill(os.getppid(), signal.SIGTERM)
+                sleep(10)
+
+        supervisor = Supervisor(target, 2)
+        supervisor.RESTART_DELAY = 0.01
+        supervisor.run()
+
+        starts = self.starts()
+        self.assertGreaterEqual(len(starts), 6)
+        self.assertEqual(set(starts), {"0", "1"})
+        self.assertEqual(supervisor.workers, {})
+
+    def testSuccessForwardHangup(self):
+        """Test SIGHUP is forwarded to the workers without stopping them"""
+        def hangup(signum, frame):
+            with open(self.path, "a") as f:
+                f.write("hup\n")
+            os.kill(os.getppid(), signal.SIGTERM)
+
+        def target(index):
+            signal.signal(signal.SIGHUP, hangup)
+            os.kill(os.getppid(), signal.SIGHUP)
+            sleep(10)
+
+        Supervisor(target, 1).run()
+        self.assertEqual(self.starts(), ["hup"])
+
+    def testSuccessHangupWhileStarting(self):
+        """Test SIGHUP does not kill workers without handler"""
+        def target(index):
+            with open(self.path, "a") as f:
+                f.write("{}\n".format(index))
+            os.kill(os.getpid(), signal.SIGHUP)
+            with open(self.path, "a") as f:
+                f.write("alive\n")
+            os.kill(os.getppid(), signal.SIGTERM)
+            sleep(10)
+
+        supervisor = Supervisor(target, 1)
+        supervisor.RESTART_DELAY = 0.01
+        supervisor.run()
+        self.assertEqual(self.starts(), ["0", "alive"])
+
+    def testSuccessListenSocket(self):
+        """Test the shared socket accepts connections"""
+        sock = listen_socket("127.0.0.1", 0)
+        self.addCleanup(sock.close)
+        client = socket.create_connection(sock.getsockname())
+        self.addCleanup(client.close)
+        connection, _ = sock.accept()
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
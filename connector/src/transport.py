@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""transport.py
+
+Provides the transports of the Sender: the way messages reach the master or
+the slaves, how the slaves are looked up and how connection changes are
+reported.
+
+* :class:`BrokerTransport` uses Broker endpoints, peering and the
+  "connectors" datastore (the production setup).
+* :class:`LoopbackTransport` delivers in memory and records the messages. It
+  simulates latency, disconnects and slave reassignment, e.g. for tests and
+  benchmarks without any Bro.
+* :class:`SocketTransport` writes the messages as json lines (see
+  :func:`spool.encode`) to local TCP sockets, e.g. to profile the send path
+  with a real (but trivial) peer.
+"""
+from monitor import Monitor
+import spool
+
+import pybroker as broker
+import logging
+import socket
+from collections import deque
+from threading import Lock, Thread
+from time import sleep
+
+
+class Transport(object):
+    """The interface of all transports.
+
+    Endpoints are addressed by name, either MASTER or the name of a peered
+    slave (bro-slave-address:port).
+    """
+
+    MASTER = "master"
+
+    def __init__(self):
+        """Initialise the (connection change) callbacks."""
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.callbacks = []
+
+    def on_change(self, callback):
+        """Call *callback* with (name, established) on every change.
+
+        :param callback:    The function to call. (func(str, bool))
+        """
+        self.callbacks.append(callback)
+
+    def _notify(self, name, established):
+        """Notify the callbacks of a connection change."""
+        for callback in self.callbacks:
+            try:
+                callback(name, established)
+            except Exception:
+                self.log.error("Connection callback failed.", exc_info=True)
+
+    def start(self):
+        """Start tracking the connection state."""
+
+    def established(self, name):
+        """Return True if the connection of endpoint *name* is established."""
+        raise NotImplementedError()
+
+    def lookup_slave(self):
+        """Return the slaves to send to (comma-separated names) or None."""
+        raise NotImplementedError()
+
+    def peer_slave(self, slave):
+        """Peer an endpoint with *slave*."""
+        raise NotImplementedError()
+
+    def unpeer_slave(self, slave):
+        """Unpeer the endpoint of *slave*, if it is peered."""
+        raise NotImplementedError()
+
+    def send(self, name, topic, msg):
+        """Send *msg* to *topic* via endpoint *name*."""
+        raise NotImplementedError()
+
+
+def parse_slave(slave):
+    """Return the (address, port) of a slave name (bro-slave-address:port)."""
+    address, port = slave[len("bro-slave-"):].split(":")
+    return address, int(port)
+
+
+def parse_slaves(slaves):
+    """Return the slave names of a comma-separated lookup value."""
+    if not slaves:
+        return []
+    return [slave.strip() for slave in slaves.split(",") if slave.strip()]
+
+
+class BrokerTransport(Transport):
+    """Transport via Broker endpoints.
+
+    See module description.
+    """
+
+    def __init__(self, master_address, master_port, broker_endpoint,
+                 connector_id):
+        """BrokerTransport(master_address, master_port)
+
+        Peers with the master and attaches to the "connectors" datastore.
+
+        :param master_address:  The address/hostname of the master. (str)
+        :param master_port:     The port of the master. (int)
+        :param broker_endpoint: The endpoint name to peer with the master
+                                and to look up the slaves by. (str)
+        :param connector_id:    The endpoint name to peer with slaves. (str)
+        """
+        super(BrokerTransport, self).__init__()
+        self.broker_endpoint = broker_endpoint
+        self.connector_id = connector_id
+
+        self.master = broker.endpoint(broker_endpoint)
+        self.master.peer(master_address, master_port, 1)
+        # a dedicated endpoint per slave, as an endpoint sends to all peers
+        # slave -> (endpoint, peering)
+        self.slaves = {}
+        # note: "connectors" is the name of the distributed datastore
+        self.balanced_slaves = broker.clone_create(self.master,
+                                                   "connectors", 1)
+
+        self.monitor = Monitor()
+        self.monitor.add(self.MASTER, self.master)
+        self.monitor.on_change(self._notify)
+
+    def start(self):
+        """Start monitoring the connections in the background."""
+        self.monitor.start()
+
+    def established(self, name):
+        """Return True if the connection of endpoint *name* is established."""
+        return self.monitor.established(name)
+
+    def lookup_slave(self):
+        """Return the slaves assigned in the "connectors" datastore."""
+        if not self.balanced_slaves:
+            return None
+        return self.balanced_slaves.lookup(
+            broker.data(self.broker_endpoint)).data().as_string()
+
+    def peer_slave(self, slave):
+        """Peer a new endpoint with *slave*."""
+        address, port = parse_slave(slave)
+        endpoint = broker.endpoint(self.connector_id)
+        self.slaves[slave] = (endpoint, endpoint.peer(address, port, 1))
+        self.monitor.add(slave, endpoint)
+
+    def unpeer_slave(self, slave):
+        """Unpeer the endpoint of *slave*, if it is peered."""
+        endpoint, peering = self.slaves.pop(slave, (None, None))
+        if endpoint is None:
+            return
+        self.monitor.remove(slave)
+        endpoint.unpeer(peering)
+
+    def send(self, name, topic, msg):
+        """Send *msg* to *topic* via endpoint *name*."""
+        if name == self.MASTER:
+            self.master.send(topic, msg)
+        else:
+            self.slaves[name][0].send(topic, msg)
+
+
+class LoopbackTransport(Transport):
+    """In-memory transport, recording the delivered messages.
+
+    See module description.
+    """
+
+    def __init__(self, latency=0.0, slave=None, keep=None):
+        """LoopbackTransport(latency, slave, keep)
+
+        :param latency:     Seconds every send takes. (float)
+        :param slave:       The slaves assigned initially (comma-separated).
+                            (str)
+        :param keep:        Number of delivered messages to record, all if
+                            None. (int)
+        """
+        super(LoopbackTransport, self).__init__()
+        self.latency = latency
+        self.assigned = slave
+        # name -> established, of the master and all peered slaves
+        self.states = {self.MASTER: True}
+        # (name, topic, message)
+        self.delivered = deque(maxlen=keep)
+        self.sent = 0
+        self.lock = Lock()
+
+    def assign_slave(self, slave):
+        """Assign *slave* (comma-separated or None), as the datastore would."""
+        self.assigned = slave
+
+    def disconnect(self, name):
+        """Simulate the loss of the connection of endpoint *name*."""
+        self._set(name, False)
+
+    def connect(self, name):
+        """Simulate the (re-)establishment of endpoint *name*."""
+        self._set(name, True)
+
+    def _set(self, name, established):
+        """Set the state of *name* and notify the callbacks on change."""
+        with self.lock:
+            changed = self.states.get(name) != established
+            self.states[name] = established
+        if changed:
+            self._notify(name, established)
+
+    def established(self, name):
+        """Return True if the connection of endpoint *name* is established."""
+        return self.states.get(name, False)
+
+    def lookup_slave(self):
+        """Return the assigned slaves."""
+        return self.assigned
+
+    def peer_slave(self, slave):
+        """Peer with *slave*, the connection is established right away."""
+        self._set(slave, True)
+
+    def unpeer_slave(self, slave):
+        """Unpeer the endpoint of *slave*."""
+        self._set(slave, False)
+        with self.lock:
+            self.states.pop(slave, None)
+
+    def send(self, name, topic, msg):
+        """Record *msg*, after the simulated latency.
+
+        :raises IOError:    If endpoint *name* is disconnected.
+        """
+        if self.latency:
+            sleep(self.latency)
+        if not self.states.get(name):
+            raise IOError("Endpoint '{}' is disconnected.".format(name))
+        with self.lock:
+            self.sent += 1
+            self.delivered.append((name, topic, msg))
+
+
+class SocketTransport(Transport):
+    """Transport writing json lines to local TCP sockets.
+
+    Every message is written as a line of the topic and the encoded message,
+    separated by a space. Lines are written whole, also by concurrent
+    senders. Lost connections are re-established in the background.
+
+    See module description.
+    """
+
+    def __init__(self, master_address, master_port, slave=None, retry=1.0):
+        """SocketTransport(master_address, master_port, slave, retry)
+
+        :param master_address:  The address of the master socket. (str)
+        :param master_port:     The port of the master socket. (int)
+        :param slave:           The slaves to send to, if any
+                                (comma-separated bro-slave-address:port).
+                                (str)
+        :param retry:           Seconds between reconnection attempts.
+                                (float)
+        """
+        super(SocketTransport, self).__init__()
+        self.slave = slave
+        self.retry = retry
+        # name -> (address, port) / (socket, lock of writing to it)
+        self.addresses = {self.MASTER: (master_address, master_port)}
+        self.sockets = {}
+        self.lock = Lock()
+
+        self.thread = Thread(target=self._reconnect, name="socket-reconnect")
+        self.thread.daemon = True
+
+    def start(self):
+        """Connect and keep reconnecting in the background."""
+        self._connect(self.MASTER)
+        self.thread.start()
+
+    def _connect(self, name):
+        """Connect endpoint *name*, return True on success."""
+        address = self.addresses.get(name)
+        if address is None:
+            return False
+        try:
+            sock = socket.create_connection(address, self.retry)
+        except socket.error:
+            return False
+        with self.lock:
+            self.sockets[name] = (sock, Lock())
+        self._notify(name, True)
+        return True
+
+    def _close(self, name, sock=None):
+        """Close the socket of endpoint *name*, if it is connected.
+
+        If *sock* is given, only if that is (still) the socket.
+        """
+        with self.lock:
+            current = self.sockets.get(name)
+            if current is None or sock is not None and current[0] is not sock:
+                return
+            del self.sockets[name]
+        current[0].close()
+        self._notify(name, False)
+
+    def _reconnect(self):
+        """Reconnect lost connections, forever."""
+        while True:
+            sleep(self.retry)
+            for name in list(self.addresses):
+                if name not in self.sockets:
+                    self._connect(name)
+
+    def established(self, name):
+        """Return True if endpoint *name* is connected."""
+        return name in self.sockets
+
+    def lookup_slave(self):
+        """Return the configured slaves."""
+        return self.slave
+
+    def peer_slave(self, slave):
+        """Connect to *slave*."""
+        self.addresses[slave] = parse_slave(slave)
+        self._connect(slave)
+
+    def unpeer_slave(self, slave):
+        """Disconnect from *slave*."""
+        self.addresses.pop(slave, None)
+        self._close(slave)
+
+    def send(self, name, topic, msg):
+        """Write *msg* to the socket of endpoint *name*.
+
+        :raises socket.error:   If writing fails, the connection is
+                                re-established in the background.
+        """
+        line = "{} {}\n".format(topic, spool.encode(msg))
+        with self.lock:
+            current = self.sockets.get(name)
+        if current is None:
+            raise socket.error("Endpoint '{}' is not connected.".format(name))
+        sock, lock = current
+        try:
+            with lock:
+                sock.sendall(line)
+        except socket.error:
+            self._close(name, sock)
+            raise
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""workers.py
+
+Provides the Supervisor, which runs the connector in multiple worker
+processes. The workers share one listening socket, bound before forking, so
+the kernel distributes the incoming connections among them. Dead workers are
+restarted; SIGINT and SIGTERM are forwarded to all workers, which stops them,
+SIGHUP (reloading the mappings) is forwarded as well.
+"""
+import errno
+import logging
+import os
+import signal
+import socket
+from time import sleep, time
+
+
+def listen_socket(address, port, backlog=128):
+    """Return a socket listening on *address*:*port*, to share with workers.
+
+    :param address:     Address to listen on. (str)
+    :param port:        Port to listen on. (int)
+    :param backlog:     Maximum number of pending connections. (int)
+    """
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((address, port))
+    sock.listen(backlog)
+    return sock
+
+
+class Supervisor(object):
+    """The worker supervisor.
+
+    See module description.
+    """
+
+    SIGNALS = (signal.SIGINT, signal.SIGTERM)
+    # forwarded to all workers, without stopping them (e.g. to reload)
+    FORWARDED = (signal.SIGHUP,)
+    # workers dying faster than this are restarted only after this delay
+    RESTART_DELAY = 1.0
+
+    def __init__(self, target, count):
+        """Supervisor(target, count)
+
+        Initialises the Supervisor. Start the workers via :meth:`run`.
+
+        :param target:  The function run by each worker, called with the
+                        worker index. (func(int))
+        :param count:   Number of workers. (int)
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.target = target
+        self.count = count
+        # pid -> index / index -> start time
+        self.workers = {}
+        self.started = {}
+        self.running = False
+
+    def run(self):
+        """Start the workers and restart dead ones, until a signal arrives."""
+        self.running = True
+        handlers = {signum: signal.signal(signum, self._stop)
+                    for signum in self.SIGNALS}
+        handlers.update((signum, signal.signal(signum, self._forward))
+                        for signum in self.FORWARDED)
+        try:
+            for index in range(self.count):
+                self._spawn(index)
+            self._supervise()
+        finally:
+            for signum, handler in handlers.iteritems():
+                signal.signal(signum, handler)
+
+    def _supervise(self):
+        """Wait for workers to exit and restart them while running."""
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            index = self.workers.pop(pid, None)
+            if index is None or not self.running:
+                continue
+            self.log.error("Worker {} (pid {}) exited with status {}, "
+                           "restarting.".format(index, pid, status))
+            if time() - self.started[index] < self.RESTART_DELAY:
+                sleep(self.RESTART_DELAY)
+            if self.running:
+                self._spawn(index)
+
+    def _spawn(self, index):
+        """Fork worker *index*."""
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            self.started[index] = time()
+            self.log.info("Worker {} started (pid {}).".format(index, pid))
+            return
+        code = 0
+        try:
+            for signum in self.SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            # until the worker installs its handler, e.g. while starting
+            for signum in self.FORWARDED:
+                signal.signal(signum, signal.SIG_IGN)
+            self.target(index)
+        except Exception:
+            self.log.critical("Worker {} failed.".format(index),
+                              exc_info=True)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        """Forward the signal to all workers and stop restarting them."""
+        self.running = False
+        self._forward(signum, frame)
+
+    def _forward(self, signum, frame):
+        """Forward the signal to all workers."""
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass